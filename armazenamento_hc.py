@@ -0,0 +1,1604 @@
+# armazenamento_hc.py
+# ---------------------------------------------------------------
+# Camada de banco do cadastro_hc.py: pool de conexões, migrações do schema, a
+# interface `Armazenamento` e os backends SQL Server (módulo DB + pyodbc) e SQLite.
+# Não depende do Streamlit: o app escolhe o backend (DB_BACKEND), liga os pools e
+# cuida de cache/invalidação; aqui fica o SQL.
+# ---------------------------------------------------------------
+
+import abc
+import contextvars
+import functools
+import inspect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Driver e utilitários de conexão SQL Server (opcionais com DB_BACKEND=sqlite)
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+try:
+    from DB import get_conn, test_connection, get_config
+except ImportError:
+    get_conn = test_connection = get_config = None
+try:
+    # opcional: conexão só de leitura (ex.: réplica com ApplicationIntent=ReadOnly)
+    from DB import get_read_conn
+except ImportError:
+    get_read_conn = None
+
+# Status de presença ('' = sem lançamento); os mesmos da semente de status_presenca
+# nas migrações (colunas do relatório agregado)
+STATUS_OPCOES = ["", "PRESENTE", "BH", "ATRASADO", "FALTA"]
+
+# ------------------------------
+# Pool de conexões (compartilhado entre sessões)
+# ------------------------------
+# Cada get_conn() paga um handshake ODBC/TLS completo. O pool guarda conexões
+# abertas e as reaproveita entre reruns e sessões do Streamlit.
+class PoolConexoes:
+    """
+    Pool limitado de conexões DB-API (pyodbc ou sqlite3, conforme o backend):
+    - no máximo `tamanho_max` conexões em uso ao mesmo tempo (as demais threads esperam);
+    - conexões ociosas há mais de `ociosa_max_s` são fechadas;
+    - no checkout, conexões paradas há mais de `checagem_s` passam por um SELECT 1;
+    - cada conexão é usada por uma única thread por vez; chamadas aninhadas na mesma
+      thread reaproveitam a conexão (e a transação) da chamada externa.
+    """
+
+    def __init__(self, fabrica, tamanho_max: int, ociosa_max_s: float,
+                 checagem_s: float, espera_s: float):
+        self._fabrica = fabrica
+        self.tamanho_max = tamanho_max
+        self._vagas = threading.BoundedSemaphore(tamanho_max)
+        self._livres: List[Tuple[object, float]] = []  # (conexão, momento da devolução)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.ociosa_max_s = ociosa_max_s
+        self.checagem_s = checagem_s
+        self.espera_s = espera_s
+
+    @staticmethod
+    def _fechar(cn):
+        try:
+            cn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _saudavel(cn) -> bool:
+        try:
+            cur = cn.cursor()
+            cur.execute("SELECT 1").fetchone()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    def _despejar_ociosas(self):
+        # chamado com self._lock adquirido
+        agora = time.monotonic()
+        vencidas = [cn for cn, t in self._livres if agora - t > self.ociosa_max_s]
+        self._livres = [(cn, t) for cn, t in self._livres if agora - t <= self.ociosa_max_s]
+        for cn in vencidas:
+            self._fechar(cn)
+
+    def obter(self):
+        if not self._vagas.acquire(timeout=self.espera_s):
+            raise TimeoutError("Pool de conexões esgotado: nenhuma conexão livre a tempo.")
+        try:
+            while True:
+                with self._lock:
+                    self._despejar_ociosas()
+                    item = self._livres.pop() if self._livres else None
+                if item is None:
+                    return self._fabrica()
+                cn, devolvida_em = item
+                if time.monotonic() - devolvida_em < self.checagem_s or self._saudavel(cn):
+                    return cn
+                self._fechar(cn)
+        except BaseException:
+            self._vagas.release()
+            raise
+
+    def devolver(self, cn, descartar: bool = False):
+        try:
+            if descartar:
+                self._fechar(cn)
+            else:
+                with self._lock:
+                    self._livres.append((cn, time.monotonic()))
+                    self._despejar_ociosas()
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        atual = getattr(self._local, "cn", None)
+        if atual is not None:
+            # chamada aninhada: mesma conexão/transação; quem abriu faz commit
+            yield atual
+            return
+
+        cn = self.obter()
+        self._local.cn = cn
+        descartar = False
+        try:
+            yield cn
+            cn.commit()
+        except BaseException:
+            try:
+                cn.rollback()
+            except Exception:
+                descartar = True  # conexão quebrada: não volta para o pool
+            raise
+        finally:
+            self._local.cn = None
+            self.devolver(cn, descartar)
+
+    def em_uso_nesta_thread(self) -> bool:
+        """A thread já está dentro de um `with conexao()` deste pool (ou de um `substituir`)."""
+        return getattr(self._local, "cn", None) is not None
+
+    @contextmanager
+    def substituir(self, cn_envolvida):
+        # dentro de um `with conexao()`: as chamadas aninhadas passam a receber `cn_envolvida`
+        anterior = getattr(self._local, "cn", None)
+        substituida = getattr(self._local, "substituida", False)
+        self._local.cn = cn_envolvida
+        self._local.substituida = True
+        try:
+            yield cn_envolvida
+        finally:
+            self._local.cn = anterior
+            self._local.substituida = substituida
+
+    def substituida_nesta_thread(self) -> bool:
+        """Há um `substituir` ativo nesta thread (ex.: captura de planos)."""
+        return getattr(self._local, "substituida", False)
+
+    def fechar_todas(self):
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for cn, _ in livres:
+            self._fechar(cn)
+
+# ------------------------------
+# Banco - Schema versionado (SQL Server e SQLite)
+# ------------------------------
+# Cada migração roda uma única vez por banco, em ordem de versão, e fica registrada
+# em dbo.schema_versao. Para mudar o schema, acrescente um item ao final da lista
+# (nunca altere uma migração já aplicada). Cada comando é enviado como um batch.
+# O SQL das migrações é literal (nada de STATUS_OPCOES etc. interpolado): uma migração
+# aplicada não pode mudar de conteúdo quando uma constante do código muda.
+MIGRACOES: List[Tuple[int, str, List[str]]] = [
+    (1, "tabelas iniciais (leaders, colaboradores, presencas)", [
+        """
+        IF OBJECT_ID('dbo.leaders', 'U') IS NULL
+        CREATE TABLE dbo.leaders (
+            id         INT IDENTITY(1,1) PRIMARY KEY,
+            nome       NVARCHAR(200) NOT NULL,
+            setor      NVARCHAR(100) NOT NULL,
+            turno      NVARCHAR(20)  NOT NULL,
+            created_at DATETIME2      DEFAULT SYSDATETIME()
+        );
+        """,
+        """
+        IF OBJECT_ID('dbo.colaboradores', 'U') IS NULL
+        CREATE TABLE dbo.colaboradores (
+            id         INT IDENTITY(1,1) PRIMARY KEY,
+            nome       NVARCHAR(200) NOT NULL,
+            setor      NVARCHAR(100) NOT NULL,
+            turno      NVARCHAR(20)  NOT NULL,
+            ativo      BIT           DEFAULT 1,
+            created_at DATETIME2      DEFAULT SYSDATETIME()
+        );
+        """,
+        # presencas (unique em colaborador_id+data)
+        """
+        IF OBJECT_ID('dbo.presencas', 'U') IS NULL
+        CREATE TABLE dbo.presencas (
+            id             INT IDENTITY(1,1) PRIMARY KEY,
+            colaborador_id INT         NOT NULL,
+            data           DATE        NOT NULL,
+            status         NVARCHAR(20) NULL,
+            setor          NVARCHAR(100) NOT NULL,
+            turno          NVARCHAR(20)  NOT NULL,
+            leader_nome    NVARCHAR(200) NULL,
+            created_at     DATETIME2      DEFAULT SYSDATETIME(),
+            updated_at     DATETIME2      NULL,
+            CONSTRAINT UQ_presenca UNIQUE (colaborador_id, data),
+            CONSTRAINT FK_presenca_colab FOREIGN KEY (colaborador_id) REFERENCES dbo.colaboradores(id)
+        );
+        """,
+    ]),
+    (2, "índices de apoio às consultas de presenças e colaboradores", [
+        # Relatórios / exportação do dia: WHERE data BETWEEN (ou =) + setor + turno
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                        WHERE name = 'IX_presencas_data_setor_turno' AND object_id = OBJECT_ID('dbo.presencas'))
+        CREATE NONCLUSTERED INDEX IX_presencas_data_setor_turno
+            ON dbo.presencas (data, setor, turno)
+            INCLUDE (colaborador_id, status, leader_nome);
+        """,
+        # quadro por setor/turno/ativo
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                        WHERE name = 'IX_colaboradores_setor_turno_ativo' AND object_id = OBJECT_ID('dbo.colaboradores'))
+        CREATE NONCLUSTERED INDEX IX_colaboradores_setor_turno_ativo
+            ON dbo.colaboradores (setor, turno, ativo)
+            INCLUDE (nome);
+        """,
+        # importador / seed: casamento por nome + setor
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                        WHERE name = 'IX_colaboradores_nome_setor' AND object_id = OBJECT_ID('dbo.colaboradores'))
+        CREATE NONCLUSTERED INDEX IX_colaboradores_nome_setor
+            ON dbo.colaboradores (nome, setor)
+            INCLUDE (turno, ativo);
+        """,
+    ]),
+    (3, "presencas compacta: status/setor/turno como chaves TINYINT e leader como FK", [
+        # a tabela passa a ser dbo.presencas_registro; dbo.presencas vira uma view com as
+        # colunas de antes (status/setor/turno/leader_nome em texto), para quem já lê dela
+        "EXEC sp_rename N'dbo.presencas', N'presencas_registro';",
+        """
+        CREATE TABLE dbo.status_presenca (
+            id   TINYINT IDENTITY(1,1) PRIMARY KEY,
+            nome NVARCHAR(20) NOT NULL CONSTRAINT UQ_status_presenca_nome UNIQUE
+        );
+        CREATE TABLE dbo.setores (
+            id   TINYINT IDENTITY(1,1) PRIMARY KEY,
+            nome NVARCHAR(100) NOT NULL CONSTRAINT UQ_setores_nome UNIQUE
+        );
+        CREATE TABLE dbo.turnos (
+            id   TINYINT IDENTITY(1,1) PRIMARY KEY,
+            nome NVARCHAR(20) NOT NULL CONSTRAINT UQ_turnos_nome UNIQUE
+        );
+        """,
+        # valores conhecidos + o que já existir gravado; "-" = turno "Todos" no lançamento
+        """
+        INSERT INTO dbo.status_presenca (nome) VALUES (N'PRESENTE'), (N'BH'), (N'ATRASADO'), (N'FALTA');
+        INSERT INTO dbo.setores (nome) VALUES (N'Aviamento'), (N'Tecido'), (N'Distribuição'), (N'Almoxarifado'),
+                                              (N'PAF'), (N'Recebimento'), (N'Expedição'), (N'E-commerce');
+        INSERT INTO dbo.turnos (nome) VALUES (N'1°'), (N'2°'), (N'3°'), (N'ÚNICO'), (N'INTERMEDIARIO'), (N'-');
+        INSERT INTO dbo.status_presenca (nome)
+            SELECT DISTINCT p.status FROM dbo.presencas_registro p
+             WHERE ISNULL(p.status, '') <> ''
+               AND NOT EXISTS (SELECT 1 FROM dbo.status_presenca d WHERE d.nome = p.status);
+        INSERT INTO dbo.setores (nome)
+            SELECT DISTINCT p.setor FROM dbo.presencas_registro p
+             WHERE NOT EXISTS (SELECT 1 FROM dbo.setores d WHERE d.nome = p.setor);
+        INSERT INTO dbo.turnos (nome)
+            SELECT DISTINCT p.turno FROM dbo.presencas_registro p
+             WHERE NOT EXISTS (SELECT 1 FROM dbo.turnos d WHERE d.nome = p.turno);
+        INSERT INTO dbo.leaders (nome, setor, turno)
+            SELECT DISTINCT p.leader_nome, p.setor, p.turno FROM dbo.presencas_registro p
+             WHERE ISNULL(p.leader_nome, '') <> ''
+               AND NOT EXISTS (SELECT 1 FROM dbo.leaders l
+                                WHERE l.nome = p.leader_nome AND l.setor = p.setor AND l.turno = p.turno);
+        """,
+        "ALTER TABLE dbo.presencas_registro ADD status_id TINYINT NULL, setor_id TINYINT NULL, "
+        "turno_id TINYINT NULL, leader_id INT NULL;",
+        """
+        UPDATE p SET status_id = sp.id, setor_id = se.id, turno_id = tu.id, leader_id = l.id
+          FROM dbo.presencas_registro p
+          JOIN dbo.setores se ON se.nome = p.setor
+          JOIN dbo.turnos  tu ON tu.nome = p.turno
+          LEFT JOIN dbo.status_presenca sp ON sp.nome = p.status
+          OUTER APPLY (SELECT TOP 1 id FROM dbo.leaders l
+                        WHERE l.nome = p.leader_nome AND l.setor = p.setor AND l.turno = p.turno
+                        ORDER BY id) l;
+        """,
+        # DROP COLUMN só marca as colunas nos metadados (rápido); o espaço volta com
+        # ALTER TABLE dbo.presencas_registro REBUILD, que prende a tabela inteira: fica para
+        # o DBA rodar numa janela de manutenção, fora da subida do app
+        """
+        DROP INDEX IF EXISTS IX_presencas_data_setor_turno ON dbo.presencas_registro;
+        ALTER TABLE dbo.presencas_registro DROP COLUMN status, setor, turno, leader_nome;
+        ALTER TABLE dbo.presencas_registro ALTER COLUMN setor_id TINYINT NOT NULL;
+        ALTER TABLE dbo.presencas_registro ALTER COLUMN turno_id TINYINT NOT NULL;
+        """,
+        """
+        ALTER TABLE dbo.presencas_registro ADD
+            CONSTRAINT FK_presenca_status FOREIGN KEY (status_id) REFERENCES dbo.status_presenca(id),
+            CONSTRAINT FK_presenca_setor  FOREIGN KEY (setor_id)  REFERENCES dbo.setores(id),
+            CONSTRAINT FK_presenca_turno  FOREIGN KEY (turno_id)  REFERENCES dbo.turnos(id),
+            CONSTRAINT FK_presenca_leader FOREIGN KEY (leader_id) REFERENCES dbo.leaders(id);
+        """,
+        """
+        CREATE NONCLUSTERED INDEX IX_presencas_data_setor_turno
+            ON dbo.presencas_registro (data, setor_id, turno_id)
+            INCLUDE (colaborador_id, status_id, leader_id);
+        """,
+        # compatibilidade: mesmo nome e mesmas colunas da tabela antiga (só leitura)
+        """
+        CREATE VIEW dbo.presencas AS
+        SELECT p.id, p.colaborador_id, p.data,
+               sp.nome AS status, se.nome AS setor, tu.nome AS turno, l.nome AS leader_nome,
+               p.created_at, p.updated_at
+          FROM dbo.presencas_registro p
+          JOIN dbo.setores se ON se.id = p.setor_id
+          JOIN dbo.turnos  tu ON tu.id = p.turno_id
+          LEFT JOIN dbo.status_presenca sp ON sp.id = p.status_id
+          LEFT JOIN dbo.leaders l ON l.id = p.leader_id;
+        """,
+        # o que o app lê: nomes de sempre + as chaves
+        """
+        CREATE VIEW dbo.vw_presencas AS
+        SELECT p.id, p.colaborador_id, p.data,
+               sp.nome AS status, se.nome AS setor, tu.nome AS turno, l.nome AS leader_nome,
+               p.status_id, p.setor_id, p.turno_id, p.leader_id, p.created_at, p.updated_at
+          FROM dbo.presencas_registro p
+          JOIN dbo.setores se ON se.id = p.setor_id
+          JOIN dbo.turnos  tu ON tu.id = p.turno_id
+          LEFT JOIN dbo.status_presenca sp ON sp.id = p.status_id
+          LEFT JOIN dbo.leaders l ON l.id = p.leader_id;
+        """,
+    ]),
+    (4, "colaboradores.eh_terceiro (coluna computada persistida) + índice do quadro", [
+        # mesmo critério do filtro da tela: nome termina com "- terceiro" (com ou sem espaços)
+        """
+        ALTER TABLE dbo.colaboradores ADD eh_terceiro AS CAST(
+            CASE WHEN LEN(nome) < 9 THEN 0
+                 WHEN LOWER(RIGHT(RTRIM(nome), 8)) <> N'terceiro' THEN 0
+                 WHEN RIGHT(RTRIM(LEFT(nome, LEN(nome) - 8)), 1) = N'-' THEN 1
+                 ELSE 0
+            END AS BIT) PERSISTED;
+        """,
+        """
+        DROP INDEX IF EXISTS IX_colaboradores_setor_turno_ativo ON dbo.colaboradores;
+        CREATE NONCLUSTERED INDEX IX_colaboradores_setor_turno_ativo
+            ON dbo.colaboradores (setor, turno, ativo, eh_terceiro)
+            INCLUDE (nome);
+        """,
+    ]),
+    (5, "versao_dados: marca d'água de escrita compartilhada entre réplicas", [
+        """
+        CREATE TABLE dbo.versao_dados (
+            tabela NVARCHAR(50) NOT NULL PRIMARY KEY,
+            versao BIGINT       NOT NULL DEFAULT 0
+        );
+        """,
+        "INSERT INTO dbo.versao_dados (tabela) VALUES (N'colaboradores'), (N'presencas');",
+    ]),
+    (6, "presencas.versao (rowversion): salvamentos concorrentes detectam alterações perdidas", [
+        "ALTER TABLE dbo.presencas_registro ADD versao ROWVERSION;",
+        "DROP VIEW dbo.vw_presencas;",
+        # BIGINT: o pandas/JSON não lidam com binary(8); a ordem é a mesma do rowversion
+        """
+        CREATE VIEW dbo.vw_presencas AS
+        SELECT p.id, p.colaborador_id, p.data,
+               sp.nome AS status, se.nome AS setor, tu.nome AS turno, l.nome AS leader_nome,
+               p.status_id, p.setor_id, p.turno_id, p.leader_id, p.created_at, p.updated_at,
+               CAST(p.versao AS BIGINT) AS versao
+          FROM dbo.presencas_registro p
+          JOIN dbo.setores se ON se.id = p.setor_id
+          JOIN dbo.turnos  tu ON tu.id = p.turno_id
+          LEFT JOIN dbo.status_presenca sp ON sp.id = p.status_id
+          LEFT JOIN dbo.leaders l ON l.id = p.leader_id;
+        """,
+    ]),
+]
+
+# SQLite (DB_BACKEND=sqlite): bancos novos já nascem no formato do SQL Server (versão 1
+# = versões 1–4 acima); a numeração é própria e segue a mesma regra de só acrescentar.
+# Sem leitores da forma antiga para preservar, a tabela continua `presencas` (no SQL
+# Server, presencas_registro + a view de compatibilidade dbo.presencas).
+_TEXTO = "TEXT NOT NULL COLLATE NOCASE"
+_AGORA = "DEFAULT (datetime('now', 'localtime'))"
+
+MIGRACOES_SQLITE: List[Tuple[int, str, List[str]]] = [
+    (1, "schema inicial (equivalente às versões 1–4 do SQL Server)", [
+        f"""
+        CREATE TABLE leaders (
+            id         INTEGER PRIMARY KEY,
+            nome       {_TEXTO},
+            setor      {_TEXTO},
+            turno      {_TEXTO},
+            created_at TEXT {_AGORA}
+        )
+        """,
+        # eh_terceiro: mesmo critério da coluna computada do SQL Server
+        f"""
+        CREATE TABLE colaboradores (
+            id          INTEGER PRIMARY KEY,
+            nome        {_TEXTO},
+            setor       {_TEXTO},
+            turno       {_TEXTO},
+            ativo       INTEGER DEFAULT 1,
+            created_at  TEXT {_AGORA},
+            eh_terceiro INTEGER GENERATED ALWAYS AS (
+                CASE WHEN lower(rtrim(nome)) NOT LIKE '%terceiro' THEN 0
+                     WHEN substr(rtrim(substr(rtrim(nome), 1, length(rtrim(nome)) - 8)), -1) = '-' THEN 1
+                     ELSE 0
+                END) STORED
+        )
+        """,
+        f"CREATE TABLE status_presenca (id INTEGER PRIMARY KEY, nome {_TEXTO} UNIQUE)",
+        f"CREATE TABLE setores (id INTEGER PRIMARY KEY, nome {_TEXTO} UNIQUE)",
+        f"CREATE TABLE turnos (id INTEGER PRIMARY KEY, nome {_TEXTO} UNIQUE)",
+        "INSERT INTO status_presenca (nome) VALUES ('PRESENTE'), ('BH'), ('ATRASADO'), ('FALTA')",
+        "INSERT INTO setores (nome) VALUES ('Aviamento'), ('Tecido'), ('Distribuição'), ('Almoxarifado'), "
+        "('PAF'), ('Recebimento'), ('Expedição'), ('E-commerce')",
+        # "-" = turno "Todos" no lançamento
+        "INSERT INTO turnos (nome) VALUES ('1°'), ('2°'), ('3°'), ('ÚNICO'), ('INTERMEDIARIO'), ('-')",
+        f"""
+        CREATE TABLE presencas (
+            id             INTEGER PRIMARY KEY,
+            colaborador_id INTEGER NOT NULL REFERENCES colaboradores(id),
+            data           TEXT    NOT NULL,
+            status_id      INTEGER NULL REFERENCES status_presenca(id),
+            setor_id       INTEGER NOT NULL REFERENCES setores(id),
+            turno_id       INTEGER NOT NULL REFERENCES turnos(id),
+            leader_id      INTEGER NULL REFERENCES leaders(id),
+            created_at     TEXT {_AGORA},
+            updated_at     TEXT NULL,
+            CONSTRAINT UQ_presenca UNIQUE (colaborador_id, data)
+        )
+        """,
+        # sem INCLUDE no SQLite: as colunas lidas entram na chave (índice de cobertura)
+        "CREATE INDEX IX_presencas_data_setor_turno ON presencas (data, setor_id, turno_id, colaborador_id, status_id)",
+        "CREATE INDEX IX_colaboradores_setor_turno_ativo ON colaboradores (setor, turno, ativo, eh_terceiro, nome)",
+        "CREATE INDEX IX_colaboradores_nome_setor ON colaboradores (nome, setor, turno, ativo)",
+        """
+        CREATE VIEW vw_presencas AS
+        SELECT p.id, p.colaborador_id, p.data,
+               sp.nome AS status, se.nome AS setor, tu.nome AS turno, l.nome AS leader_nome,
+               p.status_id, p.setor_id, p.turno_id, p.leader_id, p.created_at, p.updated_at
+          FROM presencas p
+          JOIN setores se ON se.id = p.setor_id
+          JOIN turnos  tu ON tu.id = p.turno_id
+          LEFT JOIN status_presenca sp ON sp.id = p.status_id
+          LEFT JOIN leaders l ON l.id = p.leader_id
+        """,
+    ]),
+    (2, "versao_dados (equivalente à versão 5 do SQL Server)", [
+        "CREATE TABLE versao_dados (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0)",
+        "INSERT INTO versao_dados (tabela) VALUES ('colaboradores'), ('presencas')",
+    ]),
+    # sem rowversion no SQLite: um contador único (presencas_versao) numera cada gravação
+    (3, "presencas.versao (equivalente à versão 6 do SQL Server)", [
+        "ALTER TABLE presencas ADD COLUMN versao INTEGER NOT NULL DEFAULT 1",
+        "CREATE TABLE presencas_versao (id INTEGER PRIMARY KEY CHECK (id = 1), ultima INTEGER NOT NULL)",
+        "INSERT INTO presencas_versao (id, ultima) VALUES (1, 1)",
+        "DROP VIEW vw_presencas",
+        """
+        CREATE VIEW vw_presencas AS
+        SELECT p.id, p.colaborador_id, p.data,
+               sp.nome AS status, se.nome AS setor, tu.nome AS turno, l.nome AS leader_nome,
+               p.status_id, p.setor_id, p.turno_id, p.leader_id, p.created_at, p.updated_at, p.versao
+          FROM presencas p
+          JOIN setores se ON se.id = p.setor_id
+          JOIN turnos  tu ON tu.id = p.turno_id
+          LEFT JOIN status_presenca sp ON sp.id = p.status_id
+          LEFT JOIN leaders l ON l.id = p.leader_id
+        """,
+    ]),
+]
+
+# sqlite3: datas viajam como texto ISO; inteiros numpy (ids vindos do pandas) como int
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.bool_, bool)
+
+# Conjuntos de ids vão como UM parâmetro JSON (OPENJSON / json_each): o texto da consulta
+# é sempre o mesmo (um único plano em cache) e não há limite de parâmetros do IN (?,?,...).
+SQL_IDS_JSON = "OPENJSON(?) WITH (id INT '$')"
+
+def _ids_json(ids) -> str:
+    return json.dumps([int(i) for i in ids])
+
+# Versão esperada de cada célula gravada (a lida na hidratação): 0 = célula vazia na leitura;
+# VERSAO_QUALQUER = grava sem conferir (última escrita vence).
+VERSAO_QUALQUER = -1
+
+def _com_versao(linhas) -> List[tuple]:
+    return [(c, d, s, int(v[0]) if v else VERSAO_QUALQUER) for c, d, s, *v in linhas]
+
+# --- Consultas de relatório --------------------------------------------------
+def _filtros_relatorio(dt_ini: date, dt_fim: date, setor: str | None, turno: str | None) -> Tuple[str, list]:
+    where = "p.data BETWEEN ? AND ?"
+    params: list = [dt_ini, dt_fim]
+    if setor and setor != "Todos":
+        where += " AND p.setor = ?"
+        params.append(setor)
+    if turno and turno != "Todos":
+        where += " AND p.turno = ?"
+        params.append(turno)
+    return where, params
+
+def _condicao_apos(colunas_sql: List[str]) -> str:
+    # (a, b, c) > (?, ?, ?)  ->  a > ? OR (a = ? AND (b > ? OR (b = ? AND c > ?)))
+    col = colunas_sql[0]
+    if len(colunas_sql) == 1:
+        return f"{col} > ?"
+    return f"({col} > ? OR ({col} = ? AND {_condicao_apos(colunas_sql[1:])}))"
+
+def _params_apos(valores: list) -> list:
+    if len(valores) == 1:
+        return [valores[0]]
+    return [valores[0], valores[0], *_params_apos(valores[1:])]
+
+def _ler_sql(sql: str, cn, params=None) -> pd.DataFrame:
+    # pd.read_sql avisa a cada chamada quando a conexão não é sqlite3/SQLAlchemy (pyodbc, e
+    # a conexão medida do app): funciona igual, então o aviso é silenciado só aqui
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy", category=UserWarning)
+        return pd.read_sql(sql, cn, params=params)
+
+# --- Rótulo das consultas ----------------------------------------------------
+# Cada método público de um backend marca as consultas que faz com o próprio nome; a
+# instrumentação do app lê ROTULO_CONSULTA ao medir um comando ("chamador"). Vale para o
+# contexto (thread) atual e volta ao anterior quando o método termina.
+ROTULO_CONSULTA: contextvars.ContextVar[str] = contextvars.ContextVar("rotulo_consulta", default="?")
+
+def _rotulado(func):
+    nome = func.__name__
+    if inspect.isgeneratorfunction(func):
+        # geradores (iterar_*): o rótulo vale a cada passo, não só na criação
+        @functools.wraps(func)
+        def _gerador(*args, **kwargs):
+            gerador = func(*args, **kwargs)
+            try:
+                while True:
+                    token = ROTULO_CONSULTA.set(nome)
+                    try:
+                        item = next(gerador)
+                    except StopIteration:
+                        return
+                    finally:
+                        ROTULO_CONSULTA.reset(token)
+                    yield item
+            finally:
+                gerador.close()
+        return _gerador
+
+    @functools.wraps(func)
+    def _funcao(*args, **kwargs):
+        token = ROTULO_CONSULTA.set(nome)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ROTULO_CONSULTA.reset(token)
+    return _funcao
+
+def _rotular_metodos(cls):
+    for nome, valor in list(vars(cls).items()):
+        if (not nome.startswith("_") and inspect.isfunction(valor)
+                and not getattr(valor, "__isabstractmethod__", False)):
+            setattr(cls, nome, _rotulado(valor))
+
+class Armazenamento(abc.ABC):
+    """
+    Operações de banco da aplicação. Cada método abre a própria conexão com `conexao()`
+    (pool + transação) e troca apenas tipos Python/pandas com quem chama: datas como
+    `date` e DataFrames com as mesmas colunas nos dois backends. Quem cria o backend
+    liga os pools (`usar_pools`), com fábricas que chamam `conectar`/`conectar_leitura`.
+    Os métodos públicos rotulam as próprias consultas (ROTULO_CONSULTA).
+    """
+    nome = ""
+    rotulo = ""
+    suporta_planos = False  # planos reais (SET STATISTICS XML) na página DB
+    pool: PoolConexoes | None = None
+    pool_leitura: PoolConexoes | None = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _rotular_metodos(cls)
+
+    def usar_pools(self, pool: PoolConexoes, pool_leitura: PoolConexoes):
+        self.pool, self.pool_leitura = pool, pool_leitura
+
+    def conexao(self):
+        """
+        Uso: `with arm.conexao() as cn: ...`
+        Commit ao sair sem erro, rollback em caso de exceção; a conexão volta ao pool.
+        """
+        return self.pool.conexao()
+
+    def conexao_leitura(self):
+        """Como `conexao()`, mas no pool de leitura (relatórios e exportações; só SELECT)."""
+        return self.pool_leitura.conexao()
+
+    def _iterar_em_lotes(self, sql: str, params: list, lote: int):
+        # conexão de leitura: a consulta inteira é uma foto só (SNAPSHOT), sem segurar travas
+        with self.conexao_leitura() as cn:
+            cur = cn.cursor()
+            cur.execute(sql, params)
+            colunas = [d[0] for d in cur.description]
+            while True:
+                linhas = cur.fetchmany(lote)
+                if not linhas:
+                    break
+                yield pd.DataFrame.from_records([tuple(r) for r in linhas], columns=colunas)
+            cur.close()
+
+    @abc.abstractmethod
+    def conectar(self):
+        """Nova conexão DB-API (usada como fábrica do pool)."""
+
+    def conectar_leitura(self):
+        """Nova conexão do pool de leitura (relatórios/exportações)."""
+        return self.conectar()
+
+    def estado_leitura(self) -> List[Tuple[str, str]]:
+        """Pares (rótulo, valor) do perfil de leitura, exibidos na página DB."""
+        return []
+
+    @abc.abstractmethod
+    def configuracao(self) -> List[Tuple[str, str]]:
+        """Pares (rótulo, valor) exibidos na página DB."""
+
+    def testar_conexao(self) -> bool:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("SELECT 1").fetchone()
+            cur.close()
+        return True
+
+    @abc.abstractmethod
+    def identidade(self) -> str:
+        """Identifica o banco (escopo das chaves do cache compartilhado do host)."""
+
+    @abc.abstractmethod
+    def aplicar_migracoes(self, cn) -> int:
+        """Aplica as migrações pendentes e devolve a versão final do schema."""
+
+    @staticmethod
+    def _aplicar_pendentes(cur, migracoes, aplicadas, sql_registro: str) -> int:
+        for versao, descricao, comandos in sorted(migracoes, key=lambda m: m[0]):
+            if versao in aplicadas:
+                continue
+            for sql in comandos:
+                cur.execute(sql)
+            cur.execute(sql_registro, (versao, descricao))
+        return max(m[0] for m in migracoes)
+
+    # --- marca d'água de escrita (versao_dados) ---
+    @abc.abstractmethod
+    def versoes_dados(self) -> Dict[str, int]:
+        ...
+
+    @abc.abstractmethod
+    def incrementar_versao(self, tabela: str):
+        ...
+
+    # --- dimensões ---
+    @abc.abstractmethod
+    def criar_leader(self, nome: str, setor: str, turno: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def criar_dimensao(self, tabela: str, nome: str) -> int:
+        ...
+
+    # --- colaboradores ---
+    @abc.abstractmethod
+    def carregar_quadro(self) -> pd.DataFrame:
+        """Todos os colaboradores: id, nome, setor, turno, ativo, eh_terceiro (ordem de id)."""
+
+    @abc.abstractmethod
+    def adicionar_colaborador(self, nome: str, setor: str, turno: str):
+        ...
+
+    @abc.abstractmethod
+    def atualizar_turno_colaborador(self, colab_id: int, turno: str):
+        ...
+
+    @abc.abstractmethod
+    def upsert_colaborador_turno(self, nome: str, setor: str, turno: str):
+        ...
+
+    @abc.abstractmethod
+    def atualizar_ativo_colaboradores(self, ids_para_inativar: List[int], ids_para_ativar: List[int]):
+        ...
+
+    @abc.abstractmethod
+    def inserir_colaboradores(self, linhas: List[tuple]) -> int:
+        """Insere (nome, setor, turno) que ainda não existem; devolve quantos entraram."""
+
+    @abc.abstractmethod
+    def aplicar_turnos(self, lotes, simular: bool) -> Tuple[int, int, int, int]:
+        """Upsert por nome+setor; devolve (linhas, inseridos, atualizados, reativados)."""
+
+    # --- presenças ---
+    @abc.abstractmethod
+    def carregar_presencas(self, colab_ids: List[int], inicio: date, fim: date) -> pd.DataFrame:
+        ...
+
+    @abc.abstractmethod
+    def gravar_presencas(self, linhas: List[tuple], setor_id: int, turno_id: int,
+                         leader_id: int | None) -> Tuple[int, List[tuple]]:
+        """
+        (colaborador_id, data, status[, versão esperada]); status '' apaga. Células cuja
+        versão no banco não é a esperada ficam de fora; as que também têm outro status
+        voltam como conflito. Devolve (linhas afetadas, [(colaborador_id, data,
+        status_atual, status_tentado, versao_atual)]).
+        """
+
+    # --- relatórios / exportação ---
+    @abc.abstractmethod
+    def relatorio_agregado(self, dt_ini: date, dt_fim: date, setor: str | None,
+                           turno: str | None) -> pd.DataFrame:
+        ...
+
+    @abc.abstractmethod
+    def relatorio_detalhe_pagina(self, dt_ini: date, dt_fim: date, setor: str | None,
+                                 turno: str | None, apos: tuple | None, limite: int) -> pd.DataFrame:
+        ...
+
+    @abc.abstractmethod
+    def iterar_relatorio(self, dt_ini: date, dt_fim: date, setor: str | None,
+                         turno: str | None, lote: int):
+        ...
+
+    @abc.abstractmethod
+    def ordem_setores_turnos(self) -> pd.DataFrame:
+        """(setor, turno, ordem): posição de cada par no ORDER BY setor, turno dos relatórios."""
+
+    @abc.abstractmethod
+    def ordem_colaboradores(self) -> pd.DataFrame:
+        """(nome, ordem): posição de cada nome no ORDER BY do relatório (empates = mesma ordem)."""
+
+    @abc.abstractmethod
+    def iterar_dia(self, setor: str, dia: date, lote: int):
+        ...
+
+_rotular_metodos(Armazenamento)  # os concretos daqui (testar_conexao etc.); subclasses: __init_subclass__
+
+def _colunas_status_sql() -> str:
+    return ",\n               ".join(
+        f"SUM(CASE WHEN p.status = '{s}' THEN 1 ELSE 0 END) AS [{s}]" for s in STATUS_OPCOES if s
+    )
+
+# --- SQL Server ---------------------------------------------------------------
+# colunas de texto da #tabela no collation do banco: sem isso ficam no do tempdb (o do
+# servidor) e a junção com as tabelas do app falha (Msg 468) quando os dois diferem
+_RE_TIPO_TEXTO = re.compile(r"^(N?(?:VAR)?CHAR\s*\([^)]*\))", re.IGNORECASE)
+
+def _tipo_staging(tipo: str) -> str:
+    return _RE_TIPO_TEXTO.sub(r"\1 COLLATE DATABASE_DEFAULT", tipo)
+
+def _criar_staging(cur, tabela: str, colunas: List[Tuple[str, str]], chave: str | None = None):
+    ddl = ", ".join(f"{nome} {_tipo_staging(tipo)}" for nome, tipo in colunas)
+    if chave:
+        ddl += f", PRIMARY KEY ({chave})"
+    # sem parâmetros -> SQLExecDirect: a #tabela sobrevive ao statement
+    cur.execute(f"IF OBJECT_ID('tempdb..{tabela}') IS NOT NULL DROP TABLE {tabela}; "
+                f"CREATE TABLE {tabela} ({ddl});")
+
+def _inserir_staging(cur, tabela: str, n_colunas: int, linhas: List[tuple]):
+    if not linhas:
+        return
+    marcadores = ", ".join("?" * n_colunas)
+    cur.fast_executemany = True
+    try:
+        cur.executemany(f"INSERT INTO {tabela} VALUES ({marcadores})", linhas)
+    finally:
+        cur.fast_executemany = False
+
+def _carregar_staging(cur, tabela: str, colunas: List[Tuple[str, str]], linhas: List[tuple],
+                      chave: str | None = None):
+    """
+    Cria a tabela temporária `tabela` (#nome) na sessão da conexão e envia todas as
+    linhas num único lote (fast_executemany = um array de parâmetros por round-trip).
+    """
+    _criar_staging(cur, tabela, colunas, chave)
+    _inserir_staging(cur, tabela, len(colunas), linhas)
+
+class ArmazenamentoSqlServer(Armazenamento):
+    nome = "sqlserver"
+    rotulo = "SQL Server"
+    suporta_planos = True
+
+    def __init__(self, isolamento_leitura: str = "snapshot"):
+        self.isolamento_leitura = isolamento_leitura  # snapshot | read_committed
+        self._snapshot: bool | None = None  # ALLOW_SNAPSHOT_ISOLATION, lido na 1ª conexão de leitura
+        self._snapshot_lock = threading.Lock()
+
+    def conectar(self):
+        if get_conn is None:
+            raise RuntimeError("Módulo DB (conexão SQL Server) não encontrado; use DB_BACKEND=sqlite.")
+        return get_conn()
+
+    def conectar_leitura(self):
+        cn = get_read_conn() if get_read_conn is not None else self.conectar()
+        # SNAPSHOT: cada `with self.conexao_leitura()` lê uma foto do commit em que começou, sem
+        # travas compartilhadas. Sem ALLOW_SNAPSHOT_ISOLATION no banco fica READ COMMITTED,
+        # que já não bloqueia se o banco tiver READ_COMMITTED_SNAPSHOT ligado.
+        if self.isolamento_leitura != "snapshot":
+            return cn
+        cur = cn.cursor()
+        with self._snapshot_lock:
+            # uma consulta a sys.databases por pool, não por conexão nova (a opção do banco
+            # é do DBA e só muda com o app reiniciado)
+            if self._snapshot is None:
+                self._snapshot = cur.execute(
+                    "SELECT snapshot_isolation_state FROM sys.databases WHERE name = DB_NAME()").fetchone()[0] == 1
+        if self._snapshot:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL SNAPSHOT")
+        cur.close()
+        cn.commit()
+        return cn
+
+    def estado_leitura(self) -> List[Tuple[str, str]]:
+        with self.conexao_leitura() as cn:
+            cur = cn.cursor()
+            snapshot, rcsi, escrita, isolamento = cur.execute("""
+                SELECT d.snapshot_isolation_state_desc, d.is_read_committed_snapshot_on,
+                       CAST(DATABASEPROPERTYEX(DB_NAME(), 'Updateability') AS NVARCHAR(20)),
+                       s.transaction_isolation_level
+                  FROM sys.databases d
+                  JOIN sys.dm_exec_sessions s ON s.session_id = @@SPID
+                 WHERE d.name = DB_NAME()
+            """).fetchone()
+            cur.close()
+        if isolamento == 5:
+            efetivo = "SNAPSHOT"
+        elif isolamento == 2 and rcsi:
+            efetivo = "READ COMMITTED (snapshot do banco)"
+        else:
+            efetivo = {1: "READ UNCOMMITTED", 2: "READ COMMITTED (com bloqueio)",
+                       3: "REPEATABLE READ", 4: "SERIALIZABLE"}.get(isolamento, str(isolamento))
+        return [
+            ("Conexão de leitura", ("DB.get_read_conn" + (" (somente leitura)" if escrita == "READ_ONLY" else ""))
+             if get_read_conn is not None else "a mesma do lançamento (DB.get_conn)"),
+            ("Isolamento das leituras", efetivo),
+            ("ALLOW_SNAPSHOT_ISOLATION", snapshot),
+            ("READ_COMMITTED_SNAPSHOT", "ON" if rcsi else "OFF"),
+            ("Pool de leitura (conexões)", str(self.pool_leitura.tamanho_max)),
+        ]
+
+    def configuracao(self) -> List[Tuple[str, str]]:
+        cfg = get_config()
+        return [
+            ("Servidor", cfg["SERVER"]),
+            ("Base de Dados", cfg["DATABASE"]),
+            ("Usuário", cfg["UID"]),
+            ("Encrypt", cfg["ENCRYPT"]),
+            ("TrustServerCertificate", cfg["TRUST_CERT"]),
+            ("Timeout (s)", str(cfg["CONNECT_TIMEOUT"])),
+        ]
+
+    def testar_conexao(self) -> bool:
+        return test_connection()
+
+    def identidade(self) -> str:
+        cfg = get_config()
+        return f"sqlserver://{cfg['SERVER']}/{cfg['DATABASE']}"
+
+    def aplicar_migracoes(self, cn) -> int:
+        cur = cn.cursor()
+        # trava exclusiva por banco (liberada no commit): réplicas subindo juntas esperam
+        # aqui em vez de rodar o mesmo DDL em paralelo
+        cur.execute("""
+        SET NOCOUNT ON;
+        DECLARE @r INT;
+        EXEC @r = sp_getapplock @Resource = 'cadastro_hc.schema', @LockMode = 'Exclusive',
+                                @LockOwner = 'Transaction', @LockTimeout = 120000;
+        SELECT @r;
+        """)
+        if cur.fetchone()[0] < 0:
+            raise RuntimeError("Não foi possível obter a trava de migração do schema.")
+
+        cur.execute("""
+        IF OBJECT_ID('dbo.schema_versao', 'U') IS NULL
+        CREATE TABLE dbo.schema_versao (
+            versao      INT           PRIMARY KEY,
+            descricao   NVARCHAR(200) NOT NULL,
+            aplicada_em DATETIME2     DEFAULT SYSDATETIME()
+        );
+        """)
+        aplicadas = {int(r[0]) for r in cur.execute("SELECT versao FROM dbo.schema_versao").fetchall()}
+        versao = self._aplicar_pendentes(cur, MIGRACOES, aplicadas,
+                                         "INSERT INTO dbo.schema_versao (versao, descricao) VALUES (?, ?)")
+        cur.close()
+        return versao
+
+    def versoes_dados(self) -> Dict[str, int]:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("SELECT tabela, versao FROM dbo.versao_dados")
+            versoes = {t: int(v) for t, v in cur.fetchall()}
+            cur.close()
+        return versoes
+
+    def incrementar_versao(self, tabela: str):
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("UPDATE dbo.versao_dados SET versao = versao + 1 WHERE tabela = ?", (tabela,))
+            cur.close()
+
+    def criar_leader(self, nome: str, setor: str, turno: str) -> int:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            # UPDLOCK/HOLDLOCK: duas sessões criando o mesmo leader não duplicam a linha
+            cur.execute("""
+            SET NOCOUNT ON;
+            IF NOT EXISTS (SELECT 1 FROM dbo.leaders WITH (UPDLOCK, HOLDLOCK)
+                            WHERE nome=? AND setor=? AND turno=?)
+                INSERT INTO dbo.leaders (nome, setor, turno) VALUES (?, ?, ?);
+            SELECT MIN(id) FROM dbo.leaders WHERE nome=? AND setor=? AND turno=?;
+            """, (nome, setor, turno) * 3)
+            novo = cur.fetchone()[0]
+            cur.close()
+        return int(novo)
+
+    def criar_dimensao(self, tabela: str, nome: str) -> int:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute(f"""
+            SET NOCOUNT ON;
+            IF NOT EXISTS (SELECT 1 FROM dbo.{tabela} WITH (UPDLOCK, HOLDLOCK) WHERE nome = ?)
+                INSERT INTO dbo.{tabela} (nome) VALUES (?);
+            SELECT id FROM dbo.{tabela} WHERE nome = ?;
+            """, (nome, nome, nome))
+            novo = cur.fetchone()[0]
+            cur.close()
+        return int(novo)
+
+    def carregar_quadro(self) -> pd.DataFrame:
+        with self.conexao() as cn:
+            return _ler_sql("SELECT id, nome, setor, turno, ativo, eh_terceiro FROM dbo.colaboradores ORDER BY id", cn)
+
+    def adicionar_colaborador(self, nome: str, setor: str, turno: str):
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute(
+                "INSERT INTO dbo.colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
+                (nome, setor, turno),
+            )
+            cur.close()
+
+    def atualizar_turno_colaborador(self, colab_id: int, turno: str):
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("UPDATE dbo.colaboradores SET turno=? WHERE id=?", (turno, colab_id))
+            cur.close()
+
+    def upsert_colaborador_turno(self, nome: str, setor: str, turno: str):
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("SELECT id FROM dbo.colaboradores WHERE nome=? AND setor=?", (nome, setor))
+            row = cur.fetchone()
+            if row:
+                cur.execute("UPDATE dbo.colaboradores SET turno=?, ativo=1 WHERE id=?", (turno, int(row[0])))
+            else:
+                cur.execute(
+                    "INSERT INTO dbo.colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
+                    (nome, setor, turno),
+                )
+            cur.close()
+
+    def atualizar_ativo_colaboradores(self, ids_para_inativar: List[int], ids_para_ativar: List[int]):
+        sql = f"""
+        UPDATE c SET ativo = ?
+          FROM dbo.colaboradores c
+          JOIN {SQL_IDS_JSON} AS ids ON ids.id = c.id
+        """
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            if ids_para_inativar:
+                cur.execute(sql, (0, _ids_json(ids_para_inativar)))
+            if ids_para_ativar:
+                cur.execute(sql, (1, _ids_json(ids_para_ativar)))
+            cur.close()
+
+    def inserir_colaboradores(self, linhas: List[tuple]) -> int:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            _carregar_staging(
+                cur, "#colaboradores_stg",
+                [("nome", "NVARCHAR(200) NOT NULL"), ("setor", "NVARCHAR(100) NOT NULL"), ("turno", "NVARCHAR(20) NOT NULL")],
+                linhas,
+            )
+            cur.execute("""
+            SET NOCOUNT ON;
+            DECLARE @n INT;
+            INSERT INTO dbo.colaboradores (nome, setor, turno, ativo)
+            SELECT s.nome, s.setor, s.turno, 1
+              FROM #colaboradores_stg s
+             WHERE NOT EXISTS (SELECT 1 FROM dbo.colaboradores c
+                                WHERE c.nome = s.nome AND c.setor = s.setor AND c.turno = s.turno);
+            SET @n = @@ROWCOUNT;
+            DROP TABLE #colaboradores_stg;
+            SELECT @n;
+            """)
+            inseridos = int(cur.fetchone()[0] or 0)
+            cur.close()
+        return inseridos
+
+    def aplicar_turnos(self, lotes, simular: bool) -> Tuple[int, int, int, int]:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            _criar_staging(
+                cur, "#turnos_stg",
+                [("ordem", "INT NOT NULL"), ("nome", "NVARCHAR(200) NOT NULL"),
+                 ("setor", "NVARCHAR(100) NOT NULL"), ("turno", "NVARCHAR(20) NOT NULL")],
+            )
+            ordem = 0
+            for lote in lotes:
+                linhas = [(ordem + i, n, s, t) for i, (n, s, t) in
+                          enumerate(lote[["nome", "setor", "turno"]].itertuples(index=False, name=None))]
+                ordem += len(linhas)
+                _inserir_staging(cur, "#turnos_stg", 4, linhas)
+
+            # a mesma pessoa repetida no arquivo: vale a última linha (como no upsert linha a linha)
+            cur.execute("""
+            WITH d AS (SELECT ROW_NUMBER() OVER (PARTITION BY nome, setor ORDER BY ordem DESC) AS rn
+                         FROM #turnos_stg)
+            DELETE FROM d WHERE rn > 1;
+            """)
+            cur.execute("""
+            SELECT
+                COUNT(*),
+                SUM(CASE WHEN c.id IS NULL THEN 1 ELSE 0 END),
+                SUM(CASE WHEN c.id IS NOT NULL AND ISNULL(c.ativo, 0) = 1 AND c.turno <> s.turno THEN 1 ELSE 0 END),
+                SUM(CASE WHEN c.id IS NOT NULL AND ISNULL(c.ativo, 0) = 0 THEN 1 ELSE 0 END)
+              FROM #turnos_stg s
+              OUTER APPLY (SELECT TOP 1 id, turno, ativo FROM dbo.colaboradores
+                            WHERE nome = s.nome AND setor = s.setor ORDER BY id) c
+            """)
+            contagens = tuple(int(v or 0) for v in cur.fetchone())
+
+            if not simular and contagens[0]:
+                cur.execute("""
+                MERGE dbo.colaboradores WITH (HOLDLOCK) AS T
+                USING #turnos_stg AS S
+                     ON T.nome = S.nome AND T.setor = S.setor
+                WHEN MATCHED AND (T.turno <> S.turno OR ISNULL(T.ativo, 0) = 0) THEN
+                    UPDATE SET turno = S.turno, ativo = 1
+                WHEN NOT MATCHED BY TARGET THEN
+                    INSERT (nome, setor, turno, ativo) VALUES (S.nome, S.setor, S.turno, 1);
+                """)
+            cur.execute("DROP TABLE #turnos_stg")
+            cur.close()
+        return contagens
+
+    def carregar_presencas(self, colab_ids: List[int], inicio: date, fim: date) -> pd.DataFrame:
+        with self.conexao() as cn:
+            return _ler_sql(
+                f"""
+                SELECT p.colaborador_id, p.data, p.status, p.versao
+                FROM dbo.vw_presencas p
+                JOIN {SQL_IDS_JSON} AS ids ON ids.id = p.colaborador_id
+                WHERE p.data BETWEEN ? AND ?
+                """,
+                cn,
+                params=[_ids_json(colab_ids), inicio, fim],
+            )
+
+    def gravar_presencas(self, linhas: List[tuple], setor_id: int, turno_id: int,
+                         leader_id: int | None) -> Tuple[int, List[tuple]]:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            _carregar_staging(
+                cur, "#presencas_stg",
+                [("colaborador_id", "INT NOT NULL"), ("data", "DATE NOT NULL"), ("status", "NVARCHAR(20) NOT NULL"),
+                 ("versao", "BIGINT NOT NULL")],
+                _com_versao(linhas),
+                chave="colaborador_id, data",
+            )
+            # Tudo numa transação (a do self.conexao()):
+            # 1) um applock por (dia, setor) do lote, em ordem de data (o setor é um só por
+            #    chamada, então a ordem global é (data, setor)): salvamentos concorrentes do
+            #    mesmo dia e setor entram em fila em vez de se travarem (deadlock) no meio do
+            #    MERGE, e setores diferentes gravam o mesmo dia em paralelo;
+            # 2) UPDLOCK+HOLDLOCK na leitura das versões: a chave (ou a faixa, se ainda não
+            #    existe) fica presa até o commit, então nada muda entre conferir e gravar;
+            # 3) fica de fora a célula cuja versão mudou desde a hidratação (vira conflito se
+            #    o status atual difere do desejado); o resto vai num único MERGE.
+            cur.execute("""
+            SET NOCOUNT ON;
+            DECLARE @n INT, @d DATE, @r INT, @recurso NVARCHAR(255), @setor INT = ?;
+            DECLARE dias CURSOR LOCAL FAST_FORWARD FOR
+                SELECT DISTINCT data FROM #presencas_stg ORDER BY data;
+            OPEN dias;
+            FETCH NEXT FROM dias INTO @d;
+            WHILE @@FETCH_STATUS = 0
+            BEGIN
+                SET @recurso = N'cadastro_hc.presencas.' + CONVERT(NCHAR(10), @d, 23)
+                             + N'.' + CONVERT(NVARCHAR(12), @setor);
+                EXEC @r = sp_getapplock @Resource = @recurso, @LockMode = 'Exclusive',
+                                        @LockOwner = 'Transaction', @LockTimeout = 30000;
+                IF @r < 0
+                    THROW 50001, N'Tempo esgotado esperando outro salvamento do mesmo dia e setor.', 1;
+                FETCH NEXT FROM dias INTO @d;
+            END
+            CLOSE dias;
+            DEALLOCATE dias;
+
+            SELECT s.colaborador_id, s.data, s.status, s.versao AS versao_esperada,
+                   CAST(p.versao AS BIGINT) AS versao_atual, ISNULL(sp.nome, N'') AS status_atual
+              INTO #presencas_atual
+              FROM #presencas_stg s
+              LEFT JOIN dbo.presencas_registro p WITH (UPDLOCK, HOLDLOCK)
+                ON p.colaborador_id = s.colaborador_id AND p.data = s.data
+              LEFT JOIN dbo.status_presenca sp ON sp.id = p.status_id;
+
+            MERGE dbo.presencas_registro WITH (HOLDLOCK) AS T
+            USING (SELECT a.colaborador_id, a.data, a.status, sp.id AS status_id
+                     FROM #presencas_atual a
+                     LEFT JOIN dbo.status_presenca sp ON sp.nome = a.status
+                    WHERE a.versao_esperada < 0 OR ISNULL(a.versao_atual, 0) = a.versao_esperada) AS S
+                 ON T.colaborador_id = S.colaborador_id AND T.data = S.data
+            WHEN MATCHED AND S.status = '' THEN
+                DELETE
+            WHEN MATCHED THEN
+                UPDATE SET status_id=S.status_id, setor_id=?, turno_id=?, leader_id=?, updated_at=SYSDATETIME()
+            WHEN NOT MATCHED BY TARGET AND S.status <> '' THEN
+                INSERT (colaborador_id, data, status_id, setor_id, turno_id, leader_id, created_at, updated_at)
+                VALUES (S.colaborador_id, S.data, S.status_id, ?, ?, ?, SYSDATETIME(), SYSDATETIME());
+            SET @n = @@ROWCOUNT;
+
+            -- um único result set: a contagem em todas as linhas (ao menos uma) + os conflitos
+            SELECT n.afetadas, c.colaborador_id, c.data, c.status_atual, c.status, c.versao_atual
+              FROM (SELECT @n AS afetadas) n
+              LEFT JOIN #presencas_atual c
+                ON c.versao_esperada >= 0 AND ISNULL(c.versao_atual, 0) <> c.versao_esperada
+               AND c.status_atual <> c.status
+             ORDER BY c.colaborador_id, c.data;
+            DROP TABLE #presencas_atual;
+            DROP TABLE #presencas_stg;
+            """, (setor_id, *(setor_id, turno_id, leader_id) * 2))
+            rows = cur.fetchall()
+            cur.close()
+        afetadas = int(rows[0][0] or 0)
+        conflitos = [tuple(r[1:]) for r in rows if r[1] is not None]
+        return afetadas, conflitos
+
+    def relatorio_agregado(self, dt_ini: date, dt_fim: date, setor: str | None,
+                           turno: str | None) -> pd.DataFrame:
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        with self.conexao_leitura() as cn:
+            return _ler_sql(
+                f"""
+                SELECT p.setor, p.turno, p.data,
+                       {_colunas_status_sql()},
+                       SUM(CASE WHEN c.eh_terceiro = 0 THEN 1 ELSE 0 END) AS soma,
+                       SUM(CASE WHEN c.eh_terceiro = 1 THEN 1 ELSE 0 END) AS terceiros,
+                       COUNT(*) AS total
+                  FROM dbo.vw_presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
+                 WHERE {where}
+                 GROUP BY p.setor, p.turno, p.data
+                 ORDER BY p.setor, p.turno, p.data
+                """,
+                cn,
+                params=params,
+            )
+
+    def relatorio_detalhe_pagina(self, dt_ini: date, dt_fim: date, setor: str | None,
+                                 turno: str | None, apos: tuple | None, limite: int) -> pd.DataFrame:
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        if apos is not None:
+            where += " AND " + _condicao_apos(["p.setor", "p.turno", "c.nome", "p.data", "p.id"])
+            params += _params_apos(list(apos))
+        with self.conexao_leitura() as cn:
+            return _ler_sql(
+                f"""
+                SELECT TOP (?) c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome, p.id
+                  FROM dbo.vw_presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
+                 WHERE {where}
+                 ORDER BY p.setor, p.turno, c.nome, p.data, p.id
+                """,
+                cn,
+                params=[int(limite), *params],
+            )
+
+    def iterar_relatorio(self, dt_ini: date, dt_fim: date, setor: str | None,
+                         turno: str | None, lote: int):
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        yield from self._iterar_em_lotes(
+            f"""
+            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
+              FROM dbo.vw_presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
+             WHERE {where}
+             ORDER BY p.setor, p.turno, c.nome, p.data
+            """,
+            params,
+            lote,
+        )
+
+    def ordem_setores_turnos(self) -> pd.DataFrame:
+        with self.conexao_leitura() as cn:
+            return _ler_sql(
+                """
+                SELECT se.nome AS setor, tu.nome AS turno, DENSE_RANK() OVER (ORDER BY se.nome, tu.nome) AS ordem
+                  FROM dbo.setores se CROSS JOIN dbo.turnos tu
+                """,
+                cn,
+            )
+
+    def ordem_colaboradores(self) -> pd.DataFrame:
+        with self.conexao_leitura() as cn:
+            return _ler_sql(
+                "SELECT nome, DENSE_RANK() OVER (ORDER BY nome) AS ordem FROM dbo.colaboradores",
+                cn,
+            )
+
+    def iterar_dia(self, setor: str, dia: date, lote: int):
+        yield from self._iterar_em_lotes(
+            """
+            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
+              FROM dbo.vw_presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
+             WHERE p.setor = ? AND p.data = ?
+             ORDER BY colaborador
+            """,
+            [setor, dia],
+            lote,
+        )
+
+# --- SQLite -------------------------------------------------------------------
+# Mesmo modelo do SQL Server (MIGRACOES_SQLITE): datas em texto ISO, texto COLLATE
+# NOCASE (como o collation CI do servidor), WAL para leitores concorrentes com um
+# escritor. Conexões em autocommit; as escritas abrem BEGIN IMMEDIATE, que também
+# serializa escritores entre processos.
+def _datas_nativas(df: pd.DataFrame) -> pd.DataFrame:
+    # sqlite devolve a data como texto; o resto do app espera `date` como no pyodbc
+    if "data" in df.columns and len(df):
+        df["data"] = pd.to_datetime(df["data"]).dt.date
+    return df
+
+class ArmazenamentoSqlite(Armazenamento):
+    nome = "sqlite"
+    rotulo = "SQLite"
+
+    def __init__(self, caminho: str, espera_s: float = 30.0):
+        self.caminho = caminho
+        self.espera_s = espera_s  # espera pela trava de escrita do arquivo
+
+    def conectar(self):
+        cn = sqlite3.connect(self.caminho, timeout=self.espera_s, isolation_level=None,
+                             check_same_thread=False)  # o pool entrega a uma thread por vez
+        cn.execute("PRAGMA journal_mode = WAL")
+        cn.execute("PRAGMA synchronous = NORMAL")
+        cn.execute("PRAGMA foreign_keys = ON")
+        return cn
+
+    def conectar_leitura(self):
+        # WAL: cada SELECT lê uma foto consistente e não espera o escritor (nem o atrasa)
+        cn = self.conectar()
+        cn.execute("PRAGMA query_only = ON")
+        return cn
+
+    def estado_leitura(self) -> List[Tuple[str, str]]:
+        with self.conexao_leitura() as cn:
+            modo = cn.execute("PRAGMA journal_mode").fetchone()[0]
+        return [
+            ("Isolamento das leituras", "snapshot (WAL)" if modo == "wal" else f"journal {modo} (com bloqueio)"),
+            ("Pool de leitura (conexões)", str(self.pool_leitura.tamanho_max)),
+        ]
+
+    @staticmethod
+    def _escrita(cn):
+        # chamadas aninhadas já estão dentro da transação de quem abriu
+        if not cn.in_transaction:
+            cn.execute("BEGIN IMMEDIATE")
+
+    def configuracao(self) -> List[Tuple[str, str]]:
+        caminho = os.path.abspath(self.caminho)
+        tamanho = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+        with self.conexao() as cn:
+            modo = cn.execute("PRAGMA journal_mode").fetchone()[0]
+        return [
+            ("Arquivo", caminho),
+            ("Tamanho (MB)", f"{tamanho / 1_048_576:.1f}"),
+            ("Versão do SQLite", sqlite3.sqlite_version),
+            ("Journal", modo),
+        ]
+
+    def identidade(self) -> str:
+        return f"sqlite://{os.path.abspath(self.caminho)}"
+
+    def aplicar_migracoes(self, cn) -> int:
+        # BEGIN IMMEDIATE = trava de escrita do arquivo: processos subindo juntos esperam
+        self._escrita(cn)
+        cur = cn.cursor()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_versao (
+            versao      INTEGER PRIMARY KEY,
+            descricao   TEXT NOT NULL,
+            aplicada_em TEXT DEFAULT (datetime('now', 'localtime'))
+        )
+        """)
+        aplicadas = {int(r[0]) for r in cur.execute("SELECT versao FROM schema_versao").fetchall()}
+        versao = self._aplicar_pendentes(cur, MIGRACOES_SQLITE, aplicadas,
+                                         "INSERT INTO schema_versao (versao, descricao) VALUES (?, ?)")
+        cur.close()
+        return versao
+
+    def versoes_dados(self) -> Dict[str, int]:
+        with self.conexao() as cn:
+            return {t: int(v) for t, v in cn.execute("SELECT tabela, versao FROM versao_dados").fetchall()}
+
+    def incrementar_versao(self, tabela: str):
+        with self.conexao() as cn:
+            self._escrita(cn)
+            cn.execute("UPDATE versao_dados SET versao = versao + 1 WHERE tabela = ?", (tabela,))
+
+    def criar_leader(self, nome: str, setor: str, turno: str) -> int:
+        with self.conexao() as cn:
+            self._escrita(cn)
+            cur = cn.cursor()
+            cur.execute("""
+            INSERT INTO leaders (nome, setor, turno)
+            SELECT ?, ?, ?
+             WHERE NOT EXISTS (SELECT 1 FROM leaders WHERE nome=? AND setor=? AND turno=?)
+            """, (nome, setor, turno) * 2)
+            novo = cur.execute("SELECT MIN(id) FROM leaders WHERE nome=? AND setor=? AND turno=?",
+                               (nome, setor, turno)).fetchone()[0]
+            cur.close()
+        return int(novo)
+
+    def criar_dimensao(self, tabela: str, nome: str) -> int:
+        with self.conexao() as cn:
+            cur = cn.cursor()
+            cur.execute(f"INSERT INTO {tabela} (nome) VALUES (?) ON CONFLICT (nome) DO NOTHING", (nome,))
+            novo = cur.execute(f"SELECT id FROM {tabela} WHERE nome = ?", (nome,)).fetchone()[0]
+            cur.close()
+        return int(novo)
+
+    def carregar_quadro(self) -> pd.DataFrame:
+        with self.conexao() as cn:
+            return _ler_sql("SELECT id, nome, setor, turno, ativo, eh_terceiro FROM colaboradores ORDER BY id", cn)
+
+    def adicionar_colaborador(self, nome: str, setor: str, turno: str):
+        with self.conexao() as cn:
+            cn.execute("INSERT INTO colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
+                       (nome, setor, turno))
+
+    def atualizar_turno_colaborador(self, colab_id: int, turno: str):
+        with self.conexao() as cn:
+            cn.execute("UPDATE colaboradores SET turno=? WHERE id=?", (turno, colab_id))
+
+    def upsert_colaborador_turno(self, nome: str, setor: str, turno: str):
+        with self.conexao() as cn:
+            self._escrita(cn)
+            row = cn.execute("SELECT id FROM colaboradores WHERE nome=? AND setor=?", (nome, setor)).fetchone()
+            if row:
+                cn.execute("UPDATE colaboradores SET turno=?, ativo=1 WHERE id=?", (turno, int(row[0])))
+            else:
+                cn.execute("INSERT INTO colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
+                           (nome, setor, turno))
+
+    def atualizar_ativo_colaboradores(self, ids_para_inativar: List[int], ids_para_ativar: List[int]):
+        sql = "UPDATE colaboradores SET ativo = ? WHERE id IN (SELECT value FROM json_each(?))"
+        with self.conexao() as cn:
+            self._escrita(cn)
+            if ids_para_inativar:
+                cn.execute(sql, (0, _ids_json(ids_para_inativar)))
+            if ids_para_ativar:
+                cn.execute(sql, (1, _ids_json(ids_para_ativar)))
+
+    def inserir_colaboradores(self, linhas: List[tuple]) -> int:
+        with self.conexao() as cn:
+            self._escrita(cn)
+            cur = cn.cursor()
+            cur.execute("CREATE TEMP TABLE colaboradores_stg (nome TEXT NOT NULL, setor TEXT NOT NULL, turno TEXT NOT NULL)")
+            cur.executemany("INSERT INTO colaboradores_stg VALUES (?, ?, ?)", linhas)
+            cur.execute("""
+            INSERT INTO colaboradores (nome, setor, turno, ativo)
+            SELECT s.nome, s.setor, s.turno, 1
+              FROM colaboradores_stg s
+             WHERE NOT EXISTS (SELECT 1 FROM colaboradores c
+                                WHERE c.nome = s.nome AND c.setor = s.setor AND c.turno = s.turno)
+            """)
+            inseridos = max(cur.rowcount, 0)
+            cur.execute("DROP TABLE colaboradores_stg")
+            cur.close()
+        return inseridos
+
+    def aplicar_turnos(self, lotes, simular: bool) -> Tuple[int, int, int, int]:
+        with self.conexao() as cn:
+            self._escrita(cn)
+            cur = cn.cursor()
+            cur.execute("CREATE TEMP TABLE turnos_stg (ordem INTEGER NOT NULL, nome TEXT NOT NULL COLLATE NOCASE, "
+                        "setor TEXT NOT NULL COLLATE NOCASE, turno TEXT NOT NULL)")
+            ordem = 0
+            for lote in lotes:
+                linhas = [(ordem + i, n, s, t) for i, (n, s, t) in
+                          enumerate(lote[["nome", "setor", "turno"]].itertuples(index=False, name=None))]
+                ordem += len(linhas)
+                cur.executemany("INSERT INTO turnos_stg VALUES (?, ?, ?, ?)", linhas)
+
+            # a mesma pessoa repetida no arquivo: vale a última linha
+            cur.execute("""
+            DELETE FROM turnos_stg
+             WHERE ordem NOT IN (SELECT MAX(ordem) FROM turnos_stg GROUP BY nome, setor)
+            """)
+            cur.execute("""
+            SELECT
+                COUNT(*),
+                SUM(CASE WHEN c.id IS NULL THEN 1 ELSE 0 END),
+                SUM(CASE WHEN c.id IS NOT NULL AND IFNULL(c.ativo, 0) = 1 AND c.turno <> s.turno THEN 1 ELSE 0 END),
+                SUM(CASE WHEN c.id IS NOT NULL AND IFNULL(c.ativo, 0) = 0 THEN 1 ELSE 0 END)
+              FROM turnos_stg s
+              LEFT JOIN colaboradores c
+                ON c.id = (SELECT MIN(id) FROM colaboradores WHERE nome = s.nome AND setor = s.setor)
+            """)
+            contagens = tuple(int(v or 0) for v in cur.fetchone())
+
+            if not simular and contagens[0]:
+                cur.execute("""
+                UPDATE colaboradores AS T SET turno = S.turno, ativo = 1
+                  FROM turnos_stg AS S
+                 WHERE T.nome = S.nome AND T.setor = S.setor
+                   AND (T.turno <> S.turno OR IFNULL(T.ativo, 0) = 0)
+                """)
+                cur.execute("""
+                INSERT INTO colaboradores (nome, setor, turno, ativo)
+                SELECT S.nome, S.setor, S.turno, 1
+                  FROM turnos_stg S
+                 WHERE NOT EXISTS (SELECT 1 FROM colaboradores T WHERE T.nome = S.nome AND T.setor = S.setor)
+                """)
+            cur.execute("DROP TABLE turnos_stg")
+            cur.close()
+        return contagens
+
+    def carregar_presencas(self, colab_ids: List[int], inicio: date, fim: date) -> pd.DataFrame:
+        with self.conexao() as cn:
+            return _datas_nativas(_ler_sql(
+                """
+                SELECT p.colaborador_id, p.data, p.status, p.versao
+                FROM vw_presencas p
+                JOIN json_each(?) AS ids ON ids.value = p.colaborador_id
+                WHERE p.data BETWEEN ? AND ?
+                """,
+                cn,
+                params=[_ids_json(colab_ids), inicio, fim],
+            ))
+
+    def gravar_presencas(self, linhas: List[tuple], setor_id: int, turno_id: int,
+                         leader_id: int | None) -> Tuple[int, List[tuple]]:
+        with self.conexao() as cn:
+            # BEGIN IMMEDIATE: o lote inteiro (conferência + gravação) é serializado com os
+            # outros escritores, então a versão conferida é a que será sobrescrita
+            self._escrita(cn)
+            cur = cn.cursor()
+            cur.execute("CREATE TEMP TABLE presencas_stg (colaborador_id INTEGER NOT NULL, data TEXT NOT NULL, "
+                        "status TEXT NOT NULL, versao INTEGER NOT NULL, PRIMARY KEY (colaborador_id, data))")
+            cur.executemany("INSERT INTO presencas_stg VALUES (?, ?, ?, ?)", _com_versao(linhas))
+            # versão mudou desde a hidratação: a célula sai do lote (conflito se o status difere)
+            conflitos = [
+                (cid, date.fromisoformat(d), atual, tentado, versao)
+                for cid, d, atual, tentado, versao in cur.execute("""
+                SELECT s.colaborador_id, s.data, COALESCE(sp.nome, '') AS status_atual, s.status, p.versao
+                  FROM presencas_stg s
+                  LEFT JOIN presencas p ON p.colaborador_id = s.colaborador_id AND p.data = s.data
+                  LEFT JOIN status_presenca sp ON sp.id = p.status_id
+                 WHERE s.versao >= 0 AND COALESCE(p.versao, 0) <> s.versao
+                 ORDER BY s.colaborador_id, s.data
+                """).fetchall()
+                if atual != tentado
+            ]
+            cur.execute("""
+            DELETE FROM presencas_stg
+             WHERE versao >= 0
+               AND versao <> COALESCE((SELECT p.versao FROM presencas p
+                                        WHERE p.colaborador_id = presencas_stg.colaborador_id
+                                          AND p.data = presencas_stg.data), 0)
+            """)
+            cur.execute("UPDATE presencas_versao SET ultima = ultima + 1 WHERE id = 1")
+            versao = cur.execute("SELECT ultima FROM presencas_versao WHERE id = 1").fetchone()[0]
+            # status vazio = apagar; demais = upsert (sem MERGE no SQLite: DELETE + INSERT ... ON CONFLICT)
+            # ids via junção com a staging: busca pela chave única, sem varrer presencas
+            cur.execute("""
+            DELETE FROM presencas
+             WHERE id IN (SELECT p.id
+                            FROM presencas_stg s
+                            JOIN presencas p ON p.colaborador_id = s.colaborador_id AND p.data = s.data
+                           WHERE s.status = '')
+            """)
+            afetadas = max(cur.rowcount, 0)
+            cur.execute("""
+            INSERT INTO presencas (colaborador_id, data, status_id, setor_id, turno_id, leader_id,
+                                   created_at, updated_at, versao)
+            SELECT s.colaborador_id, s.data, sp.id, ?, ?, ?, datetime('now', 'localtime'),
+                   datetime('now', 'localtime'), ?
+              FROM presencas_stg s
+              LEFT JOIN status_presenca sp ON sp.nome = s.status
+             WHERE s.status <> ''
+            ON CONFLICT (colaborador_id, data) DO UPDATE SET
+                status_id = excluded.status_id, setor_id = excluded.setor_id, turno_id = excluded.turno_id,
+                leader_id = excluded.leader_id, updated_at = excluded.updated_at, versao = excluded.versao
+            """, (setor_id, turno_id, leader_id, versao))
+            afetadas += max(cur.rowcount, 0)
+            cur.execute("DROP TABLE presencas_stg")
+            cur.close()
+        return afetadas, conflitos
+
+    def relatorio_agregado(self, dt_ini: date, dt_fim: date, setor: str | None,
+                           turno: str | None) -> pd.DataFrame:
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        with self.conexao_leitura() as cn:
+            return _datas_nativas(_ler_sql(
+                f"""
+                SELECT p.setor, p.turno, p.data,
+                       {_colunas_status_sql()},
+                       SUM(CASE WHEN c.eh_terceiro = 0 THEN 1 ELSE 0 END) AS soma,
+                       SUM(CASE WHEN c.eh_terceiro = 1 THEN 1 ELSE 0 END) AS terceiros,
+                       COUNT(*) AS total
+                  FROM vw_presencas p JOIN colaboradores c ON c.id = p.colaborador_id
+                 WHERE {where}
+                 GROUP BY p.setor, p.turno, p.data
+                 ORDER BY p.setor, p.turno, p.data
+                """,
+                cn,
+                params=params,
+            ))
+
+    def relatorio_detalhe_pagina(self, dt_ini: date, dt_fim: date, setor: str | None,
+                                 turno: str | None, apos: tuple | None, limite: int) -> pd.DataFrame:
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        if apos is not None:
+            where += " AND " + _condicao_apos(["p.setor", "p.turno", "c.nome", "p.data", "p.id"])
+            params += _params_apos(list(apos))
+        with self.conexao_leitura() as cn:
+            return _datas_nativas(_ler_sql(
+                f"""
+                SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome, p.id
+                  FROM vw_presencas p JOIN colaboradores c ON c.id = p.colaborador_id
+                 WHERE {where}
+                 ORDER BY p.setor, p.turno, c.nome, p.data, p.id
+                 LIMIT ?
+                """,
+                cn,
+                params=[*params, int(limite)],
+            ))
+
+    def iterar_relatorio(self, dt_ini: date, dt_fim: date, setor: str | None,
+                         turno: str | None, lote: int):
+        where, params = _filtros_relatorio(dt_ini, dt_fim, setor, turno)
+        for chunk in self._iterar_em_lotes(
+            f"""
+            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
+              FROM vw_presencas p JOIN colaboradores c ON c.id = p.colaborador_id
+             WHERE {where}
+             ORDER BY p.setor, p.turno, c.nome, p.data
+            """,
+            params,
+            lote,
+        ):
+            yield _datas_nativas(chunk)
+
+    def ordem_setores_turnos(self) -> pd.DataFrame:
+        with self.conexao_leitura() as cn:
+            return _ler_sql(
+                """
+                SELECT se.nome AS setor, tu.nome AS turno, DENSE_RANK() OVER (ORDER BY se.nome, tu.nome) AS ordem
+                  FROM setores se CROSS JOIN turnos tu
+                """,
+                cn,
+            )
+
+    def ordem_colaboradores(self) -> pd.DataFrame:
+        with self.conexao_leitura() as cn:
+            return _ler_sql("SELECT nome, DENSE_RANK() OVER (ORDER BY nome) AS ordem FROM colaboradores", cn)
+
+    def iterar_dia(self, setor: str, dia: date, lote: int):
+        for chunk in self._iterar_em_lotes(
+            """
+            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
+              FROM vw_presencas p JOIN colaboradores c ON c.id = p.colaborador_id
+             WHERE p.setor = ? AND p.data = ?
+             ORDER BY colaborador
+            """,
+            [setor, dia],
+            lote,
+        ):
+            yield _datas_nativas(chunk)
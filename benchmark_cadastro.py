@@ -0,0 +1,501 @@
+# benchmark_cadastro.py
+# ---------------------------------------------------------------
+# Benchmark da camada de dados e das páginas do cadastro_hc.py com carga sintética
+# determinística. Por padrão roda num banco SQLite local (DB_BACKEND=sqlite): não
+# precisa de SQL Server nem de rede.
+#
+#   python benchmark_cadastro.py                          # gera (ou reaproveita) a base e mede tudo
+#   python benchmark_cadastro.py --saida base.json        # guarda o resultado em JSON
+#   python benchmark_cadastro.py --comparar base.json     # compara com um resultado guardado
+#   python benchmark_cadastro.py --colaboradores 8000 --dias 1095 --cenarios relatorio,pagina
+#
+# A base gerada fica em cache (um arquivo por combinação de parâmetros) e cada execução
+# mede sobre uma cópia dela, então os cenários de escrita não contaminam a próxima rodada.
+# ---------------------------------------------------------------
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+RAIZ = Path(__file__).resolve().parent
+SCRIPT_APP = RAIZ / "cadastro_hc.py"
+
+# ------------------------------
+# Parâmetros da carga sintética
+# ------------------------------
+TURNOS_PESOS = [0.45, 0.30, 0.15, 0.07, 0.03]          # 1°, 2°, 3°, ÚNICO, INTERMEDIARIO
+STATUS_MIX = {"PRESENTE": 0.86, "ATRASADO": 0.05, "BH": 0.04, "FALTA": 0.05}
+# chance de o dia ficar sem lançamento, por dia da semana (seg..dom)
+SEM_LANCAMENTO_DIA_SEMANA = [0.03, 0.03, 0.03, 0.03, 0.04, 0.60, 0.92]
+ADMIN_BENCH = "projetos.logistica@somagrupo.com.br"
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark do cadastro_hc com carga sintética.")
+    p.add_argument("--backend", choices=["sqlite", "sqlserver"], default="sqlite")
+    p.add_argument("--banco-descartavel", action="store_true",
+                   help="obrigatório com --backend sqlserver: grava a carga sintética no banco configurado")
+    p.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "cadastro_hc_bench"),
+                   help="onde guardar as bases SQLite geradas")
+    p.add_argument("--setores", type=int, default=8, help="quantidade de setores (além dos 8 do app: 'Setor 09'...)")
+    p.add_argument("--colaboradores", type=int, default=3000)
+    p.add_argument("--dias", type=int, default=730, help="dias de presenças até --ate")
+    p.add_argument("--ate", type=date.fromisoformat, default=date.today(), help="último dia com presenças (AAAA-MM-DD)")
+    p.add_argument("--terceiros", type=float, default=0.15, help="fração de terceiros")
+    p.add_argument("--inativos", type=float, default=0.05, help="fração de inativos")
+    p.add_argument("--semente", type=int, default=42)
+    p.add_argument("--repeticoes", type=int, default=5)
+    p.add_argument("--aquecimento", type=int, default=1)
+    p.add_argument("--cenarios", default="", help="só os cenários cujo nome contém um destes trechos (separados por vírgula)")
+    p.add_argument("--sem-paginas", action="store_true", help="não mede a renderização das páginas")
+    p.add_argument("--cache-compartilhado", action="store_true",
+                   help="liga o cache compartilhado (L2) do app; por padrão fica desligado para medir o banco")
+    p.add_argument("--saida", help="arquivo JSON com o resultado")
+    p.add_argument("--comparar", help="JSON de uma execução anterior (baseline)")
+    p.add_argument("--tolerancia", type=float, default=0.15, help="variação da mediana tolerada na comparação")
+    p.add_argument("--diferenca-minima-ms", type=float, default=1.0,
+                   help="variações menores que isso (em ms) contam como iguais, mesmo acima da tolerância")
+    p.add_argument("--falhar-se-pior", action="store_true", help="código de saída 1 se algum cenário piorar")
+    return p.parse_args(argv)
+
+def _parametros_carga(args) -> Dict[str, object]:
+    return {"setores": args.setores, "colaboradores": args.colaboradores, "dias": args.dias,
+            "ate": args.ate.isoformat(), "terceiros": args.terceiros, "inativos": args.inativos,
+            "semente": args.semente}
+
+def _log(msg: str):
+    print(msg, file=sys.stderr, flush=True)
+
+# ------------------------------
+# Preparação do banco
+# ------------------------------
+def _apagar_sqlite(caminho: Path):
+    for sufixo in ("", "-wal", "-shm"):
+        Path(f"{caminho}{sufixo}").unlink(missing_ok=True)
+
+def preparar_ambiente(args) -> Tuple[Path | None, bool]:
+    """
+    Define DB_BACKEND/SQLITE_PATH (antes de importar o app) e devolve
+    (base em cache a criar ou None, se é preciso gerar a carga).
+    """
+    os.environ["DB_BACKEND"] = args.backend
+    os.environ["SHARED_CACHE_ENABLED"] = "1" if args.cache_compartilhado else "0"
+    if args.cache_compartilhado:
+        # arquivo L2 novo a cada execução: a primeira chamada de cada cenário é uma falta
+        l2 = Path(args.cache_dir) / "l2_execucao.sqlite3"
+        l2.parent.mkdir(parents=True, exist_ok=True)
+        _apagar_sqlite(l2)
+        os.environ["SHARED_CACHE_PATH"] = str(l2)
+    if args.backend == "sqlserver":
+        if not args.banco_descartavel:
+            sys.exit("--backend sqlserver grava dados sintéticos no banco configurado; "
+                     "confirme com --banco-descartavel.")
+        return None, True  # a carga é idempotente (upserts): sempre aplicada
+
+    chave = hashlib.sha1(json.dumps(_parametros_carga(args), sort_keys=True).encode()).hexdigest()[:12]
+    pasta = Path(args.cache_dir)
+    pasta.mkdir(parents=True, exist_ok=True)
+    base, trabalho = pasta / f"base_{chave}.sqlite3", pasta / f"execucao_{chave}.sqlite3"
+    _apagar_sqlite(trabalho)
+    os.environ["SQLITE_PATH"] = str(trabalho)
+    if base.exists():
+        shutil.copyfile(base, trabalho)
+        return None, False
+    return base, True
+
+def _fechar_sqlite(app):
+    # tudo no arquivo principal (sem -wal pendente) antes de copiar
+    with app.conexao() as cn:
+        cn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    app._pool_conexoes().fechar_todas()
+    app._pool_leitura().fechar_todas()
+
+# ------------------------------
+# Gerador determinístico
+# ------------------------------
+def nomes_setores(app, n: int) -> List[str]:
+    extras = [f"Setor {i:02d}" for i in range(len(app.OPCOES_SETORES) + 1, n + 1)]
+    return (app.OPCOES_SETORES + extras)[:n]
+
+def gerar_colaboradores(app, rng, setores: List[str], n: int, frac_terceiros: float,
+                        frac_inativos: float) -> pd.DataFrame:
+    terceiro = rng.random(n) < frac_terceiros
+    return pd.DataFrame({
+        "nome": [f"COLABORADOR {i:05d}" + (" - terceiro" if t else "") for i, t in enumerate(terceiro, 1)],
+        "setor": np.array(setores, dtype=object)[rng.integers(0, len(setores), n)],
+        "turno": rng.choice(np.array(app.OPCOES_TURNOS, dtype=object), n, p=TURNOS_PESOS),
+        "ativo": rng.random(n) >= frac_inativos,
+    })
+
+def gerar_status(rng, n_colab: int, dias: List[date]) -> np.ndarray:
+    """Matriz colaborador x dia com o índice em STATUS_MIX (+1); 0 = sem lançamento."""
+    p_vazio = np.array([SEM_LANCAMENTO_DIA_SEMANA[d.weekday()] for d in dias])
+    vazio = rng.random((n_colab, len(dias))) < p_vazio
+    codigos = rng.choice(len(STATUS_MIX), size=(n_colab, len(dias)), p=list(STATUS_MIX.values())) + 1
+    codigos[vazio] = 0
+    return codigos.astype(np.uint8)
+
+def gerar_carga(app, args):
+    rng = np.random.default_rng(args.semente)
+    setores = nomes_setores(app, args.setores)
+    colabs = gerar_colaboradores(app, rng, setores, args.colaboradores, args.terceiros, args.inativos)
+
+    t0 = time.perf_counter()
+    app.carregar_colaboradores_em_lote(colabs[["nome", "setor", "turno"]])
+    quadro = app.listar_todos_colaboradores()
+    ids = colabs["nome"].map(dict(zip(quadro["nome"], quadro["id"])))
+    colabs = colabs.assign(id=ids.astype(int))
+    app.atualizar_ativo_colaboradores(colabs.loc[~colabs["ativo"], "id"].tolist(), [])
+    _log(f"  {len(colabs)} colaboradores em {time.perf_counter() - t0:.1f}s")
+
+    # presenças de quem está ativo, gravadas pela própria interface de armazenamento,
+    # por (setor, turno) e período 16..15, como o app faria
+    t0 = time.perf_counter()
+    ativos = colabs[colabs["ativo"]].reset_index(drop=True)
+    dias = [args.ate - timedelta(days=i) for i in range(args.dias - 1, -1, -1)]
+    codigos = gerar_status(rng, len(ativos), dias)
+    rotulos = np.array([""] + list(STATUS_MIX), dtype=object)
+    dias_iso = np.array([d.isoformat() for d in dias], dtype=object)
+    periodos = pd.Series([app.periodo_por_data(d)[0] for d in dias])
+    arm = app.armazenamento()
+    total = 0
+    for (setor, turno), grupo in ativos.groupby(["setor", "turno"]):
+        setor_id = app.id_dimensao("setores", setor)
+        turno_id = app.id_dimensao("turnos", turno)
+        leader_id = app.id_leader(f"LÍDER {setor.upper()} {turno}", setor, turno)
+        linhas_grupo = codigos[grupo.index.to_numpy()]
+        for _, cols in periodos.groupby(periodos).groups.items():
+            bloco = linhas_grupo[:, cols]
+            i, j = np.nonzero(bloco)
+            linhas = list(zip(grupo["id"].to_numpy()[i].tolist(),
+                              dias_iso[np.asarray(cols)[j]].tolist(),
+                              rotulos[bloco[i, j]].tolist()))
+            total += arm.gravar_presencas(linhas, setor_id, turno_id, leader_id)[0]
+    app.registrar_escrita("presencas")
+    _log(f"  {total} presenças em {time.perf_counter() - t0:.1f}s")
+
+# ------------------------------
+# Medição
+# ------------------------------
+def _contar(resultado) -> int | None:
+    if isinstance(resultado, pd.DataFrame):
+        return len(resultado)
+    if isinstance(resultado, dict):
+        return resultado.get("linhas")
+    if isinstance(resultado, (int, np.integer)):
+        return int(resultado)
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], (int, np.integer)):
+        return int(resultado[0])
+    return None
+
+def medir(funcao, repeticoes: int, aquecimento: int) -> Dict[str, object]:
+    for _ in range(aquecimento):
+        funcao()
+    tempos, linhas = [], None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - t0) * 1000)
+        linhas = _contar(resultado)
+    return _estatisticas(tempos, linhas)
+
+def _estatisticas(tempos_ms: List[float], linhas: int | None) -> Dict[str, object]:
+    ordenados = sorted(tempos_ms)
+    return {
+        "n": len(ordenados),
+        "min_ms": round(ordenados[0], 3),
+        "mediana_ms": round(statistics.median(ordenados), 3),
+        "p95_ms": round(ordenados[min(len(ordenados) - 1, int(round(0.95 * (len(ordenados) - 1))))], 3),
+        "media_ms": round(statistics.fmean(ordenados), 3),
+        "linhas": linhas,
+    }
+
+def _alternador(*valores):
+    # cada chamada devolve o próximo valor: as escritas repetidas sempre mudam algo
+    estado = {"i": -1}
+
+    def proximo():
+        estado["i"] = (estado["i"] + 1) % len(valores)
+        return valores[estado["i"]]
+    return proximo
+
+def _grid(app, quadro: pd.DataFrame, inicio: date, fim: date) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    mapa = dict(zip(quadro["nome"], quadro["id"]))
+    base = app.montar_grid_presencas(quadro, inicio, fim)
+    presencas = app.carregar_presencas(quadro["id"].tolist(), inicio, fim)
+    return app.aplicar_status_existentes(base, presencas, mapa), mapa
+
+def _csv_turnos(quadro: pd.DataFrame, turno_de) -> io.BytesIO:
+    arq = io.BytesIO(quadro.assign(turno=quadro["turno"].map(turno_de))
+                           .rename(columns={"nome": "NOME", "setor": "SETOR", "turno": "TURNO"})
+                           [["NOME", "SETOR", "TURNO"]].to_csv(index=False, sep=";").encode("utf-8"))
+    arq.name = "turnos_benchmark.csv"
+    return arq
+
+def cenarios_dados(app, args) -> List[Tuple[str, object]]:
+    setor = app.OPCOES_SETORES[0]
+    turno = "1°"
+    ini, fim = app.periodo_por_data(args.ate)
+    ano_ini = fim - timedelta(days=364)
+    quadro_setor = app.listar_colaboradores_por_setor(setor)
+    quadro_turno = app.listar_colaboradores_setor_turno(setor, turno)
+    ids_setor = quadro_setor["id"].tolist()
+
+    grid_periodo, mapa_turno = _grid(app, quadro_turno, ini, fim)
+    col_periodo = [c for c in grid_periodo.columns if c not in ("Colaborador", "Setor")]
+    grid_dia, mapa_setor = _grid(app, quadro_setor, args.ate, args.ate)
+    dia = args.ate.isoformat()
+    alterna_periodo = _alternador("PRESENTE", "BH")
+    alterna_dia = _alternador("ATRASADO", "PRESENTE")
+
+    def salvar_periodo():
+        editado = grid_periodo.copy()
+        editado[col_periodo] = alterna_periodo()
+        return app.salvar_presencas(editado, mapa_turno, ini, fim, setor, turno, "LÍDER BENCHMARK")
+
+    def salvar_dia_diff():
+        # ~5% das linhas alteradas, como um líder corrigindo o dia
+        editado = grid_dia.copy()
+        editado.loc[editado.index[::20], dia] = alterna_dia()
+        return app.salvar_presencas(editado, mapa_setor, args.ate, args.ate, setor, "-",
+                                    "LÍDER BENCHMARK", df_base=grid_dia)
+
+    def quadro_frio():
+        app._quadro_na_versao.clear()
+        return app.listar_todos_colaboradores()
+
+    def detalhe_dez_paginas():
+        # navegação "Próxima" x10 (keyset): devolve as linhas lidas
+        apos, lidas = None, 0
+        for _ in range(10):
+            pagina = app.relatorio_detalhe_pagina(ano_ini, fim, apos=apos, limite=app.RELATORIO_TAMANHO_PAGINA)
+            if pagina.empty:
+                break
+            lidas += len(pagina)
+            apos = tuple(pagina.iloc[-1][app.CHAVE_RELATORIO])
+        return lidas
+
+    def exportar(formato, desde=ini):
+        def _exportar():
+            arq, linhas, _ = app.exportar_em_arquivo(app.iterar_relatorio_em_lotes(desde, fim), formato)
+            arq.close()
+            return linhas
+        return _exportar
+
+    quadro = app.listar_todos_colaboradores()
+    turnos_alternados = _alternador({t: "2°" if t == "1°" else "1°" for t in app.OPCOES_TURNOS},
+                                    {t: t for t in app.OPCOES_TURNOS})
+
+    return [
+        ("quadro.carga_fria", quadro_frio),
+        ("quadro.listar_setor_turno", lambda: app.listar_colaboradores_setor_turno(setor, turno)),
+        ("quadro.listar_setor_terceiros", lambda: app.listar_colaboradores_por_setor(setor, terceiros=True)),
+        ("presencas.carregar_periodo_setor", lambda: app.carregar_presencas(ids_setor, ini, fim)),
+        ("presencas.carregar_dia_setor", lambda: app.carregar_presencas(ids_setor, args.ate, args.ate)),
+        ("presencas.salvar_grid_periodo", salvar_periodo),
+        ("presencas.salvar_dia_diff", salvar_dia_diff),
+        ("relatorio.agregado_periodo", lambda: app.relatorio_agregado(ini, fim)),
+        ("relatorio.agregado_ano", lambda: app.relatorio_agregado(ano_ini, fim)),
+        ("relatorio.detalhe_pagina_1", lambda: app.relatorio_detalhe_pagina(ini, fim)),
+        ("relatorio.detalhe_10_paginas_ano", detalhe_dez_paginas),
+        ("exportacao.periodo_csv", exportar("CSV")),
+        ("exportacao.periodo_parquet", exportar("Parquet")),
+        # vários períodos: fatiado e buscado em paralelo
+        ("exportacao.ano_csv", exportar("CSV", ano_ini)),
+        ("exportacao.dia_setor", lambda: sum(len(c) for c in app.iterar_dia_em_lotes(setor, args.ate))),
+        ("importador.seed_existentes", lambda: app.carregar_colaboradores_em_lote(quadro[["nome", "setor", "turno"]])),
+        ("importador.csv_simulado", lambda: app.importar_turnos_de_arquivo(
+            _csv_turnos(quadro, turnos_alternados()), simular=True)),
+        # por último: altera turnos (volta ao original a cada duas rodadas)
+        ("importador.csv_aplicado", lambda: app.importar_turnos_de_arquivo(
+            _csv_turnos(quadro, turnos_alternados()))),
+    ]
+
+def cenarios_paginas(args) -> List[Tuple[str, object]]:
+    from streamlit.testing.v1 import AppTest
+
+    def _sessao():
+        at = AppTest.from_file(str(SCRIPT_APP), default_timeout=300)
+        at.session_state["auth"] = True
+        at.session_state["user_email"] = ADMIN_BENCH
+        return at
+
+    def _falhou(at):
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    def primeira_renderizacao():
+        at = _sessao()
+        at.run()
+        _falhou(at)
+
+    def pagina(nome, acao=None):
+        # sessão nova já na página; mede só o rerun que renderiza a página pedida
+        def _medir():
+            at = _sessao()
+            at.run()
+            at.sidebar.radio[0].set_value(nome)
+            if acao:
+                at.run()
+                acao(at)
+            t0 = time.perf_counter()
+            at.run()
+            _falhou(at)
+            return time.perf_counter() - t0
+        return _medir
+
+    def gerar_relatorio(visao):
+        def _acao(at):
+            at.radio(key="rel_visao").set_value(visao)
+            next(b for b in at.button if b.label == "Gerar relatório").click()
+        return _acao
+
+    def rerun_lancamento():
+        at = _sessao()
+        at.run()
+        t0 = time.perf_counter()
+        at.run()
+        _falhou(at)
+        return time.perf_counter() - t0
+
+    return [
+        ("pagina.lancamento_primeira", primeira_renderizacao),
+        ("pagina.lancamento_rerun", rerun_lancamento),
+        ("pagina.colaboradores", pagina("Colaboradores")),
+        ("pagina.relatorios_resumo", pagina("Relatórios", gerar_relatorio("Resumo (contagem por setor/turno/dia)"))),
+        ("pagina.relatorios_detalhe", pagina("Relatórios", gerar_relatorio("Detalhado (paginado)"))),
+        ("pagina.db", pagina("DB")),
+    ]
+
+def medir_paginas(cenarios, repeticoes: int, aquecimento: int) -> Dict[str, Dict[str, object]]:
+    """Nas páginas que devolvem o tempo do rerun, mede só ele (sem montar a sessão)."""
+    saida = {}
+    for nome, funcao in cenarios:
+        for _ in range(aquecimento):
+            funcao()
+        tempos = []
+        for _ in range(repeticoes):
+            t0 = time.perf_counter()
+            parcial = funcao()
+            tempos.append((parcial if parcial is not None else time.perf_counter() - t0) * 1000)
+        saida[nome] = _estatisticas(tempos, None)
+        _log(f"  {nome}: {saida[nome]['mediana_ms']:.1f} ms")
+    return saida
+
+# ------------------------------
+# Comparação com baseline
+# ------------------------------
+def comparar(atual: Dict, base: Dict, tolerancia: float,
+             diferenca_minima_ms: float = 0.0) -> Tuple[List[Dict[str, object]], bool]:
+    linhas, piorou = [], False
+    for nome, med in atual["cenarios"].items():
+        ref = base.get("cenarios", {}).get(nome)
+        if not ref:
+            linhas.append({"cenario": nome, "base_ms": None, "atual_ms": med["mediana_ms"],
+                           "razao": None, "situacao": "novo"})
+            continue
+        razao = med["mediana_ms"] / ref["mediana_ms"] if ref["mediana_ms"] else float("inf")
+        if abs(med["mediana_ms"] - ref["mediana_ms"]) < diferenca_minima_ms:
+            situacao = "igual"
+        elif razao > 1 + tolerancia:
+            situacao, piorou = "PIOR", True
+        elif razao < 1 - tolerancia:
+            situacao = "melhor"
+        else:
+            situacao = "igual"
+        linhas.append({"cenario": nome, "base_ms": ref["mediana_ms"], "atual_ms": med["mediana_ms"],
+                       "razao": round(razao, 3), "situacao": situacao})
+    if base.get("carga") != atual.get("carga"):
+        _log("Aviso: a baseline foi medida com outra carga sintética; compare com cautela.")
+    return linhas, piorou
+
+def imprimir_tabela(resultado: Dict, comparacao: List[Dict[str, object]] | None):
+    if comparacao is None:
+        print(f"{'cenário':40} {'mediana ms':>11} {'p95 ms':>9} {'linhas':>9}")
+        for nome, med in resultado["cenarios"].items():
+            linhas = "" if med["linhas"] is None else med["linhas"]
+            print(f"{nome:40} {med['mediana_ms']:11.1f} {med['p95_ms']:9.1f} {linhas:>9}")
+        return
+    print(f"{'cenário':40} {'base ms':>9} {'atual ms':>9} {'razão':>7}  situação")
+    for c in comparacao:
+        base = "-" if c["base_ms"] is None else f"{c['base_ms']:.1f}"
+        razao = "-" if c["razao"] is None else f"{c['razao']:.2f}"
+        print(f"{c['cenario']:40} {base:>9} {c['atual_ms']:9.1f} {razao:>7}  {c['situacao']}")
+
+# ------------------------------
+# Execução
+# ------------------------------
+def _selecionado(nome: str, filtros: List[str]) -> bool:
+    return not filtros or any(f in nome for f in filtros)
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    base_cache, gerar = preparar_ambiente(args)
+
+    sys.path.insert(0, str(RAIZ))
+    import cadastro_hc as app
+    from streamlit.logger import set_log_level
+    set_log_level("error")  # avisos de "bare mode" das chamadas fora do `streamlit run`
+
+    app.init_db()
+    if gerar:
+        _log("Gerando carga sintética...")
+        gerar_carga(app, args)
+        if base_cache is not None:
+            _fechar_sqlite(app)
+            shutil.copyfile(os.environ["SQLITE_PATH"], base_cache)
+
+    filtros = [f.strip() for f in args.cenarios.split(",") if f.strip()]
+    resultado = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "backend": args.backend,
+        "cache_compartilhado": args.cache_compartilhado,
+        "carga": _parametros_carga(args),
+        "ambiente": {"python": platform.python_version(), "plataforma": platform.platform(),
+                     "pandas": pd.__version__, "numpy": np.__version__},
+        "cenarios": {},
+    }
+    if args.backend == "sqlite":
+        import sqlite3
+        resultado["ambiente"]["sqlite"] = sqlite3.sqlite_version
+
+    _log("Medindo a camada de dados...")
+    for nome, funcao in cenarios_dados(app, args):
+        if _selecionado(nome, filtros):
+            resultado["cenarios"][nome] = medir(funcao, args.repeticoes, args.aquecimento)
+            _log(f"  {nome}: {resultado['cenarios'][nome]['mediana_ms']:.1f} ms")
+
+    if not args.sem_paginas:
+        _log("Medindo as páginas...")
+        paginas = [(n, f) for n, f in cenarios_paginas(args) if _selecionado(n, filtros)]
+        resultado["cenarios"].update(medir_paginas(paginas, args.repeticoes, args.aquecimento))
+
+    comparacao, piorou = None, False
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparacao, piorou = comparar(resultado, json.load(f), args.tolerancia,
+                                          args.diferenca_minima_ms)
+        resultado["comparacao"] = {"baseline": args.comparar, "tolerancia": args.tolerancia,
+                                   "cenarios": comparacao}
+
+    imprimir_tabela(resultado, comparacao)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return 1 if (piorou and args.falhar_se_pior) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,27 +2,58 @@
 # ---------------------------------------------------------------
 # Requisitos (instale com):
 #   pip install streamlit pandas python-dateutil pyodbc openpyxl
+#   (pyodbc só é necessário com o SQL Server; DB_BACKEND=sqlite dispensa)
 # Rode com: streamlit run cadastro_hc.py
 # ---------------------------------------------------------------
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
-import pyodbc
+import numpy as np
+import openpyxl
 import os
+import sqlite3
+import stat
+import codecs
+import csv
+import io
+import json
+import atexit
+import pickle
+import re
+import hashlib
+import functools
+import itertools
+import heapq
+import tempfile
+import xml.etree.ElementTree as ET
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from typing import List, Tuple, Dict
+from typing import Callable, List, Tuple, Dict
+
+# Camada de banco (SQL, migrações, pool de conexões): armazenamento_hc.py, ao lado deste
+from armazenamento_hc import (
+    ROTULO_CONSULTA,
+    STATUS_OPCOES,
+    VERSAO_QUALQUER,
+    Armazenamento,
+    ArmazenamentoSqlite,
+    ArmazenamentoSqlServer,
+    PoolConexoes,
+    _ids_json,
+)
 
-# Importa utilitários de conexão SQL Server
-from DB import get_conn, test_connection, get_config
 
 # ------------------------------
 # Config Básica
 # ------------------------------
 st.set_page_config(page_title="Presenças - Logística", layout="wide")
 
-STATUS_OPCOES = ["", "PRESENTE", "BH", "ATRASADO", "FALTA"]
-
 OPCOES_SETORES = [
     "Aviamento",
     "Tecido",
@@ -43,6 +74,12 @@ def normaliza_turno(t: str) -> str:
         t = "INTERMEDIARIO"
     return t if t in ["1°", "2°", "3°", "ÚNICO", "INTERMEDIARIO"] else "1°"
 
+def normaliza_turno_serie(turnos: pd.Series) -> pd.Series:
+    # mesma regra de normaliza_turno, aplicada à coluna inteira
+    t = turnos.fillna("").astype(str).str.strip().str.upper().str.replace("º", "°", regex=False)
+    t = t.replace({"UNICO": "ÚNICO", "INTERMEDIÁRIO": "INTERMEDIARIO"})
+    return t.where(t.isin(["1°", "2°", "3°", "ÚNICO", "INTERMEDIARIO"]), "1°")
+
 # --- LOGIN por e-mail/senha ---------------------------------------------------
 # Quem pode logar (email -> senha)
 # --- LOGIN por e-mail (sem senha) --------------------------------------------
@@ -114,58 +151,474 @@ def show_login():
 # -------------------------------------------------------------------------------
 
 # ------------------------------
-# Banco (SQL Server) - Tabelas
+# Pool de conexões (compartilhado entre sessões)
+# ------------------------------
+# Cada get_conn() paga um handshake ODBC/TLS completo. O pool (PoolConexoes) guarda
+# conexões abertas e as reaproveita entre reruns e sessões do Streamlit; cada backend
+# tem o seu par de pools, ligado em armazenamento().
+POOL_TAMANHO_MAX = int(os.getenv("DB_POOL_MAX", "10"))              # conexões simultâneas
+POOL_OCIOSA_MAX_S = float(os.getenv("DB_POOL_IDLE_SECONDS", "300"))  # fecha ociosas após N s
+POOL_CHECAGEM_S = float(os.getenv("DB_POOL_CHECK_SECONDS", "30"))    # SELECT 1 se ociosa há > N s
+POOL_ESPERA_S = float(os.getenv("DB_POOL_TIMEOUT", "30"))            # espera máx. por uma vaga
+
+# Relatórios e exportações usam um pool à parte (conexao_leitura), com conexões no perfil de
+# leitura do backend (SNAPSHOT no SQL Server; get_read_conn do módulo DB, se existir): uma
+# leitura longa não ocupa vagas do lançamento nem bloqueia/é bloqueada pelos salvamentos.
+POOL_LEITURA_TAMANHO_MAX = int(os.getenv("DB_READ_POOL_MAX", "4"))
+LEITURA_ISOLAMENTO = os.getenv("DB_READ_ISOLATION", "snapshot").strip().lower()  # snapshot | read_committed
+
+def _pool_conexoes() -> PoolConexoes:
+    # um único pool por processo, compartilhado por todas as sessões
+    return armazenamento().pool
+
+def conexao():
+    """
+    Uso: `with conexao() as cn: ...`
+    Commit ao sair sem erro, rollback em caso de exceção; a conexão volta ao pool.
+    """
+    return _pool_conexoes().conexao()
+
+def _pool_leitura() -> PoolConexoes:
+    return armazenamento().pool_leitura
+
+def conexao_leitura():
+    """Como `conexao()`, mas no pool de leitura (relatórios e exportações; só SELECT)."""
+    return _pool_leitura().conexao()
+
+# ------------------------------
+# Instrumentação: consultas e reruns
+# ------------------------------
+# As conexões do pool passam por _ConexaoMedida: cada comando enviado ao banco é
+# cronometrado (execute + leitura das linhas), contado e agrupado pela "impressão
+# digital" do SQL (texto normalizado, sem literais). Cada rerun de página soma os seus
+# round-trips e tempo de banco; o resto do tempo do rerun é montagem da tela.
+# Os agregados ficam em memória por processo e aparecem na página "Performance" (admin).
+PERF_ATIVO = os.getenv("PERF_ENABLED", "1") != "0"
+PERF_CONSULTA_LENTA_MS = float(os.getenv("PERF_SLOW_QUERY_MS", "250"))    # entra no log de lentas
+PERF_RERUN_LENTO_MS = float(os.getenv("PERF_SLOW_RERUN_MS", "2000"))      # idem, para reruns
+PERF_LOG_LENTAS_MAX = int(os.getenv("PERF_SLOW_LOG_SIZE", "200"))         # últimas N ocorrências
+PERF_LOG_LENTAS_ARQUIVO = os.getenv("PERF_SLOW_LOG_FILE", "")             # opcional: JSON por linha
+PERF_PROMETHEUS_ARQUIVO = os.getenv("PERF_PROMETHEUS_FILE", "")           # opcional: textfile collector
+PERF_PROMETHEUS_INTERVALO_S = float(os.getenv("PERF_PROMETHEUS_INTERVAL", "15"))
+
+_RE_COMENTARIO = re.compile(r"--[^\n]*")
+_RE_TEXTO = re.compile(r"N?'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"(?<![\w.#@])-?\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACOS = re.compile(r"\s+")
+
+def normalizar_sql(sql: str) -> str:
+    """Texto do comando sem comentários, literais nem variações de espaço/listas IN."""
+    texto = _RE_COMENTARIO.sub(" ", sql)
+    texto = _RE_TEXTO.sub("?", texto)
+    texto = _RE_NUMERO.sub("?", texto)
+    texto = _RE_LISTA.sub("(?+)", texto)
+    return _RE_ESPACOS.sub(" ", texto).strip()
+
+_impressoes: Dict[str, Tuple[str, str]] = {}   # sql -> (impressão, texto normalizado)
+
+def impressao_sql(sql: str) -> Tuple[str, str]:
+    # o SQL da aplicação é fixo (parâmetros à parte): o cache fica pequeno
+    achado = _impressoes.get(sql)
+    if achado is None:
+        normal = normalizar_sql(sql)
+        achado = (hashlib.sha1(normal.encode("utf-8")).hexdigest()[:12], normal)
+        if len(_impressoes) < 5000:
+            _impressoes[sql] = achado
+    return achado
+
+class MedicaoConsulta:
+    __slots__ = ("impressao", "sql", "chamador", "ms", "linhas")
+
+    def __init__(self, impressao: str, sql: str, chamador: str):
+        self.impressao = impressao
+        self.sql = sql
+        self.chamador = chamador
+        self.ms = 0.0
+        self.linhas = 0
+
+class ColetorRerun:
+    """Consultas feitas durante um rerun (ou rerun de fragmento) de uma página."""
+
+    def __init__(self, pagina: str, usuario: str):
+        self.pagina = pagina
+        self.usuario = usuario
+        self.quando = datetime.now()
+        self.inicio = time.perf_counter()
+        self.total_ms = 0.0
+        self.consultas: List[MedicaoConsulta] = []
+
+    @property
+    def db_ms(self) -> float:
+        return sum(m.ms for m in self.consultas)
+
+    @property
+    def tela_ms(self) -> float:
+        return max(self.total_ms - self.db_ms, 0.0)
+
+    def resumo(self) -> pd.DataFrame:
+        """Consultas do rerun agrupadas por chamador + impressão, mais caras primeiro."""
+        if not self.consultas:
+            return pd.DataFrame(columns=["chamador", "consulta", "chamadas", "ms", "linhas", "sql"])
+        df = pd.DataFrame([(m.chamador, m.impressao, m.ms, m.linhas, m.sql) for m in self.consultas],
+                          columns=["chamador", "consulta", "ms", "linhas", "sql"])
+        return (df.groupby(["chamador", "consulta"], as_index=False, sort=False)
+                  .agg(chamadas=("ms", "size"), ms=("ms", "sum"), linhas=("linhas", "sum"), sql=("sql", "first"))
+                  .sort_values("ms", ascending=False, ignore_index=True))
+
+def _coletor_atual():
+    # o thread-local mora no objeto cacheado: as conexões do pool nasceram num rerun
+    # anterior do script e enxergam as globais daquele rerun, não as deste
+    return getattr(_desempenho().local, "coletor", None)
+
+class _CursorMedido:
+    """Cursor DB-API que cronometra execute/executemany e a leitura das linhas."""
+
+    def __init__(self, cur, perf: "Desempenho"):
+        self._cur = cur
+        self._perf = perf
+        self._medicao = None
+
+    def __getattr__(self, nome):
+        return getattr(self._cur, nome)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def fast_executemany(self):
+        return self._cur.fast_executemany
+
+    @fast_executemany.setter
+    def fast_executemany(self, valor):
+        self._cur.fast_executemany = valor
+
+    def _encerrar(self):
+        if self._medicao is not None:
+            self._perf.registrar_consulta(self._medicao)
+            self._medicao = None
+
+    def _executar(self, metodo, sql, args):
+        self._encerrar()
+        impressao, _ = impressao_sql(sql)
+        medicao = MedicaoConsulta(impressao, sql, ROTULO_CONSULTA.get())  # método do backend
+        t0 = time.perf_counter()
+        try:
+            metodo(sql, *args)
+        finally:
+            medicao.ms = (time.perf_counter() - t0) * 1000
+            coletor = getattr(self._perf.local, "coletor", None)
+            if coletor is not None:
+                coletor.consultas.append(medicao)
+        # DML: linhas afetadas; SELECT: contadas na leitura (rowcount = -1)
+        medicao.linhas = max(getattr(self._cur, "rowcount", -1) or 0, 0)
+        self._medicao = medicao
+        return self
+
+    def execute(self, sql, *params):
+        return self._executar(self._cur.execute, sql, params)
+
+    def executemany(self, sql, linhas):
+        return self._executar(self._cur.executemany, sql, (linhas,))
+
+    def _ler(self, metodo, *args):
+        t0 = time.perf_counter()
+        resultado = metodo(*args)
+        if self._medicao is not None:
+            self._medicao.ms += (time.perf_counter() - t0) * 1000
+            if isinstance(resultado, list):
+                self._medicao.linhas += len(resultado)
+            elif resultado is not None:
+                self._medicao.linhas += 1
+        return resultado
+
+    def fetchone(self):
+        return self._ler(self._cur.fetchone)
+
+    def fetchmany(self, n=1):
+        return self._ler(self._cur.fetchmany, n)
+
+    def fetchall(self):
+        return self._ler(self._cur.fetchall)
+
+    def close(self):
+        self._encerrar()
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _ConexaoMedida:
+    """Conexão do pool cujos cursores são medidos; o resto é repassado à conexão real."""
+
+    def __init__(self, cn, perf: "Desempenho"):
+        self._cn = cn
+        self._perf = perf
+        self._cursores: List[_CursorMedido] = []  # da transação atual
+
+    def __getattr__(self, nome):
+        return getattr(self._cn, nome)
+
+    def cursor(self):
+        cur = _CursorMedido(self._cn.cursor(), self._perf)
+        self._cursores.append(cur)
+        return cur
+
+    def _encerrar_cursores(self):
+        # cursores abandonados sem close() (ex.: cn.execute(...).fetchone()) são registrados
+        # no fim da transação: a saída do `with conexao()` sempre faz commit ou rollback
+        cursores, self._cursores = self._cursores, []
+        for cur in cursores:
+            cur._encerrar()
+
+    def commit(self):
+        self._encerrar_cursores()
+        self._cn.commit()
+
+    def rollback(self):
+        self._encerrar_cursores()
+        self._cn.rollback()
+
+    def close(self):
+        self._encerrar_cursores()
+        self._cn.close()
+
+    def execute(self, sql, *params):
+        # atalho do sqlite3 (cn.execute) passando pelo cursor medido
+        return self.cursor().execute(sql, *params)
+
+def _fabrica_medida(conectar, perf: "Desempenho"):
+    # fábrica do pool: conexões novas do backend, medidas se PERF_ENABLED. `perf` vem
+    # resolvido de fora: as conexões também servem threads sem rerun (FilaGravacao)
+    def _fabrica():
+        cn = conectar()
+        return _ConexaoMedida(cn, perf) if PERF_ATIVO else cn
+    return _fabrica
+
+class Desempenho:
+    """Agregados do processo: por consulta, por (página, usuário) e o log de lentas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local = threading.local()  # coletor do rerun em andamento em cada thread
+        self.desde = datetime.now()
+        self.consultas: Dict[str, dict] = {}                   # impressão -> agregados
+        self.reruns: Dict[Tuple[str, str], dict] = {}          # (página, usuário) -> agregados
+        self.lentas: deque = deque(maxlen=PERF_LOG_LENTAS_MAX)
+        self.total_lentas = 0
+        self._exportado_em = 0.0
+
+    def registrar_consulta(self, m: MedicaoConsulta):
+        with self._lock:
+            ag = self.consultas.get(m.impressao)
+            if ag is None:
+                ag = self.consultas[m.impressao] = {"chamador": m.chamador, "sql": impressao_sql(m.sql)[1],
+                                                    "chamadas": 0, "ms": 0.0, "max_ms": 0.0, "linhas": 0}
+            ag["chamadas"] += 1
+            ag["ms"] += m.ms
+            ag["max_ms"] = max(ag["max_ms"], m.ms)
+            ag["linhas"] += m.linhas
+        if m.ms >= PERF_CONSULTA_LENTA_MS:
+            coletor = getattr(self.local, "coletor", None)
+            self._anotar_lenta({"tipo": "consulta", "ms": round(m.ms, 1), "chamador": m.chamador,
+                                "consulta": m.impressao, "linhas": m.linhas,
+                                "pagina": coletor.pagina if coletor else "",
+                                "usuario": coletor.usuario if coletor else "",
+                                "sql": " ".join(m.sql.split())[:500]})
+
+    def registrar_rerun(self, c: ColetorRerun):
+        db_ms, n = c.db_ms, len(c.consultas)
+        with self._lock:
+            ag = self.reruns.setdefault((c.pagina, c.usuario), {"reruns": 0, "roundtrips": 0, "db_ms": 0.0,
+                                                                "tela_ms": 0.0, "max_ms": 0.0})
+            ag["reruns"] += 1
+            ag["roundtrips"] += n
+            ag["db_ms"] += db_ms
+            ag["tela_ms"] += c.tela_ms
+            ag["max_ms"] = max(ag["max_ms"], c.total_ms)
+        if c.total_ms >= PERF_RERUN_LENTO_MS:
+            self._anotar_lenta({"tipo": "rerun", "ms": round(c.total_ms, 1), "chamador": "",
+                                "consulta": "", "linhas": n, "pagina": c.pagina, "usuario": c.usuario,
+                                "sql": f"{n} round-trips, {db_ms:.0f} ms no banco, {c.tela_ms:.0f} ms de tela"})
+        self.exportar_prometheus()
+
+    def _anotar_lenta(self, registro: dict):
+        registro = {"quando": datetime.now().isoformat(timespec="seconds"), **registro}
+        with self._lock:
+            self.lentas.append(registro)
+            self.total_lentas += 1
+        if PERF_LOG_LENTAS_ARQUIVO:
+            try:
+                with open(PERF_LOG_LENTAS_ARQUIVO, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            except OSError:
+                pass  # o log em arquivo é auxiliar; nunca derruba a página
+
+    def zerar(self):
+        with self._lock:
+            self.desde = datetime.now()
+            self.consultas.clear()
+            self.reruns.clear()
+            self.lentas.clear()
+            self.total_lentas = 0
+
+    def tabela_consultas(self) -> pd.DataFrame:
+        with self._lock:
+            linhas = [{"consulta": k, **v} for k, v in self.consultas.items()]
+        df = pd.DataFrame(linhas, columns=["consulta", "chamador", "chamadas", "ms", "max_ms", "linhas", "sql"])
+        df["media_ms"] = df["ms"] / df["chamadas"].where(df["chamadas"] > 0)
+        return df.sort_values("ms", ascending=False, ignore_index=True)
+
+    def tabela_reruns(self) -> pd.DataFrame:
+        with self._lock:
+            linhas = [{"pagina": p, "usuario": u, **v} for (p, u), v in self.reruns.items()]
+        df = pd.DataFrame(linhas, columns=["pagina", "usuario", "reruns", "roundtrips", "db_ms", "tela_ms", "max_ms"])
+        n = df["reruns"].where(df["reruns"] > 0)
+        df["roundtrips_por_rerun"] = df["roundtrips"] / n
+        df["db_ms_por_rerun"] = df["db_ms"] / n
+        df["tela_ms_por_rerun"] = df["tela_ms"] / n
+        return df.sort_values(["pagina", "usuario"], ignore_index=True)
+
+    def tabela_lentas(self) -> pd.DataFrame:
+        with self._lock:
+            linhas = list(reversed(self.lentas))
+        return pd.DataFrame(linhas, columns=["quando", "tipo", "ms", "pagina", "usuario", "chamador",
+                                             "consulta", "linhas", "sql"])
+
+    def texto_prometheus(self) -> str:
+        """Métricas no formato texto do Prometheus (node_exporter textfile collector)."""
+        def _rotulos(**r) -> str:
+            def _escapar(v):
+                return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in r.items()) + "}"
+
+        with self._lock:
+            consultas = list(self.consultas.items())
+            reruns = list(self.reruns.items())
+            total_lentas = self.total_lentas
+        metricas = [
+            ("cadastro_hc_db_consultas_total", "counter", "Comandos enviados ao banco.",
+             [(_rotulos(consulta=k, chamador=v["chamador"]), v["chamadas"]) for k, v in consultas]),
+            ("cadastro_hc_db_consulta_segundos_total", "counter", "Tempo no banco (execução + leitura).",
+             [(_rotulos(consulta=k, chamador=v["chamador"]), v["ms"] / 1000) for k, v in consultas]),
+            ("cadastro_hc_db_consulta_max_segundos", "gauge", "Comando mais lento desde o início/zeragem.",
+             [(_rotulos(consulta=k, chamador=v["chamador"]), v["max_ms"] / 1000) for k, v in consultas]),
+            ("cadastro_hc_db_consulta_linhas_total", "counter", "Linhas lidas ou afetadas.",
+             [(_rotulos(consulta=k, chamador=v["chamador"]), v["linhas"]) for k, v in consultas]),
+            ("cadastro_hc_reruns_total", "counter", "Reruns de página (inclui fragmentos).",
+             [(_rotulos(pagina=p, usuario=u), v["reruns"]) for (p, u), v in reruns]),
+            ("cadastro_hc_rerun_roundtrips_total", "counter", "Round-trips ao banco feitos nos reruns.",
+             [(_rotulos(pagina=p, usuario=u), v["roundtrips"]) for (p, u), v in reruns]),
+            ("cadastro_hc_rerun_db_segundos_total", "counter", "Tempo de banco dentro dos reruns.",
+             [(_rotulos(pagina=p, usuario=u), v["db_ms"] / 1000) for (p, u), v in reruns]),
+            ("cadastro_hc_rerun_tela_segundos_total", "counter", "Tempo dos reruns fora do banco.",
+             [(_rotulos(pagina=p, usuario=u), v["tela_ms"] / 1000) for (p, u), v in reruns]),
+            ("cadastro_hc_lentas_total", "counter", "Ocorrências acima dos limites de lentidão.",
+             [("", total_lentas)]),
+        ]
+        saida = []
+        for nome, tipo, ajuda, amostras in metricas:
+            saida += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            saida += [f"{nome}{r} {v:g}" if isinstance(v, float) else f"{nome}{r} {v}" for r, v in amostras]
+        return "\n".join(saida) + "\n"
+
+    def exportar_prometheus(self, forcar: bool = False) -> bool:
+        if not PERF_PROMETHEUS_ARQUIVO:
+            return False
+        agora = time.monotonic()
+        with self._lock:
+            if not forcar and agora - self._exportado_em < PERF_PROMETHEUS_INTERVALO_S:
+                return False
+            self._exportado_em = agora
+        # grava ao lado e renomeia: o coletor nunca lê um arquivo pela metade
+        destino = os.path.abspath(PERF_PROMETHEUS_ARQUIVO)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destino), suffix=".prom.tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.texto_prometheus())
+            os.replace(tmp, destino)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+@st.cache_resource(show_spinner=False)
+def _desempenho() -> Desempenho:
+    return Desempenho()
+
+@contextmanager
+def medir_rerun(pagina: str):
+    """
+    Uso: `with medir_rerun("Relatórios"): ...` em volta do rerun da página.
+    Aninhado (fragmento dentro de um rerun completo) não abre um segundo coletor.
+    """
+    if not PERF_ATIVO or _coletor_atual() is not None:
+        yield None
+        return
+    coletor = ColetorRerun(pagina, st.session_state.get("user_email", ""))
+    local = _desempenho().local
+    local.coletor = coletor
+    try:
+        yield coletor
+    finally:
+        local.coletor = None
+        coletor.total_ms = (time.perf_counter() - coletor.inicio) * 1000
+        _desempenho().registrar_rerun(coletor)
+        # último rerun de cada página nesta sessão, para o detalhamento na página Performance
+        st.session_state.setdefault("perf_ultimos", {})[pagina] = coletor
+
+def rerun_medido(pagina: str):
+    """Decorador para fragmentos: o rerun só do fragmento também é medido."""
+    def _decorar(funcao):
+        @functools.wraps(funcao)
+        def _medida(*args, **kwargs):
+            with medir_rerun(pagina):
+                return funcao(*args, **kwargs)
+        return _medida
+    return _decorar
+
+# ------------------------------
+# Armazenamento (SQL Server ou SQLite embutido)
 # ------------------------------
+# Todo o SQL da aplicação fica em armazenamento_hc.py, atrás da interface `Armazenamento`.
+# O backend é escolhido por DB_BACKEND: "sqlserver" (padrão; usa o módulo DB + pyodbc) ou
+# "sqlite" (arquivo local em SQLITE_PATH, sem servidor nem driver; para notebooks, CI e
+# testes de desempenho). As funções da camada de dados cuidam de cache/invalidação e
+# delegam ao backend.
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlserver").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "cadastro_hc.sqlite3")
+
+BACKENDS = {
+    "sqlserver": lambda: ArmazenamentoSqlServer(LEITURA_ISOLAMENTO),
+    "sqlite": lambda: ArmazenamentoSqlite(SQLITE_PATH, POOL_ESPERA_S),
+}
+
+@st.cache_resource(show_spinner=False)
+def armazenamento() -> Armazenamento:
+    # um backend (com os seus dois pools) por processo, conforme DB_BACKEND
+    if DB_BACKEND not in BACKENDS:
+        raise ValueError(f"DB_BACKEND desconhecido: {DB_BACKEND!r} (use {' ou '.join(BACKENDS)})")
+    arm = BACKENDS[DB_BACKEND]()
+    arm.usar_pools(
+        PoolConexoes(_fabrica_medida(arm.conectar, _desempenho()), POOL_TAMANHO_MAX, POOL_OCIOSA_MAX_S,
+                     POOL_CHECAGEM_S, POOL_ESPERA_S),
+        PoolConexoes(_fabrica_medida(arm.conectar_leitura, _desempenho()), POOL_LEITURA_TAMANHO_MAX,
+                     POOL_OCIOSA_MAX_S, POOL_CHECAGEM_S, POOL_ESPERA_S),
+    )
+    return arm
+
+@st.cache_resource(show_spinner=False)
+def _schema_pronto() -> int:
+    # uma vez por processo; nos reruns seguintes é só um acerto de cache (sem banco)
+    with conexao() as cn:
+        return armazenamento().aplicar_migracoes(cn)
+
 def init_db():
-    cn = get_conn()
-    cur = cn.cursor()
-
-    # leaders
-    cur.execute("""
-    IF OBJECT_ID('dbo.leaders', 'U') IS NULL
-    CREATE TABLE dbo.leaders (
-        id         INT IDENTITY(1,1) PRIMARY KEY,
-        nome       NVARCHAR(200) NOT NULL,
-        setor      NVARCHAR(100) NOT NULL,
-        turno      NVARCHAR(20)  NOT NULL,
-        created_at DATETIME2      DEFAULT SYSDATETIME()
-    );
-    """)
-
-    # colaboradores
-    cur.execute("""
-    IF OBJECT_ID('dbo.colaboradores', 'U') IS NULL
-    CREATE TABLE dbo.colaboradores (
-        id         INT IDENTITY(1,1) PRIMARY KEY,
-        nome       NVARCHAR(200) NOT NULL,
-        setor      NVARCHAR(100) NOT NULL,
-        turno      NVARCHAR(20)  NOT NULL,
-        ativo      BIT           DEFAULT 1,
-        created_at DATETIME2      DEFAULT SYSDATETIME()
-    );
-    """)
-
-    # presencas (unique em colaborador_id+data)
-    cur.execute("""
-    IF OBJECT_ID('dbo.presencas', 'U') IS NULL
-    CREATE TABLE dbo.presencas (
-        id             INT IDENTITY(1,1) PRIMARY KEY,
-        colaborador_id INT         NOT NULL,
-        data           DATE        NOT NULL,
-        status         NVARCHAR(20) NULL,
-        setor          NVARCHAR(100) NOT NULL,
-        turno          NVARCHAR(20)  NOT NULL,
-        leader_nome    NVARCHAR(200) NULL,
-        created_at     DATETIME2      DEFAULT SYSDATETIME(),
-        updated_at     DATETIME2      NULL,
-        CONSTRAINT UQ_presenca UNIQUE (colaborador_id, data),
-        CONSTRAINT FK_presenca_colab FOREIGN KEY (colaborador_id) REFERENCES dbo.colaboradores(id)
-    );
-    """)
-
-    cn.commit()
-    cur.close()
-    cn.close()
+    return _schema_pronto()
 
 init_db()
 
@@ -213,161 +666,1266 @@ def datas_do_periodo(inicio: date, fim: date) -> List[date]:
     n = (fim - inicio).days + 1
     return [inicio + timedelta(days=i) for i in range(n)]
 
+# ------------------------------
+# Cache compartilhado entre processos (L2)
+# ------------------------------
+# As réplicas do Streamlit num mesmo host dividem um arquivo SQLite local com resultados
+# já calculados: quadro de colaboradores, presenças de cada grid e agregados de relatório.
+# As chaves levam a versão dos dados (versao_dados), então uma escrita feita por qualquer
+# réplica deixa as entradas antigas inalcançáveis (saem depois por idade/tamanho) e uma
+# réplica recém-iniciada aquece daqui em vez de repetir as consultas no banco.
+# É só um atalho: qualquer falha no arquivo cai na consulta normal ao banco.
+# O arquivo guarda só dados (DataFrames em Parquet, o resto em JSON), fica numa pasta
+# privada do usuário do serviço (criada com 0700) e é recusado se pasta ou arquivo forem
+# de outro usuário ou graváveis por outros.
+CACHE_L2_ATIVO = os.getenv("SHARED_CACHE_ENABLED", "1") != "0"
+CACHE_L2_CAMINHO = os.getenv("SHARED_CACHE_PATH", os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "cadastro_hc", "cache_l2.sqlite3"))
+CACHE_L2_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", "256"))
+CACHE_L2_TTL_S = float(os.getenv("SHARED_CACHE_TTL_SECONDS", "86400"))
+CACHE_L2_FORMATO = 3  # mude ao alterar o formato de algum valor guardado
+
+def _conferir_dono(info: os.stat_result, caminho: str, modo_proibido: int):
+    # sem getuid (Windows) a pasta de perfil já é do usuário
+    if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & modo_proibido):
+        raise PermissionError(f"{caminho}: precisa ser do usuário do serviço e não gravável por outros")
+
+def abrir_arquivo_privado(caminho: str) -> str:
+    """
+    Cria (se preciso) a pasta de `caminho` com 0700 e o arquivo com 0600 e confere que
+    os dois são do usuário do processo; PermissionError se não forem.
+    """
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    os.makedirs(pasta, mode=0o700, exist_ok=True)
+    info = os.lstat(pasta)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{pasta}: não é uma pasta")
+    _conferir_dono(info, pasta, 0o022)
+    fd = os.open(caminho, os.O_CREAT | os.O_RDWR | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        info = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if not stat.S_ISREG(info.st_mode):
+        raise PermissionError(f"{caminho}: não é um arquivo comum")
+    _conferir_dono(info, caminho, 0o022)
+    return caminho
+
+def _serializar_l2(valor) -> bytes:
+    if isinstance(valor, pd.DataFrame):
+        buf = io.BytesIO()
+        valor.to_parquet(buf, index=False)
+        return b"P" + buf.getvalue()
+    return b"J" + json.dumps(valor).encode("utf-8")
+
+def _desserializar_l2(dados: bytes):
+    if dados[:1] == b"P":
+        return pd.read_parquet(io.BytesIO(dados[1:]))
+    if dados[:1] == b"J":
+        return json.loads(dados[1:].decode("utf-8"))
+    raise ValueError("formato desconhecido no cache L2")
+
+class CacheCompartilhado:
+    """Chave -> valor (Parquet/JSON) num arquivo SQLite em WAL, usado por vários processos."""
+
+    def __init__(self, caminho: str, escopo: str, max_bytes: int, ttl_s: float):
+        self.caminho = caminho
+        self.escopo = escopo  # banco de origem: apps apontando para bancos diferentes não se misturam
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.acertos = self.faltas = self.erros = 0
+        self._gravacoes = 0
+        self._lock = threading.Lock()
+        self._cn = sqlite3.connect(abrir_arquivo_privado(caminho), timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+        self._cn.execute("PRAGMA journal_mode = WAL")
+        self._cn.execute("PRAGMA synchronous = NORMAL")
+        self._cn.execute("""
+        CREATE TABLE IF NOT EXISTS entradas (
+            chave     TEXT PRIMARY KEY,
+            valor     BLOB NOT NULL,
+            tamanho   INTEGER NOT NULL,
+            criada_em REAL NOT NULL
+        )
+        """)
+        self._cn.execute("CREATE INDEX IF NOT EXISTS IX_entradas_criada_em ON entradas (criada_em)")
+
+    def _chave(self, chave: tuple) -> str:
+        return hashlib.sha1(repr((CACHE_L2_FORMATO, self.escopo, chave)).encode("utf-8")).hexdigest()
+
+    def obter(self, chave: tuple) -> Tuple[bool, object]:
+        """(achou, valor)."""
+        try:
+            with self._lock:
+                row = self._cn.execute("SELECT valor FROM entradas WHERE chave = ? AND criada_em > ?",
+                                       (self._chave(chave), time.time() - self.ttl_s)).fetchone()
+            achou, valor = (False, None) if row is None else (True, _desserializar_l2(row[0]))
+        except Exception:
+            self.erros += 1
+            return False, None
+        if achou:
+            self.acertos += 1
+        else:
+            self.faltas += 1
+        return achou, valor
+
+    def gravar(self, chave: tuple, valor):
+        try:
+            dados = _serializar_l2(valor)
+            if len(dados) > self.max_bytes // 10:
+                return  # um único valor enorme expulsaria todo o resto
+            with self._lock:
+                self._cn.execute("INSERT OR REPLACE INTO entradas (chave, valor, tamanho, criada_em) "
+                                 "VALUES (?, ?, ?, ?)", (self._chave(chave), dados, len(dados), time.time()))
+                self._gravacoes += 1
+                if self._gravacoes % 50 == 0:
+                    self._podar()
+        except Exception:
+            self.erros += 1
+
+    def _podar(self):
+        # chamado com self._lock adquirido: vencidas por idade, depois as mais antigas
+        # até caber em 80% do limite
+        self._cn.execute("DELETE FROM entradas WHERE criada_em <= ?", (time.time() - self.ttl_s,))
+        self._cn.execute("""
+        DELETE FROM entradas WHERE chave IN (
+            SELECT chave FROM (
+                SELECT chave, SUM(tamanho) OVER (ORDER BY criada_em DESC) AS acumulado FROM entradas
+            ) WHERE acumulado > ?
+        )
+        """, (int(self.max_bytes * 0.8),))
+
+    def estatisticas(self) -> Dict[str, float]:
+        with self._lock:
+            n, total = self._cn.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM entradas").fetchone()
+        return {"entradas": n, "mb": total / 1_048_576, "acertos": self.acertos,
+                "faltas": self.faltas, "erros": self.erros}
+
+    def limpar(self):
+        with self._lock:
+            self._cn.execute("DELETE FROM entradas")
+
+@st.cache_resource(show_spinner=False)
+def _cache_l2() -> CacheCompartilhado | None:
+    if not CACHE_L2_ATIVO:
+        return None
+    try:
+        return CacheCompartilhado(CACHE_L2_CAMINHO, armazenamento().identidade(),
+                                  int(CACHE_L2_MAX_MB * 1_048_576), CACHE_L2_TTL_S)
+    except (sqlite3.Error, OSError):
+        return None  # sem arquivo de cache (ex.: diretório somente leitura): tudo vai ao banco
+
+def em_cache_compartilhado(chave: tuple, calcular):
+    """Valor de `chave` no L2; na falta, `calcular()` e guarda. A chave deve conter a versão dos dados."""
+    l2 = _cache_l2()
+    # na captura de planos o valor tem de vir do banco (senão não há plano a mostrar)
+    if l2 is None or _pool_conexoes().substituida_nesta_thread():
+        return calcular()
+    achou, valor = l2.obter(chave)
+    if not achou:
+        valor = calcular()
+        l2.gravar(chave, valor)
+    return valor
+
 # ------------------------------
 # Camada de dados
 # ------------------------------
 def get_or_create_leader(nome: str, setor: str, turno: str) -> int:
-    cn = get_conn(); cur = cn.cursor()
-    cur.execute("SELECT id FROM dbo.leaders WHERE nome=? AND setor=? AND turno=?", (nome.strip(), setor, turno))
-    row = cur.fetchone()
-    if row:
-        cur.close(); cn.close()
-        return int(row[0])
-    cur.execute("INSERT INTO dbo.leaders (nome, setor, turno) VALUES (?, ?, ?)", (nome.strip(), setor, turno))
-    cn.commit()
-    new_id = cur.execute("SELECT SCOPE_IDENTITY()").fetchone()[0]
-    cur.close(); cn.close()
-    return int(new_id)
-
-def listar_colaboradores(setor: str, turno: str, somente_ativos=True) -> pd.DataFrame:
-    cn = get_conn()
-    query = "SELECT id, nome, setor, turno, ativo FROM dbo.colaboradores WHERE setor=? AND turno=?"
-    if somente_ativos:
-        query += " AND ativo=1"
-    df = pd.read_sql(query, cn, params=(setor, turno))
-    cn.close()
-    return df
-
-def listar_colaboradores_por_setor(setor: str, somente_ativos=True) -> pd.DataFrame:
-    cn = get_conn()
-    query = "SELECT id, nome, setor, turno, ativo FROM dbo.colaboradores WHERE setor=?"
-    params = [setor]
-    if somente_ativos:
-        query += " AND ativo=1"
-    df = pd.read_sql(query, cn, params=params)
-    cn.close()
-    return df
-
-def listar_colaboradores_setor_turno(setor: str, turno: str, somente_ativos=True) -> pd.DataFrame:
-    cn = get_conn()
-    query = "SELECT id, nome, setor, turno, ativo FROM dbo.colaboradores WHERE setor=? AND turno=?"
-    params = [setor, turno]
-    if somente_ativos:
-        query += " AND ativo=1"
-    df = pd.read_sql(query, cn, params=params)
-    cn.close()
-    return df
-
-def listar_todos_colaboradores(somente_ativos: bool = False) -> pd.DataFrame:
-    cn = get_conn()
-    query = "SELECT id, nome, setor, turno, ativo FROM dbo.colaboradores"
-    if somente_ativos:
-        query += " WHERE ativo=1"
-    df = pd.read_sql(query, cn)
-    cn.close()
-    return df
+    return armazenamento().criar_leader(nome.strip(), setor, turno)
+
+# --- Dimensões: nome -> id (setores, turnos, status, leaders) ----------------
+# Os ids nunca mudam depois de criados, então o mapa é cacheado por processo.
+TABELAS_DIMENSAO = ("setores", "turnos", "status_presenca")
+
+class MapaIds:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids: Dict[tuple, int] = {}
+
+@st.cache_resource(show_spinner=False)
+def _mapa_ids() -> MapaIds:
+    return MapaIds()
+
+def invalidar_mapa_ids():
+    _mapa_ids.clear()
+
+def _id_cacheado(chave: tuple, criar) -> int:
+    mapa = _mapa_ids()
+    with mapa.lock:
+        if chave in mapa.ids:
+            return mapa.ids[chave]
+    novo = int(criar())
+    with mapa.lock:
+        mapa.ids[chave] = novo
+    return novo
+
+def id_dimensao(tabela: str, nome: str) -> int:
+    if tabela not in TABELAS_DIMENSAO:
+        raise ValueError(f"Tabela de dimensão desconhecida: {tabela}")
+
+    return _id_cacheado((tabela, nome), lambda: armazenamento().criar_dimensao(tabela, nome))
+
+def id_leader(nome: str, setor: str, turno: str) -> int | None:
+    nome = (nome or "").strip()
+    if not nome:
+        return None
+    return _id_cacheado(("leaders", nome, setor, turno), lambda: get_or_create_leader(nome, setor, turno))
+
+# --- Marca d'água de escrita ------------------------------------------------
+# Versão por tabela em versao_dados, incrementada a cada escrita feita pelo app (em
+# qualquer réplica); entra na chave dos caches derivados (quadro, exportação do dia,
+# cache compartilhado) para que nunca sirvam dado velho. Cada processo relê as versões
+# no máximo a cada VERSAO_DADOS_TTL_S; depois de uma escrita própria, relê na hora.
+# O incremento vem DEPOIS do commit da escrita: quem ler a versão nova já lê o dado novo.
+VERSAO_DADOS_TTL_S = float(os.getenv("DATA_VERSION_TTL_SECONDS", "2"))
+
+class MarcasEscrita:
+    def __init__(self, arm: Armazenamento):
+        self._arm = arm
+        self._lock = threading.Lock()
+        self._marcas: Dict[str, int] = {}
+        self._lidas_em = float("-inf")
+        self._geracao = 0  # muda a cada escrita local; descarta leituras que a precederam
+
+    def atual(self, *tabelas: str) -> Tuple[int, ...]:
+        with self._lock:
+            if time.monotonic() - self._lidas_em < VERSAO_DADOS_TTL_S:
+                return tuple(self._marcas.get(t, 0) for t in tabelas)
+            geracao = self._geracao
+        versoes = self._arm.versoes_dados()
+        with self._lock:
+            if geracao == self._geracao:
+                self._marcas, self._lidas_em = versoes, time.monotonic()
+        return tuple(versoes.get(t, 0) for t in tabelas)
+
+    def registrar(self, tabela: str):
+        self._arm.incrementar_versao(tabela)
+        with self._lock:
+            self._geracao += 1
+            self._lidas_em = float("-inf")
+
+@st.cache_resource(show_spinner=False)
+def _marcas_escrita() -> MarcasEscrita:
+    return MarcasEscrita(armazenamento())
+
+def marca_escrita(*tabelas: str) -> Tuple[int, ...]:
+    return _marcas_escrita().atual(*tabelas)
+
+def registrar_escrita(tabela: str):
+    _marcas_escrita().registrar(tabela)
+
+# --- Cache do quadro de colaboradores ---------------------------------------
+# O quadro muda poucas vezes por dia: carregamos dbo.colaboradores inteiro uma vez,
+# indexamos em memória por (setor, turno, ativo) e as listagens leem daqui.
+# O cache é por versão de "colaboradores" (escritas de outras réplicas também o
+# renovam) e a carga passa pelo cache compartilhado; o TTL é só uma rede de segurança.
+QUADRO_TTL_S = float(os.getenv("ROSTER_CACHE_TTL_SECONDS", "600"))
+
+class QuadroColaboradores:
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        # (setor, turno, ativo, eh_terceiro) -> posições das linhas em self.df
+        self._indice = self.df.groupby(["setor", "turno", "ativo", "eh_terceiro"],
+                                       dropna=False, sort=False).indices
+
+    def filtrar(self, setor: str | None = None, turno: str | None = None,
+                somente_ativos: bool = False, terceiros: bool | None = None) -> pd.DataFrame:
+        posicoes = [
+            pos for (s, t, a, e), pos in self._indice.items()
+            if (setor is None or s == setor)
+            and (turno is None or t == turno)
+            and (not somente_ativos or a == 1)
+            and (terceiros is None or bool(e) == terceiros)
+        ]
+        if not posicoes:
+            return self.df.iloc[0:0].copy()
+        # mantém a ordem por id, como o SELECT sem ORDER BY devolvia
+        return self.df.iloc[np.sort(np.concatenate(posicoes))].reset_index(drop=True)
+
+def _carregar_quadro() -> pd.DataFrame:
+    return armazenamento().carregar_quadro()
+
+@st.cache_resource(ttl=QUADRO_TTL_S, max_entries=2, show_spinner=False)
+def _quadro_na_versao(versao: Tuple[int, ...]) -> QuadroColaboradores:
+    return QuadroColaboradores(em_cache_compartilhado(("quadro", versao), _carregar_quadro))
+
+def _quadro_colaboradores() -> QuadroColaboradores:
+    return _quadro_na_versao(marca_escrita("colaboradores"))
+
+def invalidar_quadro_colaboradores():
+    registrar_escrita("colaboradores")
+    _quadro_na_versao.clear()
+
+# terceiros: None = todos; True = só terceiros; False = só SOMA (usa a coluna eh_terceiro)
+def listar_colaboradores(setor: str, turno: str, somente_ativos=True,
+                         terceiros: bool | None = None) -> pd.DataFrame:
+    return _quadro_colaboradores().filtrar(setor, turno, somente_ativos, terceiros)
+
+def listar_colaboradores_por_setor(setor: str, somente_ativos=True,
+                                   terceiros: bool | None = None) -> pd.DataFrame:
+    return _quadro_colaboradores().filtrar(setor, None, somente_ativos, terceiros)
+
+def listar_colaboradores_setor_turno(setor: str, turno: str, somente_ativos=True,
+                                     terceiros: bool | None = None) -> pd.DataFrame:
+    return _quadro_colaboradores().filtrar(setor, turno, somente_ativos, terceiros)
+
+def listar_todos_colaboradores(somente_ativos: bool = False,
+                               terceiros: bool | None = None) -> pd.DataFrame:
+    return _quadro_colaboradores().filtrar(None, None, somente_ativos, terceiros)
 
 def adicionar_colaborador(nome: str, setor: str, turno: str):
-    turno = normaliza_turno(turno)
-    cn = get_conn(); cur = cn.cursor()
-    cur.execute(
-        "INSERT INTO dbo.colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
-        (nome.strip(), setor, turno),
-    )
-    cn.commit(); cur.close(); cn.close()
+    armazenamento().adicionar_colaborador(nome.strip(), setor, normaliza_turno(turno))
+    invalidar_quadro_colaboradores()
 
 def atualizar_turno_colaborador(colab_id: int, novo_turno: str):
-    novo_turno = normaliza_turno(novo_turno)
-    cn = get_conn(); cur = cn.cursor()
-    cur.execute("UPDATE dbo.colaboradores SET turno=? WHERE id=?", (novo_turno, colab_id))
-    cn.commit(); cur.close(); cn.close()
+    armazenamento().atualizar_turno_colaborador(colab_id, normaliza_turno(novo_turno))
+    invalidar_quadro_colaboradores()
 
 def upsert_colaborador_turno(nome: str, setor: str, turno: str):
-    turno = normaliza_turno(turno)
-    cn = get_conn(); cur = cn.cursor()
-    cur.execute("SELECT id FROM dbo.colaboradores WHERE nome=? AND setor=?", (nome.strip(), setor))
-    row = cur.fetchone()
-    if row:
-        cur.execute("UPDATE dbo.colaboradores SET turno=?, ativo=1 WHERE id=?", (turno, int(row[0])))
-    else:
-        cur.execute(
-            "INSERT INTO dbo.colaboradores (nome, setor, turno, ativo) VALUES (?, ?, ?, 1)",
-            (nome.strip(), setor, turno),
-        )
-    cn.commit(); cur.close(); cn.close()
+    armazenamento().upsert_colaborador_turno(nome.strip(), setor, normaliza_turno(turno))
+    invalidar_quadro_colaboradores()
 
 def atualizar_ativo_colaboradores(ids_para_inativar: List[int], ids_para_ativar: List[int]):
-    cn = get_conn(); cur = cn.cursor()
-    if ids_para_inativar:
-        cur.execute(
-            f"UPDATE dbo.colaboradores SET ativo=0 WHERE id IN ({','.join('?'*len(ids_para_inativar))})",
-            ids_para_inativar,
-        )
-    if ids_para_ativar:
-        cur.execute(
-            f"UPDATE dbo.colaboradores SET ativo=1 WHERE id IN ({','.join('?'*len(ids_para_ativar))})",
-            ids_para_ativar,
-        )
-    cn.commit(); cur.close(); cn.close()
+    armazenamento().atualizar_ativo_colaboradores(ids_para_inativar, ids_para_ativar)
+    invalidar_quadro_colaboradores()
 
-def carregar_presencas(colab_ids: List[int], inicio: date, fim: date) -> Dict[Tuple[int, str], str]:
+def carregar_presencas(colab_ids: List[int], inicio: date, fim: date) -> pd.DataFrame:
+    """
+    Presenças no intervalo: colunas colaborador_id, data (date nativa), status e versao
+    (a versão da linha, para conferir no salvamento se alguém a alterou depois).
+    """
     if not colab_ids:
-        return {}
-    cn = get_conn(); cur = cn.cursor()
-    placeholders = ",".join("?" * len(colab_ids))
-    cur.execute(
-        f"""
-        SELECT colaborador_id,
-               CONVERT(varchar(10), data, 23) AS data_iso,  -- yyyy-mm-dd
-               status
-        FROM dbo.presencas
-        WHERE colaborador_id IN ({placeholders})
-          AND data BETWEEN ? AND ?
-        """,
-        [*colab_ids, inicio, fim],
-    )
-    out = {(int(cid), d): (s or "") for cid, d, s in cur.fetchall()}
-    cur.close(); cn.close()
-    return out
+        return pd.DataFrame(columns=["colaborador_id", "data", "status", "versao"])
+    # o conjunto de ids identifica o grid (setor/turno/filtro); a ordem não importa
+    ids = hashlib.sha1(_ids_json(sorted(colab_ids)).encode()).hexdigest()
+    return em_cache_compartilhado(("presencas", ids, inicio, fim, marca_escrita("presencas")),
+                                  lambda: armazenamento().carregar_presencas(colab_ids, inicio, fim))
 
-def salvar_presencas(df_editado: pd.DataFrame, mapa_id_por_nome: Dict[str, int],
-                     inicio: date, fim: date, setor: str, turno: str, leader_nome: str):
+def _derreter_grid(df: pd.DataFrame, mapa_id_por_nome: Dict[str, int]) -> pd.DataFrame:
     # derrete apenas as colunas de DATA (ignora "Colaborador" e "Setor")
-    date_cols = [c for c in df_editado.columns if c not in ("Colaborador", "Setor")]
-    melt = df_editado.melt(id_vars=["Colaborador", "Setor"],
-                           value_vars=date_cols,
-                           var_name="data",
-                           value_name="status")
+    date_cols = [c for c in df.columns if c not in ("Colaborador", "Setor")]
+    melt = df.melt(id_vars=["Colaborador", "Setor"],
+                   value_vars=date_cols,
+                   var_name="data",
+                   value_name="status")
     melt["data_iso"] = pd.to_datetime(melt["data"]).dt.date   # -> datetime.date
     melt["colaborador_id"] = melt["Colaborador"].map(mapa_id_por_nome)
     melt = melt.dropna(subset=["colaborador_id"])
+    melt["colaborador_id"] = melt["colaborador_id"].astype(int)
+    melt["status"] = melt["status"].fillna("").astype(str).str.strip()
+    # nomes repetidos apontam para o mesmo id: vale a última linha (como no salvamento linha a linha)
+    return melt.drop_duplicates(subset=["colaborador_id", "data_iso"], keep="last")
+
+def diferencas_presencas(df_base: pd.DataFrame, df_editado: pd.DataFrame,
+                         mapa_id_por_nome: Dict[str, int]) -> pd.DataFrame:
+    """
+    Compara o grid editado com o grid hidratado do banco e devolve apenas as células
+    inseridas/alteradas/limpas (colunas colaborador_id, data_iso, status).
+    """
+    novo = _derreter_grid(df_editado, mapa_id_por_nome)
+    antigo = _derreter_grid(df_base, mapa_id_por_nome)[["colaborador_id", "data_iso", "status"]]
+    comp = novo.merge(antigo, on=["colaborador_id", "data_iso"], how="left", suffixes=("", "_base"))
+    comp["status_base"] = comp["status_base"].fillna("")
+    return comp.loc[comp["status"] != comp["status_base"], ["colaborador_id", "data_iso", "status"]]
+
+def _linhas_alteradas(df_editado: pd.DataFrame, mapa_id_por_nome: Dict[str, int],
+                      df_base: pd.DataFrame | None) -> List[tuple]:
+    # com df_base (grid como veio do banco), só as células que mudaram
+    if df_base is not None:
+        melt = diferencas_presencas(df_base, df_editado, mapa_id_por_nome)
+    else:
+        melt = _derreter_grid(df_editado, mapa_id_por_nome)
+    return list(zip(melt["colaborador_id"].tolist(),
+                    melt["data_iso"].tolist(),
+                    melt["status"].tolist()))
 
-    cn = get_conn(); cur = cn.cursor()
+def _validar_status(linhas: List[tuple]):
+    invalidos = {linha[2] for linha in linhas} - set(STATUS_OPCOES)
+    if invalidos:
+        raise ValueError(f"Status inválido: {', '.join(sorted(invalidos))}")
 
-    for _, r in melt.iterrows():
-        status = (r["status"] or "").strip()
-        cid = int(r["colaborador_id"])
-        dte = r["data_iso"]  # datetime.date
+COLUNAS_CONFLITO = ["colaborador_id", "data", "status_atual", "status_tentado", "versao_atual"]
 
-        if status == "":
-            cur.execute(
-                "DELETE FROM dbo.presencas WHERE colaborador_id=? AND data=?",
-                (cid, dte),
-            )
-        else:
-            cur.execute("""
-            MERGE dbo.presencas AS T
-            USING (VALUES (?, ?)) AS S(colaborador_id, data)
-                 ON T.colaborador_id = S.colaborador_id AND T.data = S.data
-            WHEN MATCHED THEN
-                UPDATE SET status=?, setor=?, turno=?, leader_nome=?, updated_at=SYSDATETIME()
-            WHEN NOT MATCHED THEN
-                INSERT (colaborador_id, data, status, setor, turno, leader_nome, created_at, updated_at)
-                VALUES (S.colaborador_id, S.data, ?, ?, ?, ?, SYSDATETIME(), SYSDATETIME());
-            """, (cid, dte, status, setor, turno, leader_nome, status, setor, turno, leader_nome))
-
-    cn.commit()
-    cur.close(); cn.close()
+def versoes_presencas(presencas: pd.DataFrame) -> Dict[Tuple[int, date], int]:
+    """{(colaborador_id, data): versao} de um resultado de carregar_presencas."""
+    return dict(zip(zip(presencas["colaborador_id"].astype(int).tolist(), presencas["data"].tolist()),
+                    presencas["versao"].astype(int).tolist()))
+
+def gravar_linhas_presencas(linhas: List[tuple], setor: str, turno: str,
+                            leader_nome: str) -> Tuple[int, pd.DataFrame]:
+    """
+    Grava (colaborador_id, data, status[, versão lida]); status vazio apaga a presença.
+    Devolve (linhas afetadas, conflitos): células que outra pessoa alterou depois da
+    leitura não são gravadas e voltam em `conflitos` (colunas COLUNAS_CONFLITO).
+    """
+    # status desconhecido viraria status_id NULL no MERGE (o LEFT JOIN aceita o '' de apagar)
+    _validar_status(linhas)
+    # resolvidos (e criados, se preciso) antes da transação do salvamento
+    return _gravar_com_ids(armazenamento(), _marcas_escrita(), linhas,
+                           ids_presencas(setor, turno, leader_nome))
+
+def ids_presencas(setor: str, turno: str, leader_nome: str) -> Tuple[int, int, int | None]:
+    """(setor_id, turno_id, leader_id) de uma gravação, criados se preciso."""
+    return id_dimensao("setores", setor), id_dimensao("turnos", turno), id_leader(leader_nome, setor, turno)
+
+def _gravar_com_ids(arm: Armazenamento, marcas: MarcasEscrita, linhas: List[tuple],
+                    ids: Tuple[int, int, int | None]) -> Tuple[int, pd.DataFrame]:
+    # sem st.cache_*: também roda na thread do diário (FilaGravacao), fora de um rerun;
+    # quem chama valida os status antes (gravar_linhas_presencas / FilaGravacao)
+    afetadas, conflitos = arm.gravar_presencas(linhas, *ids)
+    if afetadas:
+        marcas.registrar("presencas")
+    return afetadas, pd.DataFrame(conflitos, columns=COLUNAS_CONFLITO)
+
+def salvar_presencas(df_editado: pd.DataFrame, mapa_id_por_nome: Dict[str, int],
+                     inicio: date, fim: date, setor: str, turno: str, leader_nome: str,
+                     df_base: pd.DataFrame | None = None,
+                     versoes: Dict[Tuple[int, date], int] | None = None) -> Tuple[int, pd.DataFrame]:
+    """
+    Com `versoes` (versoes_presencas do que foi hidratado), cada célula só é gravada se
+    ninguém a alterou desde a leitura; sem, a última escrita vence.
+    """
+    linhas = _linhas_alteradas(df_editado, mapa_id_por_nome, df_base)
+    if not linhas:
+        return 0, pd.DataFrame(columns=COLUNAS_CONFLITO)
+    if versoes is not None:
+        linhas = [(cid, d, status, versoes.get((cid, d), 0)) for cid, d, status in linhas]
+    return gravar_linhas_presencas(linhas, setor, turno, leader_nome)
+
+# ------------------------------
+# Gravação adiada do lançamento (write-behind)
+# ------------------------------
+# Com SAVE_WRITE_BEHIND=1, "Salvar dia" só valida as células alteradas e as grava num
+# diário local (SQLite com fsync no commit); uma thread do processo descarrega o diário
+# no banco a cada SAVE_FLUSH_INTERVAL segundos, ficando só com a última edição de cada
+# (colaborador_id, data). O grid sobrepõe o que ainda está pendente ao que veio do banco,
+# então quem salvou já vê o próprio dado. Réplicas no mesmo host dividem o diário e só
+# uma por vez descarrega (arrendamento), para que edições da mesma célula cheguem ao
+# banco na ordem em que foram salvas.
+# Cada edição leva o valor que a pessoa via na célula e a versão hidratada do banco: a
+# descarga confere as duas (edição salva sem ver outra ainda pendente, ou célula que
+# outra pessoa mudou no banco) e manda o que não bate para `rejeitadas` como conflito,
+# que o grid mostra a quem salvou.
+# O diário guarda edições que ainda não estão no banco: o caminho é absoluto (o mesmo
+# para todas as réplicas, qualquer que seja o diretório de trabalho) e o padrão fica na
+# pasta de estado do usuário do serviço, privada como a do cache L2 (não em ~/.cache,
+# que pode ser limpo).
+ESCRITA_ADIADA = os.getenv("SAVE_WRITE_BEHIND", "0") == "1"
+DIARIO_CAMINHO = os.path.abspath(os.getenv("SAVE_JOURNAL_PATH") or os.path.join(
+    os.getenv("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"),
+    "cadastro_hc", "diario.sqlite3"))
+DIARIO_INTERVALO_S = float(os.getenv("SAVE_FLUSH_INTERVAL", "1"))
+DIARIO_LOTE_MAX = int(os.getenv("SAVE_FLUSH_BATCH", "5000"))      # edições lidas por descarga
+DIARIO_TENTATIVAS_MAX = int(os.getenv("SAVE_FLUSH_RETRIES", "5"))  # depois disso a edição é rejeitada
+DIARIO_ARRENDAMENTO_S = float(os.getenv("SAVE_LEASE_SECONDS", "60"))  # posse da descarga (renovada a cada grupo)
+
+class FilaGravacao:
+    """
+    Diário durável de edições do lançamento + thread que o descarrega no banco.
+    A thread só usa o backend e as marcas recebidos aqui, e cada edição chega com os ids
+    de setor/turno/leader já resolvidos: nada de st.cache_* fora de um rerun.
+    """
+
+    def __init__(self, caminho: str, intervalo_s: float, lote_max: int, arrendamento_s: float,
+                 arm: Armazenamento, marcas: MarcasEscrita):
+        self.caminho = caminho
+        self.intervalo_s = intervalo_s
+        self.lote_max = lote_max
+        self.arrendamento_s = arrendamento_s
+        self._arm = arm
+        self._marcas = marcas
+        self.processo = f"{os.getpid()}:{id(self)}"
+        self.ultima_descarga: datetime | None = None
+        self.ultimo_erro: Tuple[datetime, str] | None = None
+        self.gravadas = 0      # células gravadas no banco por este processo
+        self.coalescidas = 0   # edições descartadas por terem sido substituídas antes da gravação
+        self._lock = threading.Lock()  # uma conexão, várias threads
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._cn = sqlite3.connect(caminho, timeout=30, isolation_level=None, check_same_thread=False)
+        self._cn.execute("PRAGMA journal_mode = WAL")
+        self._cn.execute("PRAGMA synchronous = FULL")  # a edição só é "recebida" depois do fsync
+        self._cn.execute("""
+        CREATE TABLE IF NOT EXISTS pendencias (
+            seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+            colaborador_id INTEGER NOT NULL,
+            data           TEXT    NOT NULL,
+            status         TEXT    NOT NULL,
+            setor          TEXT    NOT NULL,
+            turno          TEXT    NOT NULL,
+            leader_nome    TEXT    NOT NULL,
+            recebida_em    REAL    NOT NULL,
+            tentativas     INTEGER NOT NULL DEFAULT 0,
+            visto          TEXT    NULL,   -- valor da célula no grid de quem salvou (NULL: sem conferência)
+            versao         INTEGER NULL,   -- versão hidratada do banco
+            setor_id       INTEGER NULL,   -- ids resolvidos ao enfileirar (NULL: diário antigo)
+            turno_id       INTEGER NULL,
+            leader_id      INTEGER NULL
+        )
+        """)
+        self._cn.execute("CREATE INDEX IF NOT EXISTS IX_pendencias_data ON pendencias (data, colaborador_id)")
+        self._cn.execute("""
+        CREATE TABLE IF NOT EXISTS rejeitadas (
+            seq INTEGER PRIMARY KEY, colaborador_id INTEGER, data TEXT, status TEXT,
+            setor TEXT, turno TEXT, leader_nome TEXT, recebida_em REAL, erro TEXT,
+            conflito INTEGER NOT NULL DEFAULT 0, status_atual TEXT
+        )
+        """)
+        # diários criados antes da conferência de versão (e dos ids) ganham as colunas novas
+        with self._transacao() as cn:
+            for tabela, coluna, tipo in (("pendencias", "visto", "TEXT NULL"),
+                                         ("pendencias", "versao", "INTEGER NULL"),
+                                         ("pendencias", "setor_id", "INTEGER NULL"),
+                                         ("pendencias", "turno_id", "INTEGER NULL"),
+                                         ("pendencias", "leader_id", "INTEGER NULL"),
+                                         ("rejeitadas", "conflito", "INTEGER NOT NULL DEFAULT 0"),
+                                         ("rejeitadas", "status_atual", "TEXT")):
+                if coluna not in {r[1] for r in cn.execute(f"PRAGMA table_info({tabela})")}:
+                    cn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+        self._cn.execute("""
+        CREATE TABLE IF NOT EXISTS descarga (
+            id        INTEGER PRIMARY KEY CHECK (id = 1),
+            processo  TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        )
+        """)
+        self._thread = threading.Thread(target=self._laco, name="cadastro_hc-gravacao", daemon=True)
+        self._thread.start()
+        atexit.register(self.parar)
+
+    @contextmanager
+    def _transacao(self):
+        with self._lock:
+            self._cn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._cn
+                self._cn.execute("COMMIT")
+            except BaseException:
+                self._cn.execute("ROLLBACK")
+                raise
+
+    def enfileirar(self, linhas: List[tuple], setor: str, turno: str, leader_nome: str,
+                   ids: Tuple[int, int, int | None]) -> int:
+        """
+        Grava (colaborador_id, data, status[, valor visto, versão lida]) no diário; volta
+        assim que estiver em disco. Sem os dois últimos, a descarga não confere conflitos.
+        `ids` = ids_presencas(setor, turno, leader_nome), resolvido por quem enfileira.
+        """
+        agora = time.time()
+        with self._transacao() as cn:
+            cn.executemany(
+                "INSERT INTO pendencias (colaborador_id, data, status, setor, turno, leader_nome, recebida_em, "
+                "visto, versao, setor_id, turno_id, leader_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(int(c), d, s, setor, turno, leader_nome or "", agora, *(resto or (None, None)), *ids)
+                 for c, d, s, *resto in linhas])
+        return len(linhas)
+
+    def pendentes(self, colab_ids: List[int], inicio: date, fim: date) -> pd.DataFrame:
+        """Última edição ainda não gravada de cada célula (mesmas colunas de carregar_presencas)."""
+        with self._lock:
+            df = pd.read_sql("""
+            SELECT colaborador_id, data, status FROM pendencias
+             WHERE data BETWEEN ? AND ? AND colaborador_id IN (SELECT value FROM json_each(?))
+             ORDER BY seq
+            """, self._cn, params=(inicio, fim, _ids_json(colab_ids)))
+        df = df.drop_duplicates(subset=["colaborador_id", "data"], keep="last").reset_index(drop=True)
+        df["data"] = pd.to_datetime(df["data"]).dt.date
+        return df
+
+    def contagens(self, colab_ids: List[int] | None = None,
+                  dia: date | None = None) -> Tuple[int, int, int]:
+        """
+        (pendentes, rejeitadas por erro, conflitos), no diário todo ou só das células de
+        `colab_ids` em `dia`.
+        """
+        filtro, params = "1 = 1", ()
+        if colab_ids is not None:
+            filtro = "data = ? AND colaborador_id IN (SELECT value FROM json_each(?))"
+            params = (dia, _ids_json(colab_ids))
+        with self._lock:
+            pend = self._cn.execute(f"SELECT COUNT(*) FROM pendencias WHERE {filtro}", params).fetchone()[0]
+            rej, conf = self._cn.execute(
+                f"SELECT COUNT(*) - COALESCE(SUM(conflito), 0), COALESCE(SUM(conflito), 0) "
+                f"FROM rejeitadas WHERE {filtro}", params).fetchone()
+        return pend, rej, conf
+
+    def rejeitadas(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql("SELECT * FROM rejeitadas ORDER BY seq DESC", self._cn)
+
+    def conflitos(self, colab_ids: List[int], dia: date) -> pd.DataFrame:
+        """Edições das células de `colab_ids` em `dia` que a descarga recusou por conflito."""
+        with self._lock:
+            return pd.read_sql("""
+            SELECT seq, colaborador_id, data, status_atual, status AS status_tentado FROM rejeitadas
+             WHERE conflito = 1 AND data = ? AND colaborador_id IN (SELECT value FROM json_each(?))
+             ORDER BY seq
+            """, self._cn, params=(dia, _ids_json(colab_ids)))
+
+    def dispensar(self, seqs: List[int]):
+        """Tira do diário os conflitos que a pessoa já viu."""
+        with self._transacao() as cn:
+            cn.execute("DELETE FROM rejeitadas WHERE conflito = 1 AND seq IN (SELECT value FROM json_each(?))",
+                       (json.dumps([int(s) for s in seqs]),))
+
+    def _arrendar(self) -> bool:
+        agora = time.time()
+        with self._transacao() as cn:
+            row = cn.execute("SELECT processo, expira_em FROM descarga WHERE id = 1").fetchone()
+            livre = row is None or row[0] == self.processo or row[1] < agora
+            if livre:
+                cn.execute("INSERT OR REPLACE INTO descarga (id, processo, expira_em) VALUES (1, ?, ?)",
+                           (self.processo, agora + self.arrendamento_s))
+        return livre
+
+    def _liberar(self):
+        with self._transacao() as cn:
+            cn.execute("DELETE FROM descarga WHERE id = 1 AND processo = ?", (self.processo,))
+
+    def descarregar(self) -> int:
+        """Grava no banco um lote do diário; devolve quantas edições foram lidas."""
+        if not self._arrendar():
+            return 0  # outra réplica do host está descarregando
+        with self._lock:
+            rows = self._cn.execute(
+                "SELECT seq, colaborador_id, data, status, visto, versao, setor, turno, leader_nome, "
+                "setor_id, turno_id, leader_id FROM pendencias ORDER BY seq LIMIT ?", (self.lote_max,)).fetchall()
+        if not rows:
+            self.ultimo_erro = None
+            return 0
+
+        # última edição de cada célula; as anteriores só saem do diário. A conferência com
+        # o banco usa o que a PRIMEIRA edição da célula viu: as seguintes partiram dela.
+        ultima: Dict[tuple, tuple] = {}
+        seqs: Dict[tuple, List[int]] = {}
+        lido: Dict[tuple, tuple] = {}
+        atropeladas: Dict[int, str] = {}   # seq -> edição pendente que quem salvou não viu
+        ids_legados: Dict[tuple, tuple] = {}
+        for seq, cid, data, status, visto, versao, setor, turno, leader, *ids in rows:
+            anterior = ultima.get((cid, data))
+            if anterior is None:
+                lido[(cid, data)] = (visto, versao)
+            elif visto is not None and visto != anterior[0] and status != anterior[0]:
+                atropeladas[seq] = anterior[0]
+                continue
+            if ids[0] is None:
+                chave = (setor, turno, leader)
+                if chave not in ids_legados:
+                    ids_legados[chave] = self._resolver_ids(*chave)
+                ids = ids_legados[chave]
+            ultima[(cid, data)] = (status, tuple(ids))
+            seqs.setdefault((cid, data), []).append(seq)
+        grupos: Dict[tuple, List[tuple]] = {}
+        for (cid, data), (status, ids) in ultima.items():
+            grupos.setdefault(ids, []).append((cid, data))
+        if atropeladas:
+            self._registrar_conflitos(atropeladas)
+
+        falhas = []
+        tentados = 0
+        for ids, celulas in grupos.items():
+            # renovado a cada grupo: uma descarga longa (esperas no pool) não deixa o
+            # arrendamento vencer no meio, com outra réplica gravando as mesmas pendências
+            if not self._arrendar():
+                break
+            tentados += 1
+            feitas = [s for c in celulas for s in seqs[c]]
+            try:
+                n, conflitos = self._gravar_conferindo(celulas, ultima, lido, ids)
+            except Exception as e:
+                falhas.append((feitas, str(e)))
+                continue
+            if conflitos:
+                self._registrar_conflitos({seqs[c][-1]: atual for c, atual in conflitos.items()})
+            with self._transacao() as cn:
+                # só apaga se o arrendamento ainda é deste processo; senão quem o tomou
+                # regrava as mesmas células (com a última edição de cada uma)
+                cn.execute("""
+                DELETE FROM pendencias
+                 WHERE seq IN (SELECT value FROM json_each(?))
+                   AND EXISTS (SELECT 1 FROM descarga WHERE id = 1 AND processo = ? AND expira_em >= ?)
+                """, (json.dumps(feitas), self.processo, time.time()))
+            self.gravadas += n
+            self.coalescidas += len(feitas) - len(celulas)
+
+        if not tentados:
+            return 0  # o arrendamento passou para outra réplica antes do primeiro grupo
+        if falhas and len(falhas) == tentados:
+            # nada passou: trata como banco indisponível (o laço tenta de novo, sem rejeitar nada)
+            raise RuntimeError(falhas[-1][1])
+        self.ultima_descarga = datetime.now()
+        self.ultimo_erro = (datetime.now(), falhas[-1][1]) if falhas else None
+        if falhas:
+            self._registrar_falhas(falhas)
+        return len(rows)
+
+    def _resolver_ids(self, setor: str, turno: str, leader: str) -> Tuple[int, int, int | None]:
+        # pendências de um diário anterior aos ids: mesmos get-or-create de ids_presencas,
+        # direto no backend (sem o mapa de ids, que é um st.cache_resource)
+        nome = (leader or "").strip()
+        return (self._arm.criar_dimensao("setores", setor), self._arm.criar_dimensao("turnos", turno),
+                self._arm.criar_leader(nome, setor, turno) if nome else None)
+
+    def _gravar_conferindo(self, celulas: List[tuple], ultima: Dict[tuple, tuple], lido: Dict[tuple, tuple],
+                           ids: Tuple[int, int, int | None]) -> Tuple[int, Dict[tuple, str]]:
+        """Grava as células de um grupo; devolve (gravadas, {célula: status no banco} dos conflitos)."""
+        linhas, vistos = [], {}
+        for cid, data in celulas:
+            visto, versao = lido[(cid, data)]
+            d = date.fromisoformat(data)
+            linhas.append((cid, d, ultima[(cid, data)][0], VERSAO_QUALQUER if visto is None else int(versao)))
+            vistos[(cid, d)] = visto
+        _validar_status(linhas)  # falha = edição rejeitada depois de DIARIO_TENTATIVAS_MAX
+        n, conflitos = _gravar_com_ids(self._arm, self._marcas, linhas, ids)
+        # versão mudou, mas o banco tem o valor que a pessoa via (ex.: a edição anterior dela,
+        # gravada por uma descarga entre a hidratação e esta): nada se perde, grava por cima
+        # da versão atual. Se mudar de novo até lá, é conflito.
+        regravar = [(c.colaborador_id, c.data, c.status_tentado,
+                     0 if pd.isna(c.versao_atual) else int(c.versao_atual))
+                    for c in conflitos.itertuples() if c.status_atual == vistos[(c.colaborador_id, c.data)]]
+        restantes = {(c.colaborador_id, c.data.isoformat()): c.status_atual for c in conflitos.itertuples()
+                     if c.status_atual != vistos[(c.colaborador_id, c.data)]}
+        if regravar:
+            n2, conflitos = _gravar_com_ids(self._arm, self._marcas, regravar, ids)
+            n += n2
+            restantes.update({(c.colaborador_id, c.data.isoformat()): c.status_atual
+                              for c in conflitos.itertuples()})
+        return n, restantes
+
+    def _registrar_conflitos(self, conflitos: Dict[int, str]):
+        # {seq: status que estava no banco (ou pendente no diário)}; a edição sai da fila
+        with self._transacao() as cn:
+            cn.executemany("""
+            INSERT INTO rejeitadas (seq, colaborador_id, data, status, setor, turno, leader_nome, recebida_em,
+                                    erro, conflito, status_atual)
+            SELECT seq, colaborador_id, data, status, setor, turno, leader_nome, recebida_em,
+                   'conflito: outra pessoa salvou ' || CASE WHEN ? = '' THEN '(vazio)' ELSE ? END, 1, ?
+              FROM pendencias WHERE seq = ?
+            """, [(atual, atual, atual, seq) for seq, atual in conflitos.items()])
+            cn.executemany("DELETE FROM pendencias WHERE seq = ?", [(seq,) for seq in conflitos])
+
+    def _registrar_falhas(self, falhas: List[Tuple[List[int], str]]):
+        # o banco aceitou outros grupos do mesmo lote, então o problema é da edição: depois
+        # de DIARIO_TENTATIVAS_MAX descargas assim ela sai da fila (senão seguraria o diário)
+        with self._transacao() as cn:
+            for seqs, erro in falhas:
+                lista = json.dumps(seqs)
+                cn.execute("UPDATE pendencias SET tentativas = tentativas + 1 "
+                           "WHERE seq IN (SELECT value FROM json_each(?))", (lista,))
+                cn.execute("""
+                INSERT INTO rejeitadas (seq, colaborador_id, data, status, setor, turno, leader_nome, recebida_em, erro)
+                SELECT seq, colaborador_id, data, status, setor, turno, leader_nome, recebida_em, ?
+                  FROM pendencias WHERE seq IN (SELECT value FROM json_each(?)) AND tentativas >= ?
+                """, (erro, lista, DIARIO_TENTATIVAS_MAX))
+                cn.execute("DELETE FROM pendencias WHERE seq IN (SELECT value FROM json_each(?)) "
+                           "AND tentativas >= ?", (lista, DIARIO_TENTATIVAS_MAX))
+
+    def _laco(self):
+        espera = self.intervalo_s
+        while True:
+            self._acordar.wait(espera)
+            self._acordar.clear()
+            parar = self._parar.is_set()
+            try:
+                while self.descarregar() >= self.lote_max:
+                    pass  # diário acumulado: descarrega os lotes seguintes sem esperar
+                espera = self.intervalo_s
+            except Exception as e:
+                # banco fora do ar etc.: tenta de novo com espera crescente; nada se perde
+                self.ultimo_erro = (datetime.now(), str(e))
+                espera = min(espera * 2, 60.0)
+            if parar:
+                return
+
+    def descarregar_agora(self):
+        self._acordar.set()
+
+    def parar(self, espera_s: float = 10.0):
+        # última descarga ao encerrar o processo; o que não couber fica no diário
+        self._parar.set()
+        self._acordar.set()
+        self._thread.join(espera_s)
+        if not self._thread.is_alive():
+            # sem isso o diário fica parado até o arrendamento vencer após um restart
+            try:
+                self._liberar()
+            except sqlite3.Error:
+                pass
+
+@st.cache_resource(show_spinner=False)
+def _fila_gravacao() -> FilaGravacao:
+    # uma fila (e uma thread) por processo; backend e marcas resolvidos aqui, no rerun
+    return FilaGravacao(abrir_arquivo_privado(DIARIO_CAMINHO), DIARIO_INTERVALO_S, DIARIO_LOTE_MAX,
+                        DIARIO_ARRENDAMENTO_S, armazenamento(), _marcas_escrita())
+
+def enfileirar_presencas(df_editado: pd.DataFrame, mapa_id_por_nome: Dict[str, int],
+                         inicio: date, fim: date, setor: str, turno: str, leader_nome: str,
+                         df_base: pd.DataFrame | None = None,
+                         versoes: Dict[Tuple[int, date], int] | None = None) -> int:
+    """
+    Como salvar_presencas, mas só grava no diário; o banco é atualizado em segundo plano
+    e os conflitos aparecem depois, em FilaGravacao.conflitos.
+    """
+    linhas = _linhas_alteradas(df_editado, mapa_id_por_nome, df_base)
+    if not linhas:
+        return 0
+    # validado aqui: a thread de gravação não tem como avisar o usuário
+    _validar_status(linhas)
+    if versoes is not None and df_base is not None:
+        base = _derreter_grid(df_base, mapa_id_por_nome)
+        vistos = dict(zip(zip(base["colaborador_id"].tolist(), base["data_iso"].tolist()), base["status"].tolist()))
+        linhas = [(cid, d, status, vistos.get((cid, d), ""), versoes.get((cid, d), 0))
+                  for cid, d, status in linhas]
+    return _fila_gravacao().enfileirar(linhas, setor, turno, leader_nome,
+                                       ids_presencas(setor, turno, leader_nome))
+
+# ------------------------------
+# Relatórios (agregado no servidor + detalhe paginado)
+# ------------------------------
+RELATORIO_TAMANHO_PAGINA = 500
+
+# Intervalos longos (vários períodos de folha) são fatiados nos períodos 16→15 e cada
+# fatia é buscada numa thread, com a própria conexão do pool de leitura: o extrato anual
+# escala com as conexões disponíveis em vez de ser uma varredura longa numa conexão só.
+# As fatias voltam ordenadas como a consulta inteira (data por último na ordenação) e são
+# intercaladas com heapq.merge, trecho a trecho (linhas seguidas com a mesma chave). A
+# intercalação não compara texto: cada trecho recebe a posição que o próprio banco dá à
+# chave (DENSE_RANK com o collation da coluna, de uma consulta só para todas as fatias).
+# No SQLite a consulta roda no próprio processo (mesmos núcleos e GIL da intercalação):
+# por padrão não fatia; REPORT_PARALLEL_WORKERS liga em máquinas com núcleos sobrando.
+RELATORIO_PARALELO = int(os.getenv("REPORT_PARALLEL_WORKERS",
+                                   str(POOL_LEITURA_TAMANHO_MAX if DB_BACKEND == "sqlserver" else 1)))
+RELATORIO_FATIAR_MIN_PERIODOS = int(os.getenv("REPORT_SPLIT_MIN_PERIODS", "2"))
+
+def fatias_por_periodo(dt_ini: date, dt_fim: date) -> List[Tuple[date, date]]:
+    """[dt_ini, dt_fim] cortado nos períodos de periodo_por_data (pontas recortadas)."""
+    fatias = []
+    ini = dt_ini
+    while ini <= dt_fim:
+        _, fim_periodo = periodo_por_data(ini)
+        fim = min(fim_periodo, dt_fim)
+        fatias.append((ini, fim))
+        ini = fim + timedelta(days=1)
+    return fatias
+
+def _fatiar(dt_ini: date, dt_fim: date) -> List[Tuple[date, date]]:
+    fatias = fatias_por_periodo(dt_ini, dt_fim)
+    if len(fatias) < max(RELATORIO_FATIAR_MIN_PERIODOS, 2) or RELATORIO_PARALELO <= 1:
+        return [(dt_ini, dt_fim)]
+    return fatias
+
+def _buscar_em_paralelo(tarefas: List) -> List:
+    """Roda as tarefas (funções sem argumentos) em até RELATORIO_PARALELO threads; resultados na ordem."""
+    if len(tarefas) <= 1 or _pool_leitura().em_uso_nesta_thread():
+        # já há uma conexão de leitura nesta thread (diagnóstico de planos): tudo nela
+        return [tarefa() for tarefa in tarefas]
+    ctx = get_script_run_ctx(suppress_warning=True)
+    coletor = _coletor_atual()
+
+    def _iniciar():
+        # as consultas das threads contam no rerun de quem pediu o relatório
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        _desempenho().local.coletor = coletor
+
+    with ThreadPoolExecutor(max_workers=min(RELATORIO_PARALELO, len(tarefas)),
+                            thread_name_prefix="cadastro_hc-relatorio", initializer=_iniciar) as executor:
+        return list(executor.map(lambda tarefa: tarefa(), tarefas))
+
+def _ordem_setor_turno() -> Dict[Tuple[str, str], int]:
+    df = armazenamento().ordem_setores_turnos()
+    return dict(zip(zip(df["setor"], df["turno"]), df["ordem"].astype(int)))
+
+def _ordem_relatorio() -> Callable[[tuple], tuple]:
+    # posição de (setor, turno, colaborador) no ORDER BY do detalhe. Lida depois das fatias:
+    # todo colaborador delas já existe; um renomeado no meio da exportação vai para o fim
+    # do seu setor/turno
+    setor_turno = _ordem_setor_turno()
+    df = armazenamento().ordem_colaboradores()
+    nomes = dict(zip(df["nome"], df["ordem"].astype(int)))
+    fim = len(nomes) + 1
+    return lambda v: (setor_turno[(v[0], v[1])], nomes.get(v[2], fim))
+
+def _trechos(lotes, chave: List[str], posicao: Callable[[tuple], tuple], ordem: int, colunas: list):
+    # ((posição no banco, ordem da fatia), linhas): a fatia anterior (datas menores) vem
+    # primeiro no empate
+    for df in lotes:
+        if df.empty:
+            continue
+        if not colunas:
+            colunas.extend(df.columns)
+        k = df[chave]
+        inicios = (k != k.shift()).any(axis=1).to_numpy().nonzero()[0].tolist()
+        linhas = list(df.itertuples(index=False, name=None))
+        for a, b, valores in zip(inicios, inicios[1:] + [len(df)],
+                                 k.iloc[inicios].itertuples(index=False, name=None)):
+            yield (posicao(valores), ordem), linhas[a:b]
+
+def mesclar_fatias(fatias: List, chave: List[str], posicao: Callable[[tuple], tuple],
+                   lote: int | None = None):
+    """
+    Intercala fatias (cada uma um iterável de DataFrames ordenados por `chave` + data,
+    em ordem de data entre si) na ordem da consulta inteira. `posicao` leva os valores
+    de `chave` à posição que o banco lhes dá na ordenação (ex.: _ordem_relatorio).
+    Devolve DataFrames de ~`lote` linhas (sem `lote`, um só); nada se todas as fatias
+    vierem vazias.
+    """
+    colunas: list = []
+    origens = [_trechos(lotes, chave, posicao, i, colunas) for i, lotes in enumerate(fatias)]
+    linhas: list = []
+    for _, trecho in heapq.merge(*origens, key=lambda item: item[0]):
+        linhas.extend(trecho)
+        if lote and len(linhas) >= lote:
+            yield pd.DataFrame.from_records(linhas, columns=colunas)
+            linhas = []
+    if linhas:
+        yield pd.DataFrame.from_records(linhas, columns=colunas)
+
+def _agregado_fatia(dt_ini: date, dt_fim: date, setor: str | None, turno: str | None,
+                    marca: tuple) -> pd.DataFrame:
+    # por fatia no L2: períodos fechados são reaproveitados por qualquer intervalo que os cubra
+    return em_cache_compartilhado(("agregado", dt_ini, dt_fim, setor, turno, marca),
+                                  lambda: armazenamento().relatorio_agregado(dt_ini, dt_fim, setor, turno))
+
+def relatorio_agregado(dt_ini: date, dt_fim: date, setor: str | None = None,
+                       turno: str | None = None) -> pd.DataFrame:
+    """Contagem por status e por SOMA/terceiros, por setor/turno/dia, calculada no banco."""
+    marca = marca_escrita("presencas", "colaboradores")
+    partes = _buscar_em_paralelo([functools.partial(_agregado_fatia, ini, fim, setor, turno, marca)
+                                  for ini, fim in _fatiar(dt_ini, dt_fim)])
+    if len(partes) == 1:
+        return partes[0]
+    setor_turno = _ordem_setor_turno()
+    mesclado = list(mesclar_fatias([[df] for df in partes], ["setor", "turno"], lambda v: (setor_turno[v],)))
+    return mesclado[0] if mesclado else partes[0]
+
+# chave de ordenação do detalhe; a paginação continua "depois" da última chave vista
+CHAVE_RELATORIO = ["setor", "turno", "colaborador", "data", "id"]
+
+def relatorio_detalhe_pagina(dt_ini: date, dt_fim: date, setor: str | None = None,
+                             turno: str | None = None, apos: tuple | None = None,
+                             limite: int = RELATORIO_TAMANHO_PAGINA) -> pd.DataFrame:
+    """
+    Uma página do relatório detalhado, ordenada por setor/turno/nome/data (keyset):
+    `apos` é a chave (CHAVE_RELATORIO) da última linha da página anterior.
+    """
+    return armazenamento().relatorio_detalhe_pagina(dt_ini, dt_fim, setor, turno, apos, limite)
+
+def chave_da_ultima_linha(pagina: pd.DataFrame) -> tuple:
+    """`apos` da página seguinte, em tipos Python (o pyodbc recusa escalares numpy)."""
+    return tuple(pagina[c].iloc[-1:].tolist()[0] for c in CHAVE_RELATORIO)
+
+# ------------------------------
+# Exportação em streaming (CSV / Excel / Parquet)
+# ------------------------------
+# O resultado é lido em lotes (fetchmany) e escrito direto em arquivos temporários em
+# disco: o DataFrame completo nunca fica na memória do worker. A entrega é que precisa
+# de bytes (o st.download_button não aceita o TemporaryFile), então o arquivo é cortado
+# em partes de ~EXPORTACAO_MAX_MB (o corte é entre lotes) e só a parte escolhida é
+# lida para o botão.
+EXPORTACAO_LOTE = 5000
+EXPORTACAO_MAX_MB = float(os.getenv("EXPORT_MAX_MB", "50"))  # por arquivo baixado
+FORMATOS_EXPORTACAO = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+EXCEL_MAX_LINHAS = 1_048_575  # por aba, sem contar o cabeçalho
+
+def _despejar_fatia(dt_ini: date, dt_fim: date, setor: str | None, turno: str | None, lote: int):
+    # a fatia vai inteira para um temporário em disco (lotes em pickle): a thread libera a
+    # conexão logo e a intercalação lê um lote por fatia de cada vez
+    arq = tempfile.TemporaryFile()
+    try:
+        for chunk in armazenamento().iterar_relatorio(dt_ini, dt_fim, setor, turno, lote):
+            pickle.dump(chunk, arq, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        arq.close()
+        raise
+    arq.seek(0)
+    return arq
+
+def _ler_despejo(arq):
+    while True:
+        try:
+            yield pickle.load(arq)
+        except EOFError:
+            return
+
+def iterar_relatorio_em_lotes(dt_ini: date, dt_fim: date, setor: str | None = None,
+                              turno: str | None = None, lote: int = EXPORTACAO_LOTE):
+    fatias = _fatiar(dt_ini, dt_fim)
+    if len(fatias) == 1:
+        yield from armazenamento().iterar_relatorio(dt_ini, dt_fim, setor, turno, lote)
+        return
+    # cada fatia é uma foto própria (uma conexão por thread); as datas não se sobrepõem
+    arquivos = _buscar_em_paralelo([functools.partial(_despejar_fatia, ini, fim, setor, turno, lote)
+                                    for ini, fim in fatias])
+    try:
+        yield from mesclar_fatias([_ler_despejo(arq) for arq in arquivos],
+                                  ["setor", "turno", "colaborador"], _ordem_relatorio(), lote)
+    finally:
+        for arq in arquivos:
+            arq.close()
+
+def iterar_dia_em_lotes(setor: str, dia: date, lote: int = EXPORTACAO_LOTE):
+    yield from armazenamento().iterar_dia(setor, dia, lote)
+
+def _escrever_csv(lotes, arq, progresso):
+    texto = io.TextIOWrapper(arq, encoding="utf-8-sig", newline="")
+    linhas = 0
+    for i, chunk in enumerate(lotes):
+        chunk.to_csv(texto, index=False, header=(i == 0))
+        linhas += len(chunk)
+        texto.flush()  # arq.tell() é o que decide o corte das partes
+        if progresso:
+            progresso(linhas, arq.tell())
+    texto.flush()
+    texto.detach()
+    return linhas
+
+def _escrever_xlsx(lotes, arq, progresso):
+    # write_only: as linhas vão sendo serializadas, sem manter as células em memória
+    wb = openpyxl.Workbook(write_only=True)
+    ws, linhas_aba, linhas = None, 0, 0
+    for chunk in lotes:
+        for row in chunk.itertuples(index=False, name=None):
+            if ws is None or linhas_aba >= EXCEL_MAX_LINHAS:
+                ws = wb.create_sheet(f"presencas_{len(wb.worksheets) + 1}")
+                ws.append(list(chunk.columns))
+                linhas_aba = 0
+            ws.append([None if pd.isna(v) else v for v in row])
+            linhas_aba += 1
+        linhas += len(chunk)
+        if progresso:
+            progresso(linhas, None)
+    if ws is None:
+        wb.create_sheet("presencas_1")
+    wb.save(arq)
+    return linhas
+
+def _escrever_parquet(lotes, arq, progresso):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor, schema, linhas = None, None, 0
+    try:
+        for chunk in lotes:
+            if schema is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                # coluna toda vazia no 1º lote: assume texto
+                schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                    for f in schema])
+                escritor = pq.ParquetWriter(arq, schema)
+            escritor.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            linhas += len(chunk)
+            if progresso:
+                progresso(linhas, arq.tell())
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return linhas
+
+def _ate_o_limite(lotes, arq, limite: float, estimar: bool):
+    # entrega lotes enquanto a parte não chegou ao limite; o limite é conferido antes de
+    # puxar o próximo lote, então nenhum lote se perde entre uma parte e outra.
+    # O .xlsx só vai para o arquivo no save(): o tamanho é estimado pela memória dos lotes
+    usado = 0
+    while (usado if estimar else arq.tell()) < limite:
+        chunk = next(lotes, None)
+        if chunk is None:
+            return
+        if estimar:
+            usado += int(chunk.memory_usage(index=False, deep=True).sum())
+        yield chunk
+
+def exportar_em_partes(lotes, formato: str = "CSV", max_bytes: int | None = None, progresso=None):
+    """
+    Escreve os lotes (DataFrames) no formato pedido em arquivos temporários em disco,
+    começando um arquivo novo (completo, com cabeçalho) quando o atual passa de
+    `max_bytes` (None = um arquivo só). `progresso(linhas, bytes_ou_None)` é chamado a
+    cada lote, com os totais acumulados.
+    Devolve (arquivos posicionados no início, linhas, bytes).
+    """
+    escritor = {"CSV": _escrever_csv, "Excel": _escrever_xlsx, "Parquet": _escrever_parquet}[formato]
+    limite = float("inf") if max_bytes is None else max_bytes
+    lotes = iter(lotes)
+    partes, linhas, tamanho = [], 0, 0
+
+    def _progresso(n, b):
+        progresso(linhas + n, None if b is None else tamanho + b)
+
+    try:
+        while True:
+            arq = tempfile.TemporaryFile()
+            partes.append(arq)
+            linhas += escritor(_ate_o_limite(lotes, arq, limite, formato == "Excel"), arq,
+                               _progresso if progresso else None)
+            tamanho += arq.seek(0, os.SEEK_END)
+            arq.seek(0)
+            seguinte = next(lotes, None)
+            if seguinte is None:
+                break
+            lotes = itertools.chain([seguinte], lotes)
+    except BaseException:
+        for arq in partes:
+            arq.close()
+        raise
+    return partes, linhas, tamanho
+
+def exportar_em_arquivo(lotes, formato: str = "CSV", progresso=None):
+    """
+    Escreve os lotes (DataFrames) no formato pedido num único arquivo temporário em disco.
+    Devolve (arquivo posicionado no início, linhas, bytes).
+    """
+    partes, linhas, tamanho = exportar_em_partes(lotes, formato, None, progresso)
+    return partes[0], linhas, tamanho
+
+# ------------------------------
+# Diagnóstico: planos de execução reais das funções da camada de dados
+# ------------------------------
+# Executa cada função com SET STATISTICS XML ON numa transação que é desfeita no fim
+# (nada é gravado) e coleta o plano real de cada comando que ela enviou ao banco.
+COLUNA_SHOWPLAN = "Microsoft SQL Server 2005 XML Showplan"
+NS_SHOWPLAN = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+class _CursorComPlano:
+    def __init__(self, cur, planos: List[Tuple[str, str]]):
+        self._cur = cur
+        self._planos = planos
+        self._linhas: list = []
+        self.description = None
+
+    @property
+    def fast_executemany(self):
+        return self._cur.fast_executemany
+
+    @fast_executemany.setter
+    def fast_executemany(self, valor):
+        self._cur.fast_executemany = valor
+
+    def execute(self, sql, *params):
+        self._cur.execute(sql, *params)
+        # separa os result sets de showplan do primeiro result set "de verdade"
+        self.description, self._linhas = None, []
+        while True:
+            desc = self._cur.description
+            if desc is not None:
+                if desc[0][0] == COLUNA_SHOWPLAN:
+                    self._planos.append((sql, self._cur.fetchone()[0]))
+                elif self.description is None:
+                    self.description, self._linhas = desc, list(self._cur.fetchall())
+                else:
+                    self._cur.fetchall()
+            if not self._cur.nextset():
+                break
+        return self
+
+    def executemany(self, sql, linhas):
+        return self._cur.executemany(sql, linhas)
+
+    def fetchone(self):
+        return self._linhas.pop(0) if self._linhas else None
+
+    def fetchmany(self, n=1):
+        lote, self._linhas = self._linhas[:n], self._linhas[n:]
+        return lote
+
+    def fetchall(self):
+        lote, self._linhas = self._linhas, []
+        return lote
+
+    def close(self):
+        self._cur.close()
+
+class _ConexaoComPlano:
+    def __init__(self, cn, planos: List[Tuple[str, str]]):
+        self._cn = cn
+        self._planos = planos
+
+    def cursor(self):
+        return _CursorComPlano(self._cn.cursor(), self._planos)
+
+    def commit(self):
+        pass  # a transação do diagnóstico é sempre desfeita
+
+    def rollback(self):
+        self._cn.rollback()
+
+class _DesfazerDiagnostico(Exception):
+    pass
+
+def capturar_planos(funcao, *args, **kwargs) -> List[Tuple[str, str]]:
+    """Roda `funcao` e devolve [(sql, showplan_xml)] de cada comando executado."""
+    planos: List[Tuple[str, str]] = []
+    try:
+        with conexao() as cn:
+            cur = cn.cursor()
+            cur.execute("SET STATISTICS XML ON")
+            try:
+                # relatórios e exportações usam o pool de leitura: passam pela mesma conexão
+                envolvida = _ConexaoComPlano(cn, planos)
+                with _pool_conexoes().substituir(envolvida), _pool_leitura().substituir(envolvida):
+                    resultado = funcao(*args, **kwargs)
+                    if hasattr(resultado, "__next__"):
+                        for _ in resultado:   # geradores (exportação) precisam ser consumidos
+                            pass
+            finally:
+                cur.execute("SET STATISTICS XML OFF")
+                cur.close()
+            raise _DesfazerDiagnostico()
+    except _DesfazerDiagnostico:
+        pass
+    return planos
+
+def resumir_plano(xml: str) -> str:
+    """Árvore de operadores do plano: operador, objeto/índice, linhas estimadas x reais."""
+    raiz = ET.fromstring(xml)
+    saida = []
+
+    def _visitar(relop, nivel):
+        obj = relop.find("./*/sp:Object", NS_SHOWPLAN)
+        alvo = ""
+        if obj is not None:
+            alvo = " ".join(v for v in (obj.get("Table"), obj.get("Index")) if v)
+        reais = sum(int(c.get("ActualRows", 0))
+                    for c in relop.findall("./sp:RunTimeInformation/sp:RunTimeCountersPerThread", NS_SHOWPLAN))
+        saida.append(f"{'  ' * nivel}{relop.get('PhysicalOp')} {alvo}".rstrip()
+                     + f"  (estimadas {float(relop.get('EstimateRows', 0)):.0f}, reais {reais})")
+        for filho in relop.findall("./*/sp:RelOp", NS_SHOWPLAN):
+            _visitar(filho, nivel + 1)
+
+    for stmt in raiz.iter(f"{{{NS_SHOWPLAN['sp']}}}StmtSimple"):
+        saida.append(f"-- custo {float(stmt.get('StatementSubTreeCost', 0)):.4f}: "
+                     f"{' '.join((stmt.get('StatementText') or '').split())[:120]}")
+        for relop in stmt.findall("./sp:QueryPlan/sp:RelOp", NS_SHOWPLAN):
+            _visitar(relop, 1)
+    return "\n".join(saida)
+
+def cenarios_diagnostico() -> List[Tuple[str, object]]:
+    """Uma chamada representativa de cada função da camada de dados."""
+    ini, fim = periodo_por_data(date.today())
+    quadro = _quadro_colaboradores().filtrar(OPCOES_SETORES[0], None, True)
+    ids = quadro["id"].tolist()
+    grid = pd.DataFrame({"Colaborador": quadro["nome"].head(1).tolist(),
+                         "Setor": quadro["setor"].head(1).tolist(),
+                         date.today().isoformat(): "PRESENTE"}, dtype="object")
+    mapa = dict(zip(quadro["nome"], quadro["id"]))
+    turnos = pd.DataFrame({"nome": ["(diagnóstico)"], "setor": [OPCOES_SETORES[0]], "turno": ["1°"]})
+    return [
+        ("listar_colaboradores* (carga do quadro)", lambda: _carregar_quadro()),
+        ("carregar_presencas", lambda: carregar_presencas(ids, ini, fim)),
+        ("salvar_presencas", lambda: salvar_presencas(grid, mapa, date.today(), date.today(),
+                                                      OPCOES_SETORES[0], "-", "(diagnóstico)")),
+        ("atualizar_ativo_colaboradores", lambda: atualizar_ativo_colaboradores([], ids[:1])),
+        ("carregar_colaboradores_em_lote", lambda: carregar_colaboradores_em_lote(turnos)),
+        ("aplicar_turnos_em_lote", lambda: aplicar_turnos_em_lote(turnos)),
+        ("relatorio_agregado", lambda: relatorio_agregado(ini, fim)),
+        ("relatorio_detalhe_pagina", lambda: relatorio_detalhe_pagina(ini, fim)),
+        ("iterar_relatorio_em_lotes", lambda: iterar_relatorio_em_lotes(ini, fim)),
+        ("iterar_dia_em_lotes", lambda: iterar_dia_em_lotes(OPCOES_SETORES[0], date.today())),
+    ]
 
 # ------------------------------
 # UI Helpers
@@ -380,15 +1938,18 @@ def montar_grid_presencas(df_cols: pd.DataFrame, inicio: date, fim: date) -> pd.
     return base
 
 def aplicar_status_existentes(base: pd.DataFrame,
-                              presencas: Dict[Tuple[int, str], str],
+                              presencas: pd.DataFrame,
                               mapa_id_por_nome: Dict[str, int]):
-    for nome, cid in mapa_id_por_nome.items():
-        for col in base.columns:
-            if col in ("Colaborador", "Setor"):
-                continue
-            key = (cid, col)
-            if key in presencas:
-                base.loc[base["Colaborador"] == nome, col] = presencas[key]
+    # pivot (colaborador_id x data) + reindex nas linhas/colunas do grid: sem laço por célula
+    date_cols = [c for c in base.columns if c not in ("Colaborador", "Setor")]
+    if presencas.empty or not date_cols:
+        return base
+    grade = (presencas.assign(status=presencas["status"].fillna(""))
+                      .pivot(index="colaborador_id", columns="data", values="status"))
+    grade.columns = pd.to_datetime(grade.columns).strftime("%Y-%m-%d")
+    valores = grade.reindex(index=base["Colaborador"].map(mapa_id_por_nome), columns=date_cols)
+    valores.index = base.index
+    base[date_cols] = valores.where(valores.notna(), base[date_cols])
     return base
 
 def coluna_config_datas(inicio: date, fim: date) -> Dict[str, st.column_config.Column]:
@@ -506,39 +2067,138 @@ def pagina_relatorios_globais():
     with col4:
         turno_sel = st.selectbox("Filtrar por Turno", ["Todos"] + OPCOES_TURNOS, index=0)
 
+    visao = st.radio("Visão", ["Resumo (contagem por setor/turno/dia)", "Detalhado (paginado)"],
+                     horizontal=True, key="rel_visao")
+    filtros = (dt_ini, dt_fim, setor_sel, turno_sel)
+
     if st.button("Gerar relatório"):
-        params = [dt_ini, dt_fim]
-        if setor_sel != "Todos":
-            params.append(setor_sel)
-        if turno_sel != "Todos":
-            params.append(turno_sel)
-
-        df = pd.read_sql(
-            f"""
-            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
-              FROM dbo.presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
-             WHERE p.data BETWEEN ? AND ?
-             {"AND p.setor = ?" if setor_sel != "Todos" else ""}
-             {"AND p.turno = ?" if turno_sel != "Todos" else ""}
-             ORDER BY p.setor, p.turno, c.nome, p.data
-            """,
-            get_conn(),
-            params=params,
-        )
+        st.session_state["rel_filtros"] = filtros
+        st.session_state["rel_cursores"] = [None]   # pilha de chaves: início de cada página
+
+    # só mostra o que foi gerado para os filtros atuais
+    if st.session_state.get("rel_filtros") != filtros:
+        return
+
+    tag_setor = setor_sel if setor_sel != "Todos" else "todos_setores"
+    tag_turno = turno_sel if turno_sel != "Todos" else "todos_turnos"
 
+    if visao.startswith("Resumo"):
+        df = relatorio_agregado(*filtros)
         if df.empty:
             st.info("Sem dados no intervalo/filtros informados.")
-        else:
-            st.dataframe(df, use_container_width=True, hide_index=True)
-            tag_setor = setor_sel if setor_sel != "Todos" else "todos_setores"
-            tag_turno = turno_sel if turno_sel != "Todos" else "todos_turnos"
-            csv = df.to_csv(index=False).encode("utf-8-sig")
-            st.download_button(
-                "Baixar CSV",
-                data=csv,
-                file_name=f"presencas_{tag_setor}_{tag_turno}_{dt_ini}_{dt_fim}.csv",
-                mime="text/csv",
-            )
+            return
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        st.download_button(
+            "Baixar CSV (resumo)",
+            data=df.to_csv(index=False).encode("utf-8-sig"),
+            file_name=f"presencas_resumo_{tag_setor}_{tag_turno}_{dt_ini}_{dt_fim}.csv",
+            mime="text/csv",
+        )
+        return
+
+    tamanho = st.selectbox("Linhas por página", [100, 500, 2000], index=1, key="rel_tamanho")
+    cursores = st.session_state.setdefault("rel_cursores", [None])
+    pagina = relatorio_detalhe_pagina(*filtros, apos=cursores[-1], limite=tamanho + 1)
+    tem_proxima = len(pagina) > tamanho
+    pagina = pagina.iloc[:tamanho]
+
+    if pagina.empty:
+        st.info("Sem dados no intervalo/filtros informados.")
+        return
+    st.dataframe(pagina.drop(columns=["id"]), use_container_width=True, hide_index=True)
+
+    colp1, colp2, colp3 = st.columns([1, 1, 4])
+    with colp1:
+        if st.button("◀ Anterior", disabled=len(cursores) == 1, key="rel_ant"):
+            cursores.pop()
+            st.rerun()
+    with colp2:
+        if st.button("Próxima ▶", disabled=not tem_proxima, key="rel_prox"):
+            cursores.append(chave_da_ultima_linha(pagina))
+            st.rerun()
+    with colp3:
+        st.caption(f"Página {len(cursores)}")
+
+    # o detalhe completo só é lido (em lotes, direto para arquivo) se pedido
+    st.markdown("#### Exportar detalhe completo")
+    formato = st.selectbox("Formato", list(FORMATOS_EXPORTACAO), index=0, key="rel_formato")
+    chave = (filtros, formato)
+    if st.button("Preparar arquivo", key="rel_exportar"):
+        _preparar_exportacao(
+            "rel_export",
+            chave,
+            iterar_relatorio_em_lotes(*filtros),
+            formato,
+            f"presencas_{tag_setor}_{tag_turno}_{dt_ini}_{dt_fim}",
+        )
+    _botao_exportacao("rel_export", chave, "Sem dados no intervalo/filtros informados.")
+
+def _descartar_exportacao(estado: str):
+    anterior = st.session_state.pop(estado, None)
+    if anterior is not None:
+        for arq in anterior["partes"]:
+            arq.close()
+
+def _preparar_exportacao(estado: str, chave, lotes, formato: str, nome_base: str):
+    # as partes ficam em disco, guardadas na sessão (TemporaryFile: somem ao fechar ou
+    # quando a sessão é coletada); a exportação anterior da mesma tela é descartada
+    _descartar_exportacao(estado)
+    contador = st.empty()
+
+    def _progresso(linhas, tamanho):
+        texto = f"{linhas:,} linhas".replace(",", ".")
+        if tamanho is not None:
+            texto += f" · {tamanho / 1_048_576:.1f} MB"
+        contador.caption(texto)
+
+    partes, linhas, tamanho = exportar_em_partes(
+        lotes, formato, int(EXPORTACAO_MAX_MB * 1_048_576), progresso=_progresso)
+    contador.empty()
+    st.session_state[estado] = {"chave": chave, "partes": partes, "linhas": linhas,
+                                "bytes": tamanho, "formato": formato, "nome": nome_base}
+
+def _botao_exportacao(estado: str, chave, vazio: str):
+    exp = st.session_state.get(estado)
+    if exp is None or exp["chave"] != chave:
+        return
+    if exp["linhas"] == 0:
+        st.info(vazio)
+        return
+    partes = exp["partes"]
+    texto = f"{exp['linhas']:,} linhas · {exp['bytes'] / 1_048_576:.1f} MB".replace(",", ".")
+    if len(partes) > 1:
+        texto += f" · {len(partes)} arquivos de ~{EXPORTACAO_MAX_MB:g} MB"
+    st.caption(texto)
+    i = 0
+    if len(partes) > 1:
+        i = st.selectbox("Arquivo", range(len(partes)), key=f"{estado}_parte",
+                         format_func=lambda k: f"Parte {k + 1} de {len(partes)}")
+    extensao, mime = FORMATOS_EXPORTACAO[exp["formato"]]
+    sufixo = f"_parte{i + 1}" if len(partes) > 1 else ""
+    arq = partes[i]
+    arq.seek(0)
+    # só a parte escolhida vira bytes: a memória fica limitada a EXPORTACAO_MAX_MB
+    st.download_button(
+        f"Baixar {exp['formato']}" + (f" (parte {i + 1})" if sufixo else ""),
+        data=arq.read(),
+        file_name=f"{exp['nome']}{sufixo}.{extensao}",
+        mime=mime,
+        on_click="ignore",
+    )
+
+def _exportacao_do_dia(setor: str, dia: date):
+    # nada é consultado até o usuário pedir; depois, só de novo se houver escrita
+    chave = (setor, dia.isoformat())
+    if st.button("Gerar CSV do dia", key="lan_export_btn"):
+        st.session_state["lan_export"] = chave
+    if st.session_state.get("lan_export") != chave:
+        return
+    versao = chave + tuple(marca_escrita("presencas", "colaboradores"))
+    exp = st.session_state.get("lan_export_arq")
+    if exp is None or exp["chave"] != versao:
+        _preparar_exportacao("lan_export_arq", versao, iterar_dia_em_lotes(setor, dia), "CSV",
+                             f"presencas_{setor}_{chave[1]}")
+    _botao_exportacao("lan_export_arq", versao, "Sem dados salvos para esse dia.")
 
 # ------------------------------
 # Seed de colaboradores (opcional / one-off)
@@ -864,86 +2524,228 @@ VITORIA ALVES BRAGA""",
 def _parse_names(blob: str):
     return [n.strip().strip('"').strip("'") for n in blob.splitlines() if n.strip()]
 
-def seed_colaboradores_iniciais(turno_default: str = "1°"):
-    for setor, blob in SEED_LISTAS.items():
-        for nome in _parse_names(blob):
-            cn = get_conn(); cur = cn.cursor()
-            cur.execute(
-                "SELECT 1 FROM dbo.colaboradores WHERE nome=? AND setor=? AND turno=?",
-                (nome, setor, turno_default),
-            )
-            exists = cur.fetchone()
-            cur.close(); cn.close()
-            if not exists:
-                adicionar_colaborador(nome, setor, turno_default)
+def carregar_colaboradores_em_lote(registros) -> Tuple[int, int]:
+    """
+    Carga em lote de (nome, setor, turno): envia tudo para uma tabela temporária e
+    insere só quem ainda não existe, numa única transação.
+    `registros` pode ser um DataFrame (colunas nome/setor/turno) ou um iterável de tuplas.
+    Devolve (inseridos, ignorados).
+    """
+    if isinstance(registros, pd.DataFrame):
+        df = registros[["nome", "setor", "turno"]].copy()
+    else:
+        df = pd.DataFrame(list(registros), columns=["nome", "setor", "turno"])
+    total = len(df)
+    df["nome"] = df["nome"].astype(str).str.strip()
+    df["turno"] = normaliza_turno_serie(df["turno"])
+    df = df[df["nome"] != ""].drop_duplicates()
+    if df.empty:
+        return 0, total
+
+    inseridos = armazenamento().inserir_colaboradores(list(df.itertuples(index=False, name=None)))
+    if inseridos:
+        invalidar_quadro_colaboradores()
+    return inseridos, total - inseridos
+
+def seed_colaboradores_iniciais(turno_default: str = "1°") -> Tuple[int, int]:
+    registros = [
+        (nome, setor, turno_default)
+        for setor, blob in SEED_LISTAS.items()
+        for nome in _parse_names(blob)
+    ]
+    return carregar_colaboradores_em_lote(registros)
 
 # ------------------------------
 # Importador de turnos (xlsx/csv)
 # ------------------------------
+MAPA_SETORES = {
+    "AVIAMENTO": "Aviamento",
+    "TECIDO": "Tecido",
+    "DISTRIBUICAO": "Distribuição",
+    "DISTRIBUIÇÃO": "Distribuição",
+    "ALMOXARIFADO": "Almoxarifado",
+    "PAF": "PAF",
+    "RECEBIMENTO": "Recebimento",
+    "EXPEDICAO": "Expedição",
+    "EXPEDIÇÃO": "Expedição",
+    "E-COMMERCE": "E-commerce",
+    "ECOMMERCE": "E-commerce",
+    "E COMMERCE": "E-commerce",
+}
+
 def _normalize_setor(nome_sheet: str) -> str:
     s = (nome_sheet or "").strip().upper()
-    mapa = {
-        "AVIAMENTO": "Aviamento",
-        "TECIDO": "Tecido",
-        "DISTRIBUICAO": "Distribuição",
-        "DISTRIBUIÇÃO": "Distribuição",
-        "ALMOXARIFADO": "Almoxarifado",
-        "PAF": "PAF",
-        "RECEBIMENTO": "Recebimento",
-        "EXPEDICAO": "Expedição",
-        "EXPEDIÇÃO": "Expedição",
-        "E-COMMERCE": "E-commerce",
-        "ECOMMERCE": "E-commerce",
-        "E COMMERCE": "E-commerce",
-    }
-    return mapa.get(s, nome_sheet)
-
-def importar_turnos_de_arquivo(arquivo, setor_padrao: str | None = None) -> int:
-    nome = getattr(arquivo, "name", "").lower()
-    total = 0
-
-    def _process_df(df: pd.DataFrame, setor_hint: str | None = None):
-        nonlocal total
-        cols = {c.upper(): c for c in df.columns}
-        nome_col = cols.get("NOME COMPLETO") or cols.get("NOME")
-        turno_col = cols.get("TURNO")
-        setor_col = cols.get("SETOR")
-        if not nome_col or not turno_col:
-            return 0
-        linhas = 0
-        for _, row in df.iterrows():
-            nome_val = str(row[nome_col]).strip()
-            if not nome_val:
+    return MAPA_SETORES.get(s, nome_sheet)
+
+def _normalize_setor_serie(setores: pd.Series) -> pd.Series:
+    s = setores.fillna("").astype(str).str.strip()
+    return s.str.upper().map(MAPA_SETORES).fillna(s)
+
+def _normalizar_planilha_turnos(df: pd.DataFrame, setor_hint: str | None) -> pd.DataFrame:
+    """Converte uma aba/CSV em linhas (nome, setor, turno) normalizadas, sem laço por linha."""
+    vazio = pd.DataFrame(columns=["nome", "setor", "turno"])
+    cols = {str(c).strip().upper(): c for c in df.columns}
+    nome_col = cols.get("NOME COMPLETO") or cols.get("NOME")
+    turno_col = cols.get("TURNO")
+    setor_col = cols.get("SETOR")
+    if not nome_col or not turno_col:
+        return vazio
+
+    out = pd.DataFrame({
+        "nome": df[nome_col].fillna("").astype(str).str.strip(),
+        "turno": normaliza_turno_serie(df[turno_col]),
+    })
+    setor = _normalize_setor_serie(df[setor_col]) if setor_col else pd.Series("", index=df.index)
+    out["setor"] = setor.mask(setor == "", setor_hint or "")
+    out = out[out["nome"] != ""]
+    if (out["setor"] == "").any():
+        raise ValueError("Defina o setor (coluna SETOR no arquivo ou selecione na UI para CSV sem SETOR).")
+    return out[["nome", "setor", "turno"]]
+
+def aplicar_turnos_em_lote(lotes, simular: bool = False) -> Dict[str, int]:
+    """
+    Aplica (nome, setor, turno) em colaboradores a partir de uma tabela temporária, de
+    uma vez (MERGE no SQL Server): atualiza o turno e reativa quem existe (chave
+    nome+setor), insere quem não existe. `lotes` é um DataFrame ou um iterável de DataFrames (lidos aos
+    poucos); com `simular=True` só calcula as contagens e não grava nada.
+    """
+    if isinstance(lotes, pd.DataFrame):
+        lotes = [lotes]
+    linhas, ins, upd, reat = armazenamento().aplicar_turnos(lotes, simular)
+    res = {"linhas": linhas, "inseridos": ins, "atualizados": upd, "reativados": reat,
+           "inalterados": linhas - ins - upd - reat}
+
+    if not simular and (res["inseridos"] or res["atualizados"] or res["reativados"]):
+        invalidar_quadro_colaboradores()
+    return res
+
+# --- Leitura em lotes (memória constante) -----------------------------------
+TAMANHO_LOTE_IMPORTACAO = 5000
+# .xls (binário antigo) não tem leitura por linhas: cada aba vai inteira para a memória,
+# então o arquivo tem um teto; acima dele, salve como .xlsx ou .csv
+IMPORTACAO_XLS_MAX_MB = float(os.getenv("IMPORT_XLS_MAX_MB", "10"))
+
+def _tamanho_arquivo(arquivo) -> int:
+    tamanho = getattr(arquivo, "size", None)
+    if tamanho is None:
+        pos = arquivo.tell()
+        tamanho = arquivo.seek(0, os.SEEK_END)
+        arquivo.seek(pos)
+    return int(tamanho or 0)
+
+def _ler_xlsx_em_lotes(arquivo, setor_padrao: str | None, tamanho_lote: int, progresso=None):
+    # openpyxl em modo read-only: as linhas são lidas do XML sob demanda
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        total = sum(ws.max_row or 0 for ws in wb.worksheets) or None
+        lidas = 0
+        for ws in wb.worksheets:
+            setor_hint = _normalize_setor(ws.title) or setor_padrao
+            linhas = ws.iter_rows(values_only=True)
+            cabecalho = next(linhas, None)
+            if not cabecalho:
                 continue
-            turno_val = normaliza_turno(str(row[turno_col]).strip())
-            setor_val = _normalize_setor(str(row[setor_col]).strip()) if setor_col else setor_hint or setor_padrao
-            if not setor_val:
-                raise ValueError("Defina o setor (coluna SETOR no arquivo ou selecione na UI para CSV sem SETOR).")
-            upsert_colaborador_turno(nome_val, setor_val, turno_val)
-            linhas += 1
-        total += linhas
-        return linhas
-
-    if nome.endswith((".xlsx", ".xls")):
-        xls = pd.ExcelFile(arquivo)
-        for aba in xls.sheet_names:
-            df = xls.parse(aba)
-            _process_df(df, setor_hint=_normalize_setor(aba))
+            n = len(cabecalho)
+            lote = []
+            for row in linhas:
+                lidas += 1
+                if row is None or all(v is None for v in row):
+                    continue
+                lote.append(tuple(row[:n]) + (None,) * (n - len(row)))
+                if len(lote) >= tamanho_lote:
+                    yield _normalizar_planilha_turnos(pd.DataFrame(lote, columns=cabecalho), setor_hint)
+                    lote = []
+                    if progresso:
+                        progresso(lidas, min(lidas / total, 1.0) if total else None)
+            if lote:
+                yield _normalizar_planilha_turnos(pd.DataFrame(lote, columns=cabecalho), setor_hint)
+            if progresso:
+                progresso(lidas, min(lidas / total, 1.0) if total else None)
+    finally:
+        wb.close()
+
+# CSV que começa em UTF-8 (ou ASCII) pode ter um nome em latin1 (Excel) muito depois da
+# amostra: os bytes que não formam UTF-8 válido são lidos como latin1, sem reler o arquivo.
+# Só um latin1 que por acaso forma UTF-8 válido ("Ã" + "©", p.ex.) sairia diferente.
+codecs.register_error("cadastro_hc.latin1", lambda e: (e.object[e.start:e.end].decode("latin1"), e.end))
+
+def _detectar_formato_csv(arquivo) -> Tuple[str, str]:
+    # olha só o começo do arquivo para escolher encoding e separador
+    pos = arquivo.tell()
+    tamanho_amostra = 64 * 1024
+    amostra = arquivo.read(tamanho_amostra)
+    arquivo.seek(pos)
+    cortada = len(amostra) >= tamanho_amostra
+    if isinstance(amostra, str):
+        texto, encoding = amostra, "utf-8"
     else:
         try:
-            df = pd.read_csv(arquivo)
-        except Exception:
-            df = pd.read_csv(arquivo, encoding="latin1", sep=None, engine="python")
-        _process_df(df, setor_hint=None)
+            # incremental: um caractere multibyte cortado no fim da amostra não conta como erro
+            # (a menos que a amostra seja o arquivo inteiro)
+            texto = codecs.getincrementaldecoder("utf-8-sig")().decode(amostra, final=not cortada)
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError:
+            texto, encoding = amostra.decode("latin1"), "latin1"
+    if cortada and "\n" in texto:
+        texto = texto[:texto.rindex("\n")]  # a última linha da amostra pode estar pela metade
+    try:
+        sep = csv.Sniffer().sniff(texto, delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+    return encoding, sep
+
+def _ler_csv_em_lotes(arquivo, setor_padrao: str | None, tamanho_lote: int, progresso=None):
+    encoding, sep = _detectar_formato_csv(arquivo)
+    tamanho = _tamanho_arquivo(arquivo)
+    lidas = 0
+    with pd.read_csv(arquivo, sep=sep, encoding=encoding, encoding_errors="cadastro_hc.latin1", dtype=str,
+                     chunksize=tamanho_lote) as leitor:
+        for chunk in leitor:
+            lidas += len(chunk)
+            yield _normalizar_planilha_turnos(chunk, setor_padrao)
+            if progresso:
+                progresso(lidas, min(arquivo.tell() / tamanho, 1.0) if tamanho else None)
+
+def ler_turnos_em_lotes(arquivo, setor_padrao: str | None = None,
+                        tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO, progresso=None):
+    """
+    Gera DataFrames (nome, setor, turno) já normalizados, com no máximo `tamanho_lote`
+    linhas cada. `progresso(linhas_lidas, fracao_ou_None)` é chamado a cada lote.
+    """
+    nome = getattr(arquivo, "name", "").lower()
+    if nome.endswith(".xlsx"):
+        yield from _ler_xlsx_em_lotes(arquivo, setor_padrao, tamanho_lote, progresso)
+    elif nome.endswith(".xls"):
+        # formato binário antigo: openpyxl não lê; carrega aba a aba pelo pandas
+        if _tamanho_arquivo(arquivo) > IMPORTACAO_XLS_MAX_MB * 1_048_576:
+            raise ValueError(f"Arquivo .xls acima de {IMPORTACAO_XLS_MAX_MB:.0f} MB: salve como .xlsx ou .csv "
+                             "(lidos aos poucos, sem limite de tamanho).")
+        xls = pd.ExcelFile(arquivo)
+        for i, aba in enumerate(xls.sheet_names, start=1):
+            df = xls.parse(aba, dtype=str)
+            yield _normalizar_planilha_turnos(df, setor_hint=_normalize_setor(aba) or setor_padrao)
+            if progresso:
+                progresso(len(df), i / len(xls.sheet_names))
+    else:
+        yield from _ler_csv_em_lotes(arquivo, setor_padrao, tamanho_lote, progresso)
 
-    return total
+def importar_turnos_de_arquivo(arquivo, setor_padrao: str | None = None,
+                               simular: bool = False, progresso=None) -> Dict[str, int]:
+    return aplicar_turnos_em_lote(ler_turnos_em_lotes(arquivo, setor_padrao, progresso=progresso),
+                                  simular=simular)
 
 # ------------------------------
 # Página de Lançamento Diário
 # ------------------------------
 def pagina_lancamento_diario():
     st.markdown("### Lançamento diário de presença (por setor)")
+    _fragmento_filtros_lancamento()
 
+# Fragmentos: mexer nos filtros reexecuta só os filtros + grid; editar uma célula ou
+# salvar reexecuta só o grid (sem login, sidebar, painel admin etc.).
+@st.fragment
+@rerun_medido("Lançamento diário (fragmento)")
+def _fragmento_filtros_lancamento():
     # agora uso 5 colunas: Setor | Turno | Data | Filtro | Nome
     colA, colB, colC, colD, colE = st.columns([1, 1, 1, 1, 2])
 
@@ -979,28 +2781,34 @@ def pagina_lancamento_diario():
         else:
             nome_preenchedor = st.text_input("Seu nome (opcional)", key="lan_nome")
 
-    # ------ busca colaboradores (Setor/Turno) ------
-    if turno_sel == "Todos":
-        df_cols = listar_colaboradores_por_setor(setor, somente_ativos=True)
-    else:
-        df_cols = listar_colaboradores_setor_turno(setor, turno_sel, somente_ativos=True)
+    _fragmento_grid_dia(setor, turno_sel, data_dia, tuple(sorted(filtro_st)), nome_preenchedor or "")
 
-    # ------ aplica o filtro SOMA / TERCEIROS ------
-    # "TERCEIROS" = nome termina com "- terceiro" (case-insensitive, com ou sem espaços)
-    mask_terceiro = df_cols["nome"].str.contains(r"-\s*terceiro\s*$", case=False, na=False)
+def _dados_grid_dia(setor: str, turno_sel: str, data_dia: date, filtro_st: Tuple[str, ...]):
+    """
+    Quadro filtrado + grid hidratado, guardados na sessão: só são recarregados quando
+    os filtros mudam ou depois de um salvamento (que descarta o que está guardado).
+    """
+    chave = (setor, turno_sel, data_dia.isoformat(), filtro_st)
+    guardado = st.session_state.get("lan_grid")
+    if guardado is not None and guardado["chave"] == chave:
+        return guardado
 
+    # ------ filtro SOMA / TERCEIROS ------
+    # "TERCEIROS" = nome termina com "- terceiro" (coluna eh_terceiro do banco)
     escolha = set(filtro_st)
     if escolha == {"SOMA"}:
-        df_cols = df_cols[~mask_terceiro]
+        terceiros = False
     elif escolha == {"TERCEIROS"}:
-        df_cols = df_cols[mask_terceiro]
+        terceiros = True
     else:
         # ambos selecionados (ou nenhum) -> não filtra
-        pass
+        terceiros = None
 
-    if len(df_cols) == 0:
-        st.warning("Nenhum colaborador cadastrado para este filtro.")
-        st.stop()
+    # ------ busca colaboradores (Setor/Turno) ------
+    if turno_sel == "Todos":
+        df_cols = listar_colaboradores_por_setor(setor, somente_ativos=True, terceiros=terceiros)
+    else:
+        df_cols = listar_colaboradores_setor_turno(setor, turno_sel, somente_ativos=True, terceiros=terceiros)
 
     iso = data_dia.isoformat()
     base = pd.DataFrame(
@@ -1009,11 +2817,72 @@ def pagina_lancamento_diario():
          iso: ""},
         dtype="object"
     )
-
-    pres = carregar_presencas(df_cols["id"].tolist(), data_dia, data_dia)
     mapa = dict(zip(df_cols["nome"], df_cols["id"]))
-    base = aplicar_status_existentes(base, pres, mapa)
+    versoes: Dict[Tuple[int, date], int] = {}
+    if len(df_cols):
+        pres = carregar_presencas(df_cols["id"].tolist(), data_dia, data_dia)
+        base = aplicar_status_existentes(base, pres, mapa)
+        versoes = versoes_presencas(pres)
+        if ESCRITA_ADIADA:
+            # edições salvas que ainda estão no diário valem mais que o banco
+            pend = _fila_gravacao().pendentes(df_cols["id"].tolist(), data_dia, data_dia)
+            base = aplicar_status_existentes(base, pend, mapa)
+
+    guardado = {"chave": chave, "vazio": len(df_cols) == 0, "base": base, "mapa": mapa, "versoes": versoes}
+    st.session_state["lan_grid"] = guardado
+    return guardado
+
+# Com gravação adiada: situação do diário para as células do grid, atualizada sozinha
+@st.fragment(run_every=max(DIARIO_INTERVALO_S, 2.0))
+def _estado_gravacao(colaboradores: Tuple[Tuple[int, str], ...], data_dia: date):
+    fila = _fila_gravacao()
+    colab_ids = [cid for cid, _ in colaboradores]
+    pendentes, rejeitadas, conflitos = fila.contagens(colab_ids, data_dia)
+    if conflitos:
+        df = fila.conflitos(colab_ids, data_dia)
+        st.warning(f"{len(df)} alteração(ões) deste dia NÃO foram gravadas: outra pessoa salvou um valor "
+                   "diferente antes. Recarregue a tabela para ver o valor atual e salve de novo se for o caso.")
+        st.dataframe(pd.DataFrame({
+            "Colaborador": df["colaborador_id"].map(dict(colaboradores)),
+            "Data": pd.to_datetime(df["data"]).dt.strftime("%d/%m/%Y"),
+            "No banco": df["status_atual"].replace("", "(vazio)"),
+            "Você tentou": df["status_tentado"].replace("", "(vazio)"),
+        }), use_container_width=True, hide_index=True)
+        if st.button("Ok, recarregar tabela", key="lan_conflitos_ok"):
+            fila.dispensar(df["seq"].tolist())
+            st.session_state.pop("lan_grid", None)
+            st.rerun()
+    if rejeitadas:
+        st.error(f"{rejeitadas} alteração(ões) deste dia foram recusadas pelo banco. Avise um administrador.")
+    if pendentes and fila.ultimo_erro:
+        st.warning(f"⏳ {pendentes} alteração(ões) aguardando gravação — o banco recusou a última "
+                   f"tentativa ({fila.ultimo_erro[1][:120]}); nova tentativa automática em instantes.")
+    elif pendentes:
+        st.caption(f"⏳ {pendentes} alteração(ões) deste dia aguardando gravação no banco.")
+    elif fila.ultima_descarga:
+        st.caption(f"✔ Tudo gravado no banco (última gravação às {fila.ultima_descarga:%H:%M:%S}).")
+
+@st.fragment
+@rerun_medido("Lançamento diário (fragmento)")
+def _fragmento_grid_dia(setor: str, turno_sel: str, data_dia: date,
+                        filtro_st: Tuple[str, ...], nome_preenchedor: str):
+    aviso = st.session_state.pop("lan_aviso", None)
+    if aviso:
+        (st.success if aviso[0] == "ok" else st.info)(aviso[1])
+    conflitos = st.session_state.pop("lan_conflitos", None)
+    if conflitos is not None:
+        st.warning(f"{len(conflitos)} célula(s) NÃO foram gravadas: outra pessoa salvou um valor diferente "
+                   "depois que você abriu a tabela. A tabela abaixo já mostra o valor atual do banco; "
+                   "revise e salve de novo se for o caso.")
+        st.dataframe(conflitos, use_container_width=True, hide_index=True)
+
+    dados = _dados_grid_dia(setor, turno_sel, data_dia, filtro_st)
+    if dados["vazio"]:
+        st.warning("Nenhum colaborador cadastrado para este filtro.")
+        return
+    base, mapa = dados["base"], dados["mapa"]
 
+    iso = data_dia.isoformat()
     cfg = {
         "Colaborador": st.column_config.TextColumn("Colaborador", disabled=True),
         "Setor": st.column_config.TextColumn("Setor", disabled=True),
@@ -1026,7 +2895,7 @@ def pagina_lancamento_diario():
 
     st.markdown("#### Tabela do dia")
     # incluir o filtro na chave do editor evita cache estranho ao alternar
-    editor_key = f"editor_dia_{iso}_{setor}_{turno_sel}_{'-'.join(sorted(filtro_st) or ['TODOS'])}"
+    editor_key = f"editor_dia_{iso}_{setor}_{turno_sel}_{'-'.join(filtro_st or ('TODOS',))}"
     editado = st.data_editor(
         base,
         use_container_width=True,
@@ -1036,127 +2905,303 @@ def pagina_lancamento_diario():
         key=editor_key,
     )
 
+    if ESCRITA_ADIADA:
+        _estado_gravacao(tuple((cid, nome) for nome, cid in mapa.items()), data_dia)
+
     if st.button("Salvar dia"):
-        salvar_presencas(
-            editado,
-            mapa,
-            data_dia,
-            data_dia,
-            setor,
-            turno=(turno_sel if turno_sel != "Todos" else "-"),
-            leader_nome=nome_preenchedor or "",
-        )
-        st.success("Registros salvos/atualizados!")
-        st.session_state.pop(editor_key, None)  
-        st.rerun()
+        args = (editado, mapa, data_dia, data_dia, setor)
+        kwargs = dict(turno=(turno_sel if turno_sel != "Todos" else "-"),
+                      leader_nome=nome_preenchedor, df_base=base, versoes=dados["versoes"])
+        try:
+            if ESCRITA_ADIADA:
+                n = enfileirar_presencas(*args, **kwargs)
+                conflitos = None   # vêm depois da descarga, em _estado_gravacao
+            else:
+                n, conflitos = salvar_presencas(*args, **kwargs)
+        except ValueError as e:
+            # nada foi gravado; as edições continuam na tabela para correção
+            st.error(str(e))
+            return
+        if n and ESCRITA_ADIADA:
+            st.session_state["lan_aviso"] = ("ok", f"Alterações recebidas! ({n} alteração(ões); "
+                                                   "a gravação no banco segue em segundo plano)")
+        elif n:
+            st.session_state["lan_aviso"] = ("ok", f"Registros salvos/atualizados! ({n} alteração(ões))")
+        elif conflitos is None or conflitos.empty:
+            st.session_state["lan_aviso"] = ("info", "Nenhuma alteração para salvar.")
+        if conflitos is not None and not conflitos.empty:
+            nomes = {cid: nome for nome, cid in mapa.items()}
+            st.session_state["lan_conflitos"] = pd.DataFrame({
+                "Colaborador": conflitos["colaborador_id"].map(nomes),
+                "Data": pd.to_datetime(conflitos["data"]).dt.strftime("%d/%m/%Y"),
+                "No banco": conflitos["status_atual"].replace("", "(vazio)"),
+                "Você tentou": conflitos["status_tentado"].replace("", "(vazio)"),
+            })
+        st.session_state.pop(editor_key, None)
+        st.session_state.pop("lan_grid", None)   # recarrega do banco
+        st.rerun(scope="fragment")
 
     with st.expander("Exportar CSV do dia", expanded=False):
-        df = pd.read_sql(
-            """
-            SELECT c.nome AS colaborador, p.data, p.status, p.setor, p.turno, p.leader_nome
-              FROM dbo.presencas p JOIN dbo.colaboradores c ON c.id = p.colaborador_id
-             WHERE p.setor = ? AND p.data = ?
-             ORDER BY colaborador
-            """,
-            get_conn(),
-            params=(setor, iso),
-        )
-        if df.empty:
-            st.info("Sem dados salvos para esse dia.")
-        else:
-            csv = df.to_csv(index=False).encode("utf-8-sig")
-            st.download_button(
-                "Baixar CSV",
-                data=csv,
-                file_name=f"presencas_{setor}_{iso}.csv",
-                mime="text/csv",
-            )
+        _exportacao_do_dia(setor, data_dia)
 
 
 # ------------------------------
 # Página de Configuração do DB
 # ------------------------------
-def pagina_db():
-    st.markdown("### Configuração do Banco (SQL Server)")
-    cfg = get_config()
-    col1, col2 = st.columns(2)
-    with col1:
-        st.text_input("Servidor", value=cfg["SERVER"], disabled=True)
-        st.text_input("Base de Dados", value=cfg["DATABASE"], disabled=True)
-        st.text_input("Usuário", value=cfg["UID"], disabled=True)
-    with col2:
-        st.text_input("Encrypt", value=cfg["ENCRYPT"], disabled=True)
-        st.text_input("TrustServerCertificate", value=cfg["TRUST_CERT"], disabled=True)
-        st.text_input("Timeout (s)", value=str(cfg["CONNECT_TIMEOUT"]), disabled=True)
+def _leituras_db(arm: Armazenamento):
+    st.markdown("#### Leituras de relatórios e exportações")
+    st.caption("Relatórios e exportações usam um pool de conexões próprio (DB_READ_POOL_MAX) no perfil "
+               "de leitura (DB_READ_ISOLATION; réplica via get_read_conn no módulo DB, se existir): "
+               "consultas longas não bloqueiam nem esperam os salvamentos do lançamento.")
+    try:
+        estado = arm.estado_leitura()
+    except Exception as e:
+        st.error(f"Falha ao consultar o perfil de leitura: {e}")
+        return
+    metade = (len(estado) + 1) // 2
+    for coluna, parte in zip(st.columns(2), (estado[:metade], estado[metade:])):
+        with coluna:
+            for rotulo, valor in parte:
+                st.text_input(rotulo, value=valor, disabled=True, key=f"db_leitura_{rotulo}")
+
+    if dict(estado).get("ALLOW_SNAPSHOT_ISOLATION", "ON") == "ON" or LEITURA_ISOLAMENTO != "snapshot":
+        return
+    st.warning("O banco não permite isolamento SNAPSHOT: relatórios longos leem em READ COMMITTED "
+               "e disputam travas com os salvamentos. A opção ALLOW_SNAPSHOT_ISOLATION é ligada pelo "
+               "DBA na configuração do banco; o app passa a usá-la depois de reiniciado.")
 
-    st.caption("As credenciais são lidas de variáveis de ambiente. Altere-as no servidor/ambiente de execução.")
+def pagina_db():
+    arm = armazenamento()
+    st.markdown(f"### Configuração do Banco ({arm.rotulo})")
+    campos = arm.configuracao()
+    metade = (len(campos) + 1) // 2
+    for coluna, parte in zip(st.columns(2), (campos[:metade], campos[metade:])):
+        with coluna:
+            for rotulo, valor in parte:
+                st.text_input(rotulo, value=valor, disabled=True)
+
+    st.caption("As credenciais e o backend (DB_BACKEND = sqlserver | sqlite) são lidos de variáveis "
+               "de ambiente. Altere-os no servidor/ambiente de execução.")
 
     if st.button("🔌 Testar conexão"):
         try:
-            ok = test_connection()
+            ok = arm.testar_conexao()
             if ok:
                 st.success("Conexão OK (SELECT 1 executado com sucesso).")
         except Exception as e:
             st.error(f"Falha ao conectar: {e}")
 
+    _leituras_db(arm)
+
+    if not arm.suporta_planos:
+        return
+    with st.expander("Planos de execução (diagnóstico)", expanded=False):
+        st.caption("Executa cada função da camada de dados com SET STATISTICS XML ON numa "
+                   "transação desfeita ao final (nada é gravado) e mostra o plano real.")
+        if st.button("Capturar planos", key="db_planos"):
+            for rotulo, chamada in cenarios_diagnostico():
+                st.markdown(f"**{rotulo}**")
+                try:
+                    planos = capturar_planos(chamada)
+                except Exception as e:
+                    st.error(f"Falha: {e}")
+                    continue
+                if not planos:
+                    st.caption("Nenhum comando com plano.")
+                for _, xml in planos:
+                    st.code(resumir_plano(xml), language="text")
+            # o diagnóstico passou pelas funções de escrita (desfeitas): descarta os caches
+            invalidar_quadro_colaboradores()
+            invalidar_mapa_ids()
+
+# ------------------------------
+# Página de Performance (admin)
+# ------------------------------
+def pagina_desempenho():
+    st.markdown("### Performance")
+    if not PERF_ATIVO:
+        st.info("Instrumentação desligada (PERF_ENABLED=0).")
+        return
+    perf = _desempenho()
+    consultas, reruns, lentas = perf.tabela_consultas(), perf.tabela_reruns(), perf.tabela_lentas()
+
+    st.caption(f"Agregados deste processo desde {perf.desde:%d/%m/%Y %H:%M:%S}. Limites do log de lentas: "
+               f"consulta ≥ {PERF_CONSULTA_LENTA_MS:.0f} ms, rerun ≥ {PERF_RERUN_LENTO_MS:.0f} ms.")
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Reruns", int(reruns["reruns"].sum()))
+    m2.metric("Round-trips", int(consultas["chamadas"].sum()))
+    m3.metric("Tempo no banco (s)", f"{consultas['ms'].sum() / 1000:.2f}")
+    m4.metric("Ocorrências lentas", perf.total_lentas)
+
+    st.markdown("#### Por página e usuário")
+    st.dataframe(reruns[["pagina", "usuario", "reruns", "roundtrips_por_rerun", "db_ms_por_rerun",
+                         "tela_ms_por_rerun", "max_ms"]].round(1),
+                 use_container_width=True, hide_index=True)
+
+    st.markdown("#### Por consulta")
+    st.dataframe(consultas[["chamador", "chamadas", "ms", "media_ms", "max_ms", "linhas", "consulta", "sql"]].round(1),
+                 use_container_width=True, hide_index=True)
+
+    st.markdown("#### Log de lentas")
+    if lentas.empty:
+        st.caption("Nenhuma ocorrência acima dos limites.")
+    else:
+        st.dataframe(lentas, use_container_width=True, hide_index=True)
+
+    # detalhamento: o que o último rerun de cada página (nesta sessão) fez no banco
+    ultimos = {p: c for p, c in st.session_state.get("perf_ultimos", {}).items() if p != "Performance"}
+    if ultimos:
+        st.markdown("#### Último rerun desta sessão")
+        pagina = st.selectbox("Página", sorted(ultimos), key="perf_pagina")
+        c = ultimos[pagina]
+        st.caption(f"{c.quando:%H:%M:%S} — total {c.total_ms:.0f} ms: {len(c.consultas)} round-trips, "
+                   f"{c.db_ms:.0f} ms no banco, {c.tela_ms:.0f} ms de tela.")
+        st.dataframe(c.resumo().round(1), use_container_width=True, hide_index=True)
+
+    st.markdown("#### Cache compartilhado (L2)")
+    l2 = _cache_l2()
+    if l2 is None:
+        st.caption("Desligado (SHARED_CACHE_ENABLED=0) ou arquivo indisponível/recusado "
+                   f"(pasta e arquivo precisam ser só do usuário do serviço: {CACHE_L2_CAMINHO}).")
+    else:
+        est = l2.estatisticas()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Entradas", est["entradas"])
+        c2.metric("Tamanho (MB)", f"{est['mb']:.1f}")
+        c3.metric("Acertos / faltas", f"{est['acertos']} / {est['faltas']}")
+        c4.metric("Erros", est["erros"])
+        st.caption(f"{l2.caminho} — compartilhado pelos processos deste host; contadores deste processo.")
+        if st.button("Limpar cache compartilhado", key="perf_l2_limpar"):
+            l2.limpar()
+            st.rerun()
+
+    if ESCRITA_ADIADA:
+        st.markdown("#### Gravação adiada (write-behind)")
+        fila = _fila_gravacao()
+        pendentes, rejeitadas, conflitos = fila.contagens()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Pendentes no diário", pendentes)
+        c2.metric("Gravadas (este processo)", fila.gravadas)
+        c3.metric("Edições coalescidas", fila.coalescidas)
+        c4.metric("Rejeitadas / conflitos", f"{rejeitadas} / {conflitos}")
+        quando = f"{fila.ultima_descarga:%d/%m %H:%M:%S}" if fila.ultima_descarga else "nenhuma neste processo"
+        st.caption(f"{fila.caminho} (SAVE_JOURNAL_PATH) — última descarga: {quando}.")
+        if fila.ultimo_erro:
+            st.warning(f"Último erro ({fila.ultimo_erro[0]:%H:%M:%S}): {fila.ultimo_erro[1]}")
+        if rejeitadas or conflitos:
+            with st.expander("Edições rejeitadas"):
+                st.dataframe(fila.rejeitadas(), use_container_width=True, hide_index=True)
+        if st.button("Descarregar agora", key="perf_fila"):
+            fila.descarregar_agora()
+
+    col1, col2 = st.columns(2)
+    if col1.button("Zerar métricas", key="perf_zerar"):
+        perf.zerar()
+        st.rerun()
+    if PERF_PROMETHEUS_ARQUIVO:
+        if col2.button("Exportar Prometheus agora", key="perf_prom"):
+            if perf.exportar_prometheus(forcar=True):
+                st.success(f"Métricas gravadas em {os.path.abspath(PERF_PROMETHEUS_ARQUIVO)}")
+            else:
+                st.error("Falha ao gravar o arquivo de métricas.")
+        col2.caption(f"Exportação automática a cada {PERF_PROMETHEUS_INTERVALO_S:.0f} s para "
+                     f"{PERF_PROMETHEUS_ARQUIVO}.")
+    else:
+        col2.caption("Exportação Prometheus desligada (defina PERF_PROMETHEUS_FILE).")
+    with st.expander("Métricas no formato Prometheus"):
+        st.code(perf.texto_prometheus(), language="text")
+
 # ------------------------------
 # Roteamento (com login)
 # ------------------------------
-if not st.session_state.get("auth", False):
-    show_login()
-
-# >>> Auto-import: rode uma vez por sessão (se quiser manter)
-if not st.session_state.get("seed_loaded", False):
-    # Se não quiser auto-import, comente as duas linhas abaixo
-    # _try_auto_import_seed()
-    st.session_state["seed_loaded"] = True
-
-st.sidebar.title("Menu")
-st.sidebar.caption(f"Usuário: {st.session_state.get('user_email','')}")
-if st.sidebar.button("Sair"):
-    for k in ("auth", "user_email"):
-        st.session_state.pop(k, None)
-    st.rerun()
-
-# Opções de navegação (Colaboradores e DB só aparecem para admin)
-nav_opts = ["Lançamento diário"] + (["Colaboradores"] if is_admin() else []) + ["Relatórios"] + (["DB"] if is_admin() else [])
-escolha = st.sidebar.radio("Navegação", nav_opts, index=0)
-
-# Painel Admin apenas para admin
-if is_admin():
+def _painel_admin():
+    # Painel Admin (só é chamado para admin)
     with st.sidebar.expander("⚙️ Admin"):
         coladm1, coladm2 = st.columns([1,1])
         if coladm1.button("Carregar lista inicial de colaboradores"):
-            seed_colaboradores_iniciais(turno_default="1°")
-            st.success("Seed aplicado (somente adiciona quem não existe).")
+            inseridos, ignorados = seed_colaboradores_iniciais(turno_default="1°")
+            st.success(f"Seed aplicado: {inseridos} adicionados, {ignorados} já existiam.")
 
         up = st.file_uploader("Importar turnos (xlsx/csv)", type=["xlsx", "xls", "csv"], key="up_turnos")
+        st.caption(f".xlsx e .csv são lidos aos poucos, de qualquer tamanho; .xls (formato antigo) é "
+                   f"carregado aba a aba na memória e aceito só até {IMPORTACAO_XLS_MAX_MB:.0f} MB.")
         setor_default = st.selectbox("Se o CSV não tiver coluna SETOR, aplicar a:",
                                      ["(obrigatório se CSV sem SETOR)"] + OPCOES_SETORES, index=0)
+        simular = st.checkbox("Apenas simular (não grava)", value=False, key="up_turnos_simular")
         if st.button("Aplicar turnos do arquivo"):
             if up is None:
                 st.warning("Selecione um arquivo .xlsx ou .csv")
             else:
+                barra = st.progress(0.0, text="Lendo arquivo...")
+
+                def _progresso(lidas, fracao):
+                    barra.progress(fracao if fracao is not None else 0.0, text=f"{lidas} linhas lidas")
+
                 try:
-                    n = importar_turnos_de_arquivo(up, setor_padrao=None if setor_default.startswith("(") else setor_default)
-                    st.success(f"Turnos aplicados/atualizados para {n} colaboradores.")
+                    r = importar_turnos_de_arquivo(up, setor_padrao=None if setor_default.startswith("(") else setor_default,
+                                                   simular=simular, progresso=_progresso)
+                    barra.progress(1.0, text=f"{r['linhas']} colaboradores processados")
+                    resumo = (f"{r['linhas']} colaboradores no arquivo: {r['inseridos']} novos, "
+                              f"{r['atualizados']} com turno alterado, {r['reativados']} reativados, "
+                              f"{r['inalterados']} sem mudança.")
+                    if simular:
+                        st.info(f"Simulação — {resumo}")
+                    else:
+                        st.success(f"Turnos aplicados. {resumo}")
                 except Exception as e:
                     st.error(f"Erro ao importar: {e}")
 
-# Roteamento
-if escolha == "Lançamento diário":
-    pagina_lancamento_diario()
-elif escolha == "Colaboradores":
-    if not is_admin():
-        st.error("Acesso restrito aos administradores.")
-        st.stop()
-    pagina_colaboradores()
-elif escolha == "Relatórios":
-    pagina_relatorios_globais()
-elif escolha == "DB":
-    if not is_admin():
-        st.error("Acesso restrito aos administradores.")
-        st.stop()
-    pagina_db()
+def _rotear(escolha: str):
+    if escolha == "Lançamento diário":
+        pagina_lancamento_diario()
+    elif escolha == "Colaboradores":
+        if not is_admin():
+            st.error("Acesso restrito aos administradores.")
+            st.stop()
+        pagina_colaboradores()
+    elif escolha == "Relatórios":
+        pagina_relatorios_globais()
+    elif escolha == "DB":
+        if not is_admin():
+            st.error("Acesso restrito aos administradores.")
+            st.stop()
+        pagina_db()
+    elif escolha == "Performance":
+        if not is_admin():
+            st.error("Acesso restrito aos administradores.")
+            st.stop()
+        pagina_desempenho()
+
+# Importável sem efeitos de tela (ex.: benchmark_cadastro.py); `streamlit run` executa
+# o script como __main__.
+def main():
+    if not st.session_state.get("auth", False):
+        show_login()
+
+    # >>> Auto-import: rode uma vez por sessão (se quiser manter)
+    if not st.session_state.get("seed_loaded", False):
+        # Se não quiser auto-import, comente as duas linhas abaixo
+        # _try_auto_import_seed()
+        st.session_state["seed_loaded"] = True
+
+    st.sidebar.title("Menu")
+    st.sidebar.caption(f"Usuário: {st.session_state.get('user_email','')}")
+    if st.sidebar.button("Sair"):
+        for k in ("auth", "user_email"):
+            st.session_state.pop(k, None)
+        st.rerun()
+
+    # Opções de navegação (Colaboradores, DB e Performance só aparecem para admin)
+    nav_opts = ["Lançamento diário"] + (["Colaboradores"] if is_admin() else []) + ["Relatórios"] + (["DB", "Performance"] if is_admin() else [])
+    escolha = st.sidebar.radio("Navegação", nav_opts, index=0)
+
+    # Painel Admin apenas para admin; o rerun inteiro (painel + página) é medido
+    with medir_rerun(escolha):
+        if is_admin():
+            _painel_admin()
+        _rotear(escolha)
+
+if __name__ == "__main__":
+    main()
 
 # Fim do arquivo
@@ -0,0 +1,23 @@
+"""O app importado uma vez por sessão, apontando para um SQLite vazio em pasta temporária."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RAIZ))  # cadastro_hc.py e armazenamento_hc.py ficam na raiz
+
+
+@pytest.fixture(scope="session")
+def app():
+    pasta = tempfile.mkdtemp()
+    os.environ.update(DB_BACKEND="sqlite", SQLITE_PATH=os.path.join(pasta, "testes.sqlite3"),
+                      SHARED_CACHE_ENABLED="0", SAVE_WRITE_BEHIND="0")
+    import cadastro_hc
+    from streamlit.logger import set_log_level
+    set_log_level("error")
+
+    cadastro_hc.init_db()
+    return cadastro_hc
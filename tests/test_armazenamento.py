@@ -0,0 +1,167 @@
+"""
+Camada de banco sem o Streamlit: o backend SQLite é montado direto (com os próprios
+pools, num arquivo novo por teste) e cada teste confere uma ida e volta pelo banco.
+"""
+import sqlite3
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from armazenamento_hc import (
+    MIGRACOES_SQLITE,
+    ROTULO_CONSULTA,
+    VERSAO_QUALQUER,
+    Armazenamento,
+    ArmazenamentoSqlite,
+    PoolConexoes,
+)
+
+DIA1, DIA2 = date(2026, 3, 2), date(2026, 3, 3)
+
+
+@pytest.fixture
+def arm(tmp_path):
+    arm = ArmazenamentoSqlite(str(tmp_path / "banco.sqlite3"), espera_s=5)
+    arm.usar_pools(PoolConexoes(arm.conectar, 4, 300, 30, 5),
+                   PoolConexoes(arm.conectar_leitura, 2, 300, 30, 5))
+    with arm.conexao() as cn:
+        arm.aplicar_migracoes(cn)
+    yield arm
+    arm.pool.fechar_todas()
+    arm.pool_leitura.fechar_todas()
+
+
+@pytest.fixture
+def quadro(arm):
+    arm.inserir_colaboradores([("Ana", "PAF", "1°"), ("Bruno", "PAF", "1°")])
+    ids = arm.carregar_quadro()["id"].tolist()
+    return ids, arm.criar_dimensao("setores", "PAF"), arm.criar_dimensao("turnos", "1°")
+
+
+def _celulas(arm, ids) -> list:
+    lidas = arm.carregar_presencas(ids, DIA1, DIA2).sort_values(["colaborador_id", "data"])
+    return list(lidas[["colaborador_id", "data", "status"]].itertuples(index=False, name=None))
+
+
+def _versao(arm, cid, dia) -> int:
+    lidas = arm.carregar_presencas([cid], dia, dia)
+    return int(lidas["versao"].iloc[0]) if len(lidas) else 0
+
+
+def test_backend_incompleto_nao_instancia():
+    class SoConecta(Armazenamento):
+        def conectar(self):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        SoConecta()
+
+
+def test_migracoes_aplicadas_uma_vez(arm):
+    ultima = max(m[0] for m in MIGRACOES_SQLITE)
+    with arm.conexao() as cn:
+        assert arm.aplicar_migracoes(cn) == ultima
+        versoes = [r[0] for r in cn.execute("SELECT versao FROM schema_versao ORDER BY versao")]
+    assert versoes == sorted(m[0] for m in MIGRACOES_SQLITE)
+
+
+def test_colaboradores_ida_e_volta(arm):
+    assert arm.inserir_colaboradores([("Ana", "PAF", "1°"), ("Bruno", "PAF", "2°")]) == 2
+    # nome sem distinção de caixa, como o collation CI do SQL Server
+    assert arm.inserir_colaboradores([("ana", "PAF", "1°")]) == 0
+    quadro = arm.carregar_quadro()
+    assert quadro[["nome", "setor", "turno", "ativo"]].values.tolist() == [
+        ["Ana", "PAF", "1°", 1], ["Bruno", "PAF", "2°", 1]]
+
+    arm.atualizar_ativo_colaboradores([int(quadro["id"].iloc[1])], [])
+    arm.atualizar_turno_colaborador(int(quadro["id"].iloc[0]), "3°")
+    assert arm.carregar_quadro()[["turno", "ativo"]].values.tolist() == [["3°", 1], ["2°", 0]]
+
+
+def test_dimensao_criada_uma_vez(arm):
+    setor = arm.criar_dimensao("setores", "Setor Novo")
+    assert arm.criar_dimensao("setores", "Setor Novo") == setor
+    assert arm.criar_leader("Carla", "PAF", "1°") == arm.criar_leader("Carla", "PAF", "1°")
+
+
+def test_presencas_ida_e_volta(arm, quadro):
+    (ana, bruno), setor, turno = quadro
+    afetadas, conflitos = arm.gravar_presencas(
+        [(ana, DIA1, "PRESENTE"), (bruno, DIA1, "FALTA"), (ana, DIA2, "BH")], setor, turno, None)
+    assert (afetadas, conflitos) == (3, [])
+    assert _celulas(arm, [ana, bruno]) == [(ana, DIA1, "PRESENTE"), (ana, DIA2, "BH"), (bruno, DIA1, "FALTA")]
+
+    # status vazio apaga a célula
+    arm.gravar_presencas([(bruno, DIA1, "")], setor, turno, None)
+    assert _celulas(arm, [ana, bruno]) == [(ana, DIA1, "PRESENTE"), (ana, DIA2, "BH")]
+
+    dia = pd.concat(arm.iterar_dia("PAF", DIA1, 1), ignore_index=True)
+    assert dia[["colaborador", "data", "status"]].values.tolist() == [["Ana", DIA1, "PRESENTE"]]
+    agregado = arm.relatorio_agregado(DIA1, DIA2, None, None)
+    assert agregado[["data", "PRESENTE", "BH", "total"]].values.tolist() == [[DIA1, 1, 0, 1], [DIA2, 0, 1, 1]]
+
+
+def test_versao_velha_nao_grava_e_vira_conflito(arm, quadro):
+    (ana, _), setor, turno = quadro
+    arm.gravar_presencas([(ana, DIA1, "PRESENTE", 0)], setor, turno, None)
+    lida = _versao(arm, ana, DIA1)
+    arm.gravar_presencas([(ana, DIA1, "FALTA", lida)], setor, turno, None)  # outra pessoa, antes
+
+    afetadas, conflitos = arm.gravar_presencas([(ana, DIA1, "BH", lida)], setor, turno, None)
+    assert afetadas == 0
+    assert conflitos == [(ana, DIA1, "FALTA", "BH", _versao(arm, ana, DIA1))]
+    assert _celulas(arm, [ana]) == [(ana, DIA1, "FALTA")]
+
+
+def test_versao_velha_com_mesmo_status_nao_e_conflito(arm, quadro):
+    (ana, _), setor, turno = quadro
+    arm.gravar_presencas([(ana, DIA1, "PRESENTE", 0)], setor, turno, None)
+    lida = _versao(arm, ana, DIA1)
+    arm.gravar_presencas([(ana, DIA1, "FALTA", lida)], setor, turno, None)
+    atual = _versao(arm, ana, DIA1)
+
+    # as duas pessoas chegaram ao mesmo valor: nada a avisar nem a regravar
+    assert arm.gravar_presencas([(ana, DIA1, "FALTA", lida)], setor, turno, None) == (0, [])
+    assert _versao(arm, ana, DIA1) == atual
+
+
+def test_sem_versao_ultima_escrita_vence(arm, quadro):
+    (ana, _), setor, turno = quadro
+    arm.gravar_presencas([(ana, DIA1, "PRESENTE", 0)], setor, turno, None)
+    arm.gravar_presencas([(ana, DIA1, "FALTA", _versao(arm, ana, DIA1))], setor, turno, None)
+
+    assert arm.gravar_presencas([(ana, DIA1, "BH", VERSAO_QUALQUER)], setor, turno, None) == (1, [])
+    assert arm.gravar_presencas([(ana, DIA2, "BH")], setor, turno, None) == (1, [])
+    assert _celulas(arm, [ana]) == [(ana, DIA1, "BH"), (ana, DIA2, "BH")]
+
+
+def test_apagar_com_versao_velha_vira_conflito(arm, quadro):
+    (ana, _), setor, turno = quadro
+    arm.gravar_presencas([(ana, DIA1, "PRESENTE", 0)], setor, turno, None)
+    lida = _versao(arm, ana, DIA1)
+    arm.gravar_presencas([(ana, DIA1, "FALTA", lida)], setor, turno, None)
+
+    afetadas, conflitos = arm.gravar_presencas([(ana, DIA1, "", lida)], setor, turno, None)
+    assert afetadas == 0
+    assert [c[:4] for c in conflitos] == [(ana, DIA1, "FALTA", "")]
+    assert _celulas(arm, [ana]) == [(ana, DIA1, "FALTA")]
+
+
+def test_consultas_rotuladas_pelo_metodo(arm, quadro):
+    (ana, _), setor, turno = quadro
+    arm.gravar_presencas([(ana, DIA1, "PRESENTE")], setor, turno, None)
+    rotulos = []
+    with arm.conexao_leitura() as cn:  # as chamadas aninhadas reaproveitam esta conexão
+        cn.set_trace_callback(lambda sql: rotulos.append(ROTULO_CONSULTA.get()))
+        for _ in arm.iterar_dia("PAF", DIA1, 1):  # gerador: o rótulo vale em cada passo
+            rotulos.append(ROTULO_CONSULTA.get())  # entre um passo e outro: "?"
+        arm.ordem_colaboradores()
+        cn.set_trace_callback(None)
+    assert set(rotulos) == {"iterar_dia", "ordem_colaboradores", "?"}
+    assert ROTULO_CONSULTA.get() == "?"
+
+
+def test_pool_de_leitura_nao_escreve(arm):
+    with arm.conexao_leitura() as cn, pytest.raises(sqlite3.OperationalError):
+        cn.execute("DELETE FROM colaboradores")
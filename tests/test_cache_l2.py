@@ -0,0 +1,62 @@
+"""Cache compartilhado (L2): só dados no arquivo e nada de arquivo alheio."""
+import os
+import pickle
+from datetime import date
+
+import pandas as pd
+import pytest
+
+
+class _Carga:
+    # ao ser desserializada com pickle, cria o arquivo `caminho`
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def __reduce__(self):
+        return (open, (self.caminho, "w"))
+
+
+def test_ida_e_volta_sem_pickle(app, tmp_path):
+    l2 = app.CacheCompartilhado(str(tmp_path / "l2" / "cache.sqlite3"), "teste", 1 << 20, 60)
+    df = pd.DataFrame({"colaborador_id": [1, 2], "data": [date(2026, 1, 1), date(2026, 1, 2)],
+                       "status": ["PRESENTE", ""], "versao": [3, 4]})
+    l2.gravar(("presencas", 1), df)
+    l2.gravar(("escalar", 1), {"n": 1})
+    achou, valor = l2.obter(("presencas", 1))
+    assert achou
+    pd.testing.assert_frame_equal(valor, df)
+    assert l2.obter(("escalar", 1)) == (True, {"n": 1})
+    assert os.stat(tmp_path / "l2").st_mode & 0o777 == 0o700
+
+
+def test_blob_pickle_plantado_nao_e_executado(app, tmp_path):
+    l2 = app.CacheCompartilhado(str(tmp_path / "cache.sqlite3"), "teste", 1 << 20, 60)
+    l2._cn.execute("INSERT INTO entradas VALUES (?, ?, 1, strftime('%s', 'now'))",
+                   (l2._chave(("quadro",)), pickle.dumps(_Carga(str(tmp_path / "executou")))))
+    assert l2.obter(("quadro",)) == (False, None)
+    assert l2.erros == 1
+    assert not (tmp_path / "executou").exists()
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="permissões POSIX")
+def test_recusa_arquivo_ou_pasta_gravavel_por_outros(app, tmp_path):
+    arquivo = tmp_path / "cache.sqlite3"
+    arquivo.touch()
+    arquivo.chmod(0o666)
+    with pytest.raises(PermissionError):
+        app.abrir_arquivo_privado(str(arquivo))
+
+    pasta = tmp_path / "aberta"
+    pasta.mkdir()
+    pasta.chmod(0o777)
+    with pytest.raises(PermissionError):
+        app.abrir_arquivo_privado(str(pasta / "cache.sqlite3"))
+
+
+@pytest.mark.skipif(not hasattr(os, "O_NOFOLLOW"), reason="sem O_NOFOLLOW")
+def test_recusa_link_simbolico(app, tmp_path):
+    alvo = tmp_path / "alvo.sqlite3"
+    alvo.touch()
+    (tmp_path / "cache.sqlite3").symlink_to(alvo)
+    with pytest.raises(OSError):
+        app.abrir_arquivo_privado(str(tmp_path / "cache.sqlite3"))
@@ -0,0 +1,113 @@
+"""
+Escrita adiada (FilaGravacao): a descarga grava a última edição de cada célula, manda
+para conflito o que outra pessoa mudou no banco, regrava por cima da própria edição
+anterior e não apaga do diário o que gravou depois de perder o arrendamento. A thread
+não pode depender de st.cache_*: as descargas aqui rodam com eles desligados.
+"""
+import time
+from datetime import date
+
+import pytest
+
+SETOR, TURNO = "Expedição", "1°"
+NOMES = ["Davi", "Elisa", "Fábio"]
+
+
+@pytest.fixture(scope="module")
+def quadro(app):
+    app.carregar_colaboradores_em_lote([(nome, SETOR, TURNO) for nome in NOMES])
+    ids = app.listar_colaboradores_por_setor(SETOR)["id"].tolist()
+    return ids, app.ids_presencas(SETOR, TURNO, "Leader A")
+
+
+@pytest.fixture
+def fila(app, tmp_path):
+    f = app.FilaGravacao(str(tmp_path / "diario.sqlite3"), 3600, 1000, 60,
+                         app.armazenamento(), app._marcas_escrita())
+    yield f
+    f.parar()
+
+
+def _descarregar(app, fila, monkeypatch) -> int:
+    def fora_do_rerun(*_a, **_k):
+        raise AssertionError("st.cache_* chamado pela descarga")
+
+    with monkeypatch.context() as m:
+        for nome in ("armazenamento", "_marcas_escrita", "_desempenho", "id_dimensao", "id_leader"):
+            m.setattr(app, nome, fora_do_rerun)
+        return fila.descarregar()
+
+
+def _banco(app, ids, dia) -> dict:
+    pres = app.armazenamento().carregar_presencas(ids, dia, dia)
+    return dict(zip(pres["colaborador_id"].tolist(), pres["status"].tolist()))
+
+
+def _versao(app, cid, dia) -> int:
+    return app.versoes_presencas(app.armazenamento().carregar_presencas([cid], dia, dia)).get((cid, dia), 0)
+
+
+def test_coalesce_edicoes_da_mesma_celula(app, quadro, fila, monkeypatch):
+    ids, chaves = quadro
+    dia = date(2026, 5, 4)
+    fila.enfileirar([(ids[0], dia.isoformat(), "PRESENTE")], SETOR, TURNO, "Leader A", chaves)
+    fila.enfileirar([(ids[0], dia.isoformat(), "FALTA")], SETOR, TURNO, "Leader A", chaves)
+    assert _descarregar(app, fila, monkeypatch) == 2
+    assert _banco(app, ids, dia) == {ids[0]: "FALTA"}
+    assert (fila.gravadas, fila.coalescidas) == (1, 1)
+    assert fila.contagens() == (0, 0, 0)
+
+
+def test_versao_velha_vira_conflito(app, quadro, fila, monkeypatch):
+    ids, chaves = quadro
+    dia = date(2026, 5, 5)
+    # a pessoa viu a célula vazia (versão 0); outra gravou FALTA antes da descarga
+    fila.enfileirar([(ids[1], dia.isoformat(), "PRESENTE", "", 0)], SETOR, TURNO, "Leader A", chaves)
+    app.gravar_linhas_presencas([(ids[1], dia, "FALTA", 0)], SETOR, TURNO, "Leader B")
+    _descarregar(app, fila, monkeypatch)
+    assert _banco(app, ids, dia) == {ids[1]: "FALTA"}
+    assert fila.contagens(ids, dia) == (0, 0, 1)
+    conflito = fila.conflitos(ids, dia).iloc[0]
+    assert (conflito["status_atual"], conflito["status_tentado"]) == ("FALTA", "PRESENTE")
+
+
+def test_regrava_sobre_a_propria_edicao(app, quadro, fila, monkeypatch):
+    ids, chaves = quadro
+    dia = date(2026, 5, 6)
+    fila.enfileirar([(ids[2], dia.isoformat(), "FALTA", "", 0)], SETOR, TURNO, "Leader A", chaves)
+    # segunda edição hidratada com a primeira ainda pendente: viu FALTA, versão 0
+    segunda = (ids[2], dia.isoformat(), "PRESENTE", "FALTA", 0)
+    _descarregar(app, fila, monkeypatch)
+    assert _versao(app, ids[2], dia) > 0
+    fila.enfileirar([segunda], SETOR, TURNO, "Leader A", chaves)
+    _descarregar(app, fila, monkeypatch)
+    assert _banco(app, ids, dia) == {ids[2]: "PRESENTE"}
+    assert fila.contagens(ids, dia) == (0, 0, 0)
+
+
+def test_arrendamento_perdido_no_meio_da_descarga(app, quadro, fila, monkeypatch):
+    ids, chaves = quadro
+    dia = date(2026, 5, 7)
+    outras = app.ids_presencas(SETOR, TURNO, "Leader C")
+    fila.enfileirar([(ids[0], dia.isoformat(), "PRESENTE")], SETOR, TURNO, "Leader A", chaves)
+    fila.enfileirar([(ids[1], dia.isoformat(), "FALTA")], SETOR, TURNO, "Leader C", outras)
+
+    gravar = fila._gravar_conferindo
+
+    def gravar_e_perder(*args):
+        resultado = gravar(*args)
+        with fila._transacao() as cn:  # outra réplica toma a descarga depois do primeiro grupo
+            cn.execute("UPDATE descarga SET processo = 'outra-replica', expira_em = ?", (time.time() + 60,))
+        return resultado
+
+    monkeypatch.setattr(fila, "_gravar_conferindo", gravar_e_perder)
+    _descarregar(app, fila, monkeypatch)
+    assert _banco(app, ids, dia) == {ids[0]: "PRESENTE"}
+    assert fila.contagens(ids, dia)[0] == 2  # gravado sem arrendamento: fica para quem o tomou
+
+    monkeypatch.undo()
+    with fila._transacao() as cn:
+        cn.execute("UPDATE descarga SET expira_em = 0")
+    _descarregar(app, fila, monkeypatch)
+    assert _banco(app, ids, dia) == {ids[0]: "PRESENTE", ids[1]: "FALTA"}
+    assert fila.contagens() == (0, 0, 0)
@@ -0,0 +1,41 @@
+"""Leitura de CSV do importador de turnos: encoding e separador a partir da amostra."""
+import io
+
+import pandas as pd
+import pytest
+
+
+def _csv(linhas, encoding="utf-8", nome="turnos.csv"):
+    arq = io.BytesIO("".join(linhas).encode(encoding) if isinstance(linhas, list) else linhas)
+    arq.name = nome
+    return arq
+
+
+def _lido(app, arq):
+    return pd.concat(list(app.ler_turnos_em_lotes(arq, tamanho_lote=1000)), ignore_index=True)
+
+
+def test_latin1_depois_da_amostra(app):
+    # Excel exporta latin1; o primeiro acento vem bem depois dos 64 KB da amostra
+    corpo = "NOME;TURNO;SETOR\n" + "".join(f"Fulano {i};1;PAF\n" for i in range(6000))
+    arq = _csv(corpo.encode("ascii") + "João Conceição;2°;PAF\n".encode("latin1"))
+    df = _lido(app, arq)
+    assert len(df) == 6001
+    assert df.iloc[-1].tolist() == ["João Conceição", "PAF", "2°"]
+
+
+def test_utf8_inteiro(app):
+    df = _lido(app, _csv(["NOME,TURNO,SETOR\n", "Ângela Mäder,2°,PAF\n"]))
+    assert df.iloc[0].tolist() == ["Ângela Mäder", "PAF", "2°"]
+
+
+def test_separador_pela_amostra_toda(app):
+    # pelo cabeçalho sozinho (vírgula no nome de uma coluna) o separador seria ","
+    linhas = ["NOME;TURNO;SETOR (PAF, TECIDO)\n"] + [f"Fulano {i};1°;PAF\n" for i in range(50)]
+    assert app._detectar_formato_csv(_csv(linhas))[1] == ";"
+
+
+def test_xls_acima_do_limite(app, monkeypatch):
+    monkeypatch.setattr(app, "IMPORTACAO_XLS_MAX_MB", 0.001)
+    with pytest.raises(ValueError, match=".xlsx ou .csv"):
+        list(app.ler_turnos_em_lotes(_csv(b"\0" * 4096, nome="turnos.xls")))
@@ -0,0 +1,112 @@
+"""
+Relatórios: paginação por chave do detalhe e intervalos fatiados por período (a
+intercalação das fatias tem de reproduzir a ordem da consulta inteira, inclusive com
+nomes acentuados e com caixa misturada: o collation do banco não é a ordem de texto
+do Python). A exportação em partes tem de dar os mesmos dados que o arquivo único.
+"""
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+
+NOMES = ["Bruno", "zeca", "Álvaro", "érica", "Carla", "ana paula", "Zuleica", "Ângela"]
+DIAS = [date(2026, 1, 10), date(2026, 1, 20), date(2026, 2, 3), date(2026, 2, 20)]  # três períodos 16→15
+
+
+@pytest.fixture(scope="module")
+def app(app):
+    cadastro_hc = app
+    setores = cadastro_hc.OPCOES_SETORES[:2]
+    cadastro_hc.carregar_colaboradores_em_lote(
+        [(nome, setor, turno) for setor in setores for turno in ("1°", "2°") for nome in NOMES])
+    for setor in setores:
+        quadro = cadastro_hc.listar_colaboradores_por_setor(setor)
+        for turno in ("1°", "2°"):
+            ids = quadro.loc[quadro["turno"] == turno, "id"].tolist()
+            linhas = [(cid, dia, "PRESENTE") for cid in ids for dia in DIAS]
+            cadastro_hc.gravar_linhas_presencas(linhas, setor, turno, "Teste")
+    return cadastro_hc
+
+
+def _inteiro(lotes) -> pd.DataFrame:
+    return pd.concat(list(lotes), ignore_index=True)
+
+
+def test_detalhe_pagina_seguinte(app):
+    ini, fim = DIAS[0], DIAS[-1]
+    tudo = app.relatorio_detalhe_pagina(ini, fim, limite=10_000)
+    pagina1 = app.relatorio_detalhe_pagina(ini, fim, limite=25)
+    apos = app.chave_da_ultima_linha(pagina1)
+    # vai como parâmetro do pyodbc no SQL Server: nada de numpy.int64 & cia.
+    assert all(type(v).__module__ == "builtins" or isinstance(v, date) for v in apos)
+    pagina2 = app.relatorio_detalhe_pagina(ini, fim, apos=apos, limite=25)
+    pd.testing.assert_frame_equal(pagina2, tudo.iloc[25:50].reset_index(drop=True))
+
+
+def test_mesclar_fatias_segue_a_posicao_do_banco(app):
+    # ordem do "banco": Zeca < Álvaro (como no NOCASE do SQLite); Ana/ana empatam
+    posicoes = {"Zeca": 1, "Álvaro": 2, "Ana": 3, "ana": 3}
+
+    def fatia(linhas):
+        return [pd.DataFrame(linhas, columns=["colaborador", "data"])]
+
+    fatias = [
+        fatia([("Zeca", 1), ("Álvaro", 1), ("Ana", 1), ("ana", 2), ("Ana", 3)]),
+        fatia([("Zeca", 10), ("Álvaro", 10), ("ana", 10)]),
+    ]
+    mesclado = _inteiro(app.mesclar_fatias(fatias, ["colaborador"], lambda v: (posicoes[v[0]],), lote=2))
+    assert list(mesclado.itertuples(index=False, name=None)) == [
+        ("Zeca", 1), ("Zeca", 10), ("Álvaro", 1), ("Álvaro", 10),
+        ("Ana", 1), ("ana", 2), ("Ana", 3), ("ana", 10),
+    ]
+
+
+def test_mesclar_fatias_vazias(app):
+    assert list(app.mesclar_fatias([[pd.DataFrame()], []], ["setor"], lambda v: v)) == []
+
+
+def test_exportacao_fatiada_igual_a_consulta_inteira(app, monkeypatch):
+    ini, fim = DIAS[0], DIAS[-1]
+    esperado = _inteiro(app.armazenamento().iterar_relatorio(ini, fim, None, None, 1000))
+
+    monkeypatch.setattr(app, "RELATORIO_PARALELO", 2)
+    assert len(app._fatiar(ini, fim)) == 3
+    fatiado = _inteiro(app.iterar_relatorio_em_lotes(ini, fim, lote=7))
+
+    # o NOCASE do SQLite põe os acentuados depois do "z"
+    assert esperado["colaborador"].drop_duplicates().tolist()[-3:] == ["Álvaro", "Ângela", "érica"]
+    pd.testing.assert_frame_equal(fatiado, esperado)
+
+
+def test_agregado_fatiado_igual_ao_inteiro(app, monkeypatch):
+    ini, fim = DIAS[0], DIAS[-1]
+    esperado = app.armazenamento().relatorio_agregado(ini, fim, None, None)
+
+    monkeypatch.setattr(app, "RELATORIO_PARALELO", 2)
+    pd.testing.assert_frame_equal(app.relatorio_agregado(ini, fim).reset_index(drop=True), esperado)
+
+
+@pytest.mark.parametrize("formato", ["CSV", "Parquet", "Excel"])
+def test_exportacao_em_partes_igual_ao_arquivo_unico(app, formato):
+    ini, fim = DIAS[0], DIAS[-1]
+    ler = {"CSV": lambda b: pd.read_csv(io.BytesIO(b), encoding="utf-8-sig"),
+           "Parquet": lambda b: pd.read_parquet(io.BytesIO(b)),
+           "Excel": lambda b: pd.read_excel(io.BytesIO(b))}[formato]
+
+    arq, linhas, _ = app.exportar_em_arquivo(app.iterar_relatorio_em_lotes(ini, fim, lote=10), formato)
+    with arq:
+        esperado = ler(arq.read())
+
+    # limite menor que um lote: cada lote fecha uma parte, e nenhum lote se perde no corte
+    partes, linhas_partes, tamanho = app.exportar_em_partes(
+        app.iterar_relatorio_em_lotes(ini, fim, lote=10), formato, max_bytes=1)
+    try:
+        assert len(partes) == -(-linhas // 10) > 1
+        assert linhas_partes == linhas
+        dados = [arq.read() for arq in partes]
+    finally:
+        for arq in partes:
+            arq.close()
+    assert tamanho == sum(len(d) for d in dados)
+    pd.testing.assert_frame_equal(pd.concat([ler(d) for d in dados], ignore_index=True), esperado)